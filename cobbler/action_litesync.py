@@ -25,12 +25,115 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 
 import os
 import os.path
+import threading
 
 import utils
 import traceback
 import clogger
 import module_loader
 
+class MenuRebuilds:
+    """
+    Coalesces requests to rebuild the PXE menu, which renders an entry
+    for every profile and image.  Inside cobblerd a rebuild waits until
+    no further request has come in for pxe_menu_rebuild_delay seconds,
+    so a burst of edits rebuilds the menu once.  A rebuild requested
+    inside a batch (see BootAPI.begin_batch) is left until the batch
+    ends.  Use the one shared instance returned by menu_rebuilds().
+
+    A rebuild never runs in the middle of a sync (see sync_lock), nor
+    waits for one: it is left pending, and the sync does it once it is
+    done, see action_sync.BootSync.run.
+    """
+
+    def __init__(self, api):
+        self.api     = api
+        self.lock    = threading.RLock()
+        self.pxegen  = None
+        self.pending = False
+        self.timer   = None
+
+    def request(self, pxegen):
+        """
+        Mark the menu as needing a rebuild, using pxegen to do it.
+        """
+        self.lock.acquire()
+        try:
+            self.pxegen  = pxegen
+            self.pending = True
+            if utils.batch_depth(self.api) > 0:
+                return
+            delay = pxegen.settings.pxe_menu_rebuild_delay
+            now = not self.api.is_cobblerd or delay <= 0
+            if not now:
+                self.__cancel_timer()
+                self.timer = threading.Timer(delay, self.flush)
+                self.timer.setDaemon(True)
+                self.timer.start()
+        finally:
+            self.lock.release()
+        if now:
+            self.flush()
+
+    def flush(self):
+        """
+        Rebuild the menu now if a rebuild is pending, unless a sync is
+        running or the calling thread is in a batch.
+        """
+        sync = sync_lock(self.api)
+        if not sync.acquire(False):
+            return
+        try:
+            self.lock.acquire()
+            try:
+                self.__cancel_timer()
+                if not self.pending or utils.batch_depth(self.api) > 0:
+                    return
+                self.pending = False
+                pxegen = self.pxegen
+            finally:
+                self.lock.release()
+            try:
+                pxegen.make_pxe_menu()
+            except:
+                utils.log_exc(pxegen.logger)
+        finally:
+            sync.release()
+
+    def cancel(self):
+        """
+        Drop any pending rebuild, as a full sync rebuilds the menu anyway.
+        """
+        self.lock.acquire()
+        self.__cancel_timer()
+        self.pending = False
+        self.lock.release()
+
+    def __cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+def sync_lock(api):
+    """
+    The lock held by a sync for as long as it runs, kept on the
+    (shared) API handle.  Delayed menu rebuilds take it too (see
+    MenuRebuilds), so the two never write the same files at once.
+    """
+    lock = getattr(api, "sync_lock", None)
+    if lock is None:
+        lock = api.sync_lock = threading.RLock()
+    return lock
+
+def menu_rebuilds(api):
+    """
+    The MenuRebuilds queue, kept on the (shared) API handle.
+    """
+    queue = getattr(api, "menu_rebuilds", None)
+    if queue is None:
+        queue = api.menu_rebuilds = MenuRebuilds(api)
+    return queue
+
 class BootLiteSync:
     """
     Handles conversion of internal state to the tftpboot tree layout
@@ -57,6 +160,20 @@ class BootLiteSync:
         self.sync        = config.api.get_sync(verbose,logger=self.logger)
         self.sync.make_tftpboot()
 
+    def rebuild_menu(self):
+        menu_rebuilds(self.config.api).request(self.sync.pxegen)
+
+    def end_batch(self):
+        """
+        Catch up on what was deferred while a batch was running, see
+        BootAPI.begin_batch.
+        """
+        if self.settings.manage_dhcp:
+            self.sync.dhcp.regen_ethers()
+        if self.settings.manage_dns:
+            self.sync.dns.regen_hosts()
+        menu_rebuilds(self.config.api).flush()
+
     def add_single_distro(self, name):
         # get the distro record
         distro = self.distros.find(name=name)
@@ -73,7 +190,7 @@ class BootLiteSync:
         kids = distro.get_children()
         for k in kids:
             self.add_single_profile(k.name, rebuild_menu=False)    
-        self.sync.pxegen.make_pxe_menu()
+        self.rebuild_menu()
 
 
     def add_single_image(self, name):
@@ -82,7 +199,7 @@ class BootLiteSync:
         kids = image.get_children()
         for k in kids:
             self.add_single_system(k.name)
-        self.sync.pxegen.make_pxe_menu()
+        self.rebuild_menu()
 
     def remove_single_distro(self, name):
         bootloc = utils.tftpboot_location()
@@ -116,7 +233,7 @@ class BootLiteSync:
             else:
                 self.add_single_system(k.name)
         if rebuild_menu:
-            self.sync.pxegen.make_pxe_menu()
+            self.rebuild_menu()
         return True
          
     def remove_single_profile(self, name, rebuild_menu=True):
@@ -125,7 +242,7 @@ class BootLiteSync:
         # delete contents on kickstarts/$name directory in webdir
         utils.rmtree(os.path.join(self.settings.webdir, "kickstarts", name))
         if rebuild_menu:
-            self.sync.pxegen.make_pxe_menu()
+            self.rebuild_menu()
    
     def update_system_netboot_status(self,name):
         self.tftpd.update_netboot(name)
@@ -135,11 +252,11 @@ class BootLiteSync:
         system = self.systems.find(name=name)
         if system is None:
             return
-        # rebuild system_list file in webdir
+        # update this system's entries in /etc/ethers and such
         if self.settings.manage_dhcp:
-            self.sync.dhcp.regen_ethers() 
+            self.sync.dhcp.regen_ethers(system)
         if self.settings.manage_dns:
-            self.sync.dns.regen_hosts()  
+            self.sync.dns.regen_hosts(system)
         # write the PXE files for the system
         self.tftpd.add_single_system(system)
 
@@ -149,6 +266,11 @@ class BootLiteSync:
         # delete contents of kickstarts_sys/$name in webdir
         system_record = self.systems.find(name=name)
 
+        if self.settings.manage_dhcp:
+            self.sync.dhcp.regen_ethers(system_record, removed=True)
+        if self.settings.manage_dns:
+            self.sync.dns.regen_hosts(system_record, removed=True)
+
         itanic = False
         profile = self.profiles.find(name=system_record.profile)
         if profile is not None:
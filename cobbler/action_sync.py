@@ -27,6 +27,7 @@ import glob
 import shutil
 import time
 import yaml # Howell-Clark version
+import simplejson
 import sys
 import glob
 import traceback
@@ -35,6 +36,7 @@ import utils
 from cexceptions import *
 import templar 
 import pxegen
+import action_litesync
 import item_distro
 import item_profile
 import item_repo
@@ -44,12 +46,73 @@ import clogger
 from utils import _
 
 
+def cpu_time():
+    """
+    CPU time used by this process and the children it has waited for.
+    """
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+class SyncProfile:
+    """
+    Wall time, CPU time and the utils.SYNC_STATS counters for each
+    phase of a sync, as reported by "cobbler sync --profile".  Does
+    nothing unless enabled.
+    """
+
+    def __init__(self,api,enabled=False):
+        self.api     = api
+        self.enabled = enabled
+        self.phases  = []
+        self.current = None
+        self.state   = utils.sync_state(api)
+        if enabled:
+            self.state.stats = {}
+
+    def start(self,name):
+        """
+        End the current phase, if any, and start the named one.  Time
+        spent in a phase entered more than once is added up.
+        """
+        if not self.enabled:
+            return
+        self.stop()
+        self.current = (name, time.time(), cpu_time(), self.state.stats.copy())
+
+    def stop(self):
+        if self.current is None:
+            return
+        (name, wall, cpu, stats) = self.current
+        self.current = None
+        for phase in self.phases:
+            if phase["phase"] == name:
+                break
+        else:
+            phase = { "phase" : name, "wall_time" : 0.0, "cpu_time" : 0.0 }
+            for key in utils.SYNC_STATS:
+                phase[key] = 0
+            self.phases.append(phase)
+        phase["wall_time"] += time.time() - wall
+        phase["cpu_time"] += cpu_time() - cpu
+        for key in utils.SYNC_STATS:
+            phase[key] += self.state.stats.get(key, 0) - stats.get(key, 0)
+
+    def finish(self):
+        """
+        Stop profiling, returning the phases in the order they were
+        first entered.
+        """
+        self.stop()
+        if self.enabled:
+            self.state.stats = None
+        return self.phases
+
 class BootSync:
     """
     Handles conversion of internal state to the tftpboot tree layout
     """
 
-    def __init__(self,config,verbose=True,dhcp=None,dns=None,logger=None,tftpd=None):
+    def __init__(self,config,verbose=True,dhcp=None,dns=None,logger=None,tftpd=None,full=False,profile=False,dry_run=False):
         """
         Constructor
         """
@@ -59,6 +122,10 @@ class BootSync:
             self.logger     = clogger.Logger()
 
         self.verbose      = verbose
+        self.full         = full
+        self.profile_phases = profile
+        self.dry_run      = dry_run
+        self.report       = None
         self.config       = config
         self.api          = config.api
         self.distros      = config.distros()
@@ -93,10 +160,44 @@ class BootSync:
         if not os.path.exists(self.bootloc):
             utils.die(self.logger,"cannot find directory: %s" % self.bootloc)
 
-        self.logger.info("running pre-sync triggers")
+        # delayed PXE menu rebuilds are put off until this is done, as
+        # they write the same files
+        lock = action_litesync.sync_lock(self.api)
+        lock.acquire()
+        try:
+            rc = self.run_locked()
+        finally:
+            lock.release()
+        action_litesync.menu_rebuilds(self.api).flush()
+        return rc
+
+    def run_locked(self):
+        if self.dry_run:
+            # triggers restart services and may do anything else, so a
+            # dry run leaves them out, and plans an incremental sync
+            if self.full:
+                self.logger.info("a dry run plans an incremental sync, ignoring --full")
+                self.full = False
+            utils.sync_state(self.api).plan = { "added" : {}, "changed" : {}, "removed" : {} }
+
+        self.profiler = SyncProfile(self.api, self.profile_phases)
+        try:
+            self.run_phases()
+        finally:
+            phases = self.profiler.finish()
+            plan = utils.dry_run(self.api)
+            utils.sync_state(self.api).plan = None
+
+        self.report = self.make_report(phases, plan)
+        return True
+
+    def run_phases(self):
+        self.profiler.start("triggers")
+        if not self.dry_run:
+            self.logger.info("running pre-sync triggers")
 
-        # run pre-triggers...
-        utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/pre/*")
+            # run pre-triggers...
+            utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/pre/*")
 
         self.distros  = self.config.distros()
         self.profiles = self.config.profiles()
@@ -104,76 +205,211 @@ class BootSync:
         self.settings = self.config.settings()
         self.repos    = self.config.repos()
 
-        # execute the core of the sync operation
-        self.logger.info("cleaning trees")
+        # execute the core of the sync operation.  Only changed files
+        # are written, and files no longer generated are removed
+        # afterwards.  A full sync instead builds the boot configuration
+        # trees from scratch in a staging directory and swaps them in
+        # at the end, so clients never see them empty or half built.
+        self.profiler.start("clean_trees")
         self.clean_trees()
+        if self.full:
+            self.start_staging()
+            self.pxegen.forget_menu_fragments()
+            self.api.distro_link_fingerprints = {}
+        if not self.dry_run:
+            # this sync rebuilds the menu, so a pending lite sync rebuild
+            # can go (a dry run writes nothing, so it still has to happen)
+            action_litesync.menu_rebuilds(self.api).cancel()
+        utils.track_outputs(self.api)
+        utils.load_link_caches(self.api)
 
-        # Have the tftpd module handle copying bootloaders,
-        # distros, images, and all_system_files
-        self.tftpd.sync(self.verbose)
-        # Copy distros to the webdir
-        # Adding in the exception handling to not blow up if files have
-        # been moved (or the path references an NFS directory that's no longer
-        # mounted)
-	for d in self.distros:
-            try:
-                self.logger.info("copying files for distro: %s" % d.name)
-                self.pxegen.copy_single_distro_files(d,
-                                                     self.settings.webdir,True)
-            except CX, e:
-                self.logger.error(e.value)
-
-        # make the default pxe menu anyway...
-        self.pxegen.make_pxe_menu()
-
-        if self.settings.manage_dhcp:
-            self.logger.info("rendering DHCP files")
-            self.dhcp.write_dhcp_file()
-            self.dhcp.regen_ethers()
-        if self.settings.manage_dns:
-            self.logger.info("rendering DNS files")
-            self.dns.regen_hosts()
-            self.dns.write_dns_files()
-
-        if self.settings.manage_tftpd:
-           # xinetd.d/tftpd, basically
-           self.logger.info("rendering TFTPD files")
-           self.tftpd.write_tftpd_files()
-
+        try:
+            # Have the tftpd module handle copying bootloaders,
+            # distros, images, and all_system_files
+            self.profiler.start("tftpd.sync")
+            self.tftpd.sync(self.verbose)
+            # Copy distros to the webdir
+            # Adding in the exception handling to not blow up if files have
+            # been moved (or the path references an NFS directory that's no longer
+            # mounted)
+            self.profiler.start("distro copy")
+            for d in self.distros:
+                try:
+                    self.logger.info("copying files for distro: %s" % d.name)
+                    self.pxegen.copy_single_distro_files(d,
+                                                         self.settings.webdir,True)
+                except CX, e:
+                    self.logger.error(e.value)
+
+            # make the default pxe menu anyway...
+            self.profiler.start("pxe menu")
+            self.pxegen.make_pxe_menu()
+        finally:
+            self.profiler.start("link cache")
+            utils.save_link_caches(self.api)
+            outputs = utils.track_outputs(self.api, False)
+            staging = getattr(utils.sync_state(self.api), "staging", None)
+            utils.sync_state(self.api).staging = None
+
+        self.profiler.start("stale files")
+        skip = []
+        if self.full:
+            self.logger.info("swapping in rebuilt trees")
+            self.swap_staged(staging)
+            skip = staging.keys()
+        self.logger.info("removing stale files")
+        self.remove_stale_files(outputs, skip)
+
+        # the configuration files of the DHCP, DNS, TFTP and rsync
+        # services are tracked separately, as their fingerprints are
+        # compared with those of the last sync to tell the post-sync
+        # triggers which services need restarting
+        utils.track_outputs(self.api)
+        try:
+            if self.settings.manage_dhcp:
+                self.profiler.start("dhcp")
+                self.logger.info("rendering DHCP files")
+                self.dhcp.write_dhcp_file()
+                self.dhcp.regen_ethers()
+            if self.settings.manage_dns:
+                self.profiler.start("dns")
+                self.logger.info("rendering DNS files")
+                self.dns.regen_hosts()
+                self.dns.write_dns_files()
+
+            if self.settings.manage_tftpd:
+               # xinetd.d/tftpd, basically
+               self.profiler.start("tftpd files")
+               self.logger.info("rendering TFTPD files")
+               self.tftpd.write_tftpd_files()
+
+            self.profiler.start("rsync_gen")
+            self.logger.info("rendering Rsync files")
+            self.rsync_gen()
+        finally:
+            configs = utils.track_outputs(self.api, False)
+
+        self.profiler.start("link cache")
         self.logger.info("cleaning link caches")
         self.clean_link_cache()
+        self.profiler.stop()
+
+        if self.dry_run:
+            return
 
-        self.logger.info("rendering Rsync files")
-        self.rsync_gen()
+        (fingerprints, changed) = self.fingerprint_configs(configs)
+        utils.sync_state(self.api).changed_outputs = changed
+        if len(changed) > 0:
+            self.logger.info("changed configuration files: %s" % ", ".join(changed.keys()))
 
         # run post-triggers
+        self.profiler.start("triggers")
         self.logger.info("running post-sync triggers")
-        utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/post/*", logger=self.logger)
-        utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/change/*", logger=self.logger)
+        try:
+            utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/post/*", logger=self.logger)
+            utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/change/*", logger=self.logger)
+        finally:
+            utils.sync_state(self.api).changed_outputs = None
+        self.profiler.stop()
 
-        return True
+        # only once the triggers have succeeded (and restarted whatever
+        # needed it) are the changes considered dealt with
+        utils.write_if_changed(self.FINGERPRINTS, simplejson.dumps(fingerprints))
+
+    def make_report(self,phases,plan):
+        """
+        Log what was asked for by the profile and dry_run options, and
+        return it as a hash: the phases profiled (see SyncProfile) and
+        the files a dry run would have "added", "changed" and "removed",
+        each a sorted list of paths.
+        """
+        report = {}
+        if self.profile_phases:
+            report["phases"] = phases
+            for x in phases:
+                self.logger.info("phase %(phase)s: %(wall_time).2fs wall, %(cpu_time).2fs cpu, %(files_written)d files (%(bytes_written)d bytes) written, %(templates_rendered)d templates rendered, %(blender_calls)d blender calls" % x)
+        if plan is not None:
+            for change in [ "added", "changed", "removed" ]:
+                paths = plan[change].keys()
+                paths.sort()
+                report[change] = paths
+                for path in paths:
+                    self.logger.info("would be %s: %s" % (change, path))
+            self.logger.info("dry run: %s files would be added, %s changed and %s removed" % (len(report["added"]), len(report["changed"]), len(report["removed"])))
+        return report
+
+    # content fingerprints of the service configuration files as of
+    # the last sync, see fingerprint_configs
+    FINGERPRINTS = "/var/lib/cobbler/sync_fingerprints"
+
+    def fingerprint_configs(self,configs):
+        """
+        Fingerprint the configuration files written by this sync
+        (configs, a hash keyed by path), and compare with those of the
+        last sync.  Returns the new fingerprints, and the files that
+        changed or are no longer written, as a hash keyed by path.
+        These include changes made in between syncs, for instance to
+        /etc/ethers when a system is saved, as they still need the
+        service to be restarted.
+        """
+        try:
+            fd = open(self.FINGERPRINTS)
+            previous = simplejson.loads(fd.read())
+            fd.close()
+        except:
+            previous = {}
+        fingerprints = {}
+        changed = {}
+        for path in configs.keys():
+            fingerprints[path] = utils.file_fingerprint(path)
+            if previous.get(path, None) != fingerprints[path]:
+                changed[path] = 1
+        for path in previous.keys():
+            if not fingerprints.has_key(path):
+                changed[path] = 1
+        return (fingerprints, changed)
 
     def make_tftpboot(self):
         """
         Make directories for tftpboot images
         """
         if not os.path.exists(self.pxelinux_dir):
-            utils.mkdir(self.pxelinux_dir,logger=self.logger)
+            utils.mkdir(self.pxelinux_dir,logger=self.logger,api=self.api)
         if not os.path.exists(self.images_dir):
-            utils.mkdir(self.images_dir,logger=self.logger)
+            utils.mkdir(self.images_dir,logger=self.logger,api=self.api)
         if not os.path.exists(self.s390_dir):
-            utils.mkdir(self.s390_dir,logger=self.logger)
+            utils.mkdir(self.s390_dir,logger=self.logger,api=self.api)
         if not os.path.exists(self.rendered_dir):
-            utils.mkdir(self.rendered_dir,logger=self.logger)
+            utils.mkdir(self.rendered_dir,logger=self.logger,api=self.api)
         if not os.path.exists(self.yaboot_bin_dir):
-            utils.mkdir(self.yaboot_bin_dir,logger=self.logger)
+            utils.mkdir(self.yaboot_bin_dir,logger=self.logger,api=self.api)
         if not os.path.exists(self.yaboot_cfg_dir):
-            utils.mkdir(self.yaboot_cfg_dir,logger=self.logger)
+            utils.mkdir(self.yaboot_cfg_dir,logger=self.logger,api=self.api)
+
+    # webdir directories holding only what sync generates
+    WEBDIR_GENERATED = ["kickstarts","kickstarts_sys","images","systems","distros","profiles","repo_profile","repo_system","rendered"]
+
+    def generated_dirs(self):
+        """
+        The directories whose contents are entirely generated by sync.
+        """
+        dirs = [ self.pxelinux_dir, self.images_dir, self.s390_dir, self.yaboot_bin_dir, self.yaboot_cfg_dir, self.rendered_dir ]
+        for x in self.WEBDIR_GENERATED:
+            path = os.path.join(self.settings.webdir,x)
+            if os.path.isdir(path) and not path in dirs:
+                dirs.append(path)
+        return dirs
+
+    # tftp trees that a full sync builds from scratch in a staging
+    # directory and then swaps in, rather than emptying them in place
+    STAGED_DIRS = [ "pxelinux.cfg", "etc", "s390x", "ppc" ]
 
     def clean_trees(self):
         """
-        Delete any previously built pxelinux.cfg tree and virt tree info and then create
-        directories.
+        Delete anything in the webdir that sync does not manage, and
+        create the directories for the tftpboot trees.  The generated
+        trees themselves are updated in place and then pruned by
+        remove_stale_files, or rebuilt in staging by a full sync.
 
         Note: for SELinux reasons, some information goes in /tftpboot, some in /var/www/cobbler
         and some must be duplicated in both.  This is because PXE needs tftp, and auto-kickstart
@@ -182,33 +418,89 @@ class BootSync:
         a solution.  *Otherwise* duplication is minimal.
         """
 
-        # clean out parts of webdir and all of /tftpboot/images and /tftpboot/pxelinux.cfg
+        # clean out parts of webdir
         for x in os.listdir(self.settings.webdir):
             path = os.path.join(self.settings.webdir,x)
             if os.path.isfile(path):
                 if not x.endswith(".py"):
-                    utils.rmfile(path,logger=self.logger)
+                    utils.rmfile(path,logger=self.logger,api=self.api)
             if os.path.isdir(path):
                 if not x in ["aux", "web", "webui", "localmirror","repo_mirror","ks_mirror","images","links","repo_profile","repo_system","svc","rendered",".link_cache"] :
                     # delete directories that shouldn't exist
-                    utils.rmtree(path,logger=self.logger)
-                if x in ["kickstarts","kickstarts_sys","images","systems","distros","profiles","repo_profile","repo_system","rendered"]:
-                    # clean out directory contents
-                    utils.rmtree_contents(path,logger=self.logger)
+                    utils.rmtree(path,logger=self.logger,api=self.api)
         #
         self.make_tftpboot()
-        utils.rmtree_contents(self.pxelinux_dir,logger=self.logger)
-        utils.rmtree_contents(self.images_dir,logger=self.logger)
-        utils.rmtree_contents(self.s390_dir,logger=self.logger)
-        utils.rmtree_contents(self.yaboot_bin_dir,logger=self.logger)
-        utils.rmtree_contents(self.yaboot_cfg_dir,logger=self.logger)
-        utils.rmtree_contents(self.rendered_dir,logger=self.logger)
+
+    def start_staging(self):
+        """
+        Make empty staging directories for the STAGED_DIRS, and have
+        everything written under those trees go there instead (see
+        utils.staged_path) until swap_staged is called.  The staging
+        area lives inside the tftpboot directory, so it is on the same
+        filesystem and can be renamed into place.
+        """
+        self.staging_dir = os.path.join(self.bootloc, ".staging")
+        if os.path.exists(self.staging_dir):
+            # left over from a failed sync
+            utils.rmtree(self.staging_dir,logger=self.logger)
+        staging = {}
+        for x in self.STAGED_DIRS:
+            live  = os.path.join(self.bootloc, x)
+            stage = os.path.join(self.staging_dir, x)
+            utils.mkdir(stage,logger=self.logger)
+            os.chmod(stage, os.stat(live).st_mode & 07777)
+            staging[live] = stage
+        utils.sync_state(self.api).staging = staging
+
+    def swap_staged(self,staging):
+        """
+        Replace each live tree with its rebuilt copy, by renaming the
+        live one out of the way and the staged one into its place.
+        """
+        for (live, stage) in staging.iteritems():
+            old = "%s.old" % stage
+            os.rename(live, old)
+            os.rename(stage, live)
+        utils.rmtree(self.staging_dir,logger=self.logger)
+
+    def remove_stale_files(self,outputs,skip=[]):
+        """
+        Remove everything in the generated trees (other than those in
+        skip) that this sync did not produce (outputs, a hash keyed by
+        path) along with any directories left empty.  Files that lite
+        syncs wrote for systems still defined are produced again by
+        every sync, so only those of systems since removed or
+        renumbered (say pxelinux.cfg/01-<old mac>) go.
+        """
+        for top in self.generated_dirs():
+            if top in skip:
+                continue
+            for (root, dirs, files) in os.walk(top, topdown=True):
+                # linkfile's cache of kernels and initrds, see utils.cachefile
+                if ".link_cache" in dirs:
+                    dirs.remove(".link_cache")
+                for f in files:
+                    path = os.path.join(root, f)
+                    if not outputs.has_key(path):
+                        utils.rmfile(path,logger=self.logger,api=self.api)
+            for (root, dirs, files) in os.walk(top, topdown=False):
+                for d in dirs:
+                    path = os.path.join(root, d)
+                    if os.path.islink(path):
+                        if not outputs.has_key(path):
+                            utils.rmfile(path,logger=self.logger,api=self.api)
+                    elif len(os.listdir(path)) == 0 and not self.dry_run:
+                        self.logger.info("removing: %s" % path)
+                        os.rmdir(path)
 
     def clean_link_cache(self):
-        for dirtree in [self.bootloc, self.settings.webdir]:
-            cachedir = '%s/.link_cache'%dirtree
-            cmd = "find %s -maxdepth 1 -type f -links 1 -exec rm -f '{}' ';'"%cachedir
-            utils.subprocess_call(self.logger,cmd)
+        """
+        Remove the files in the link caches (see utils.cachefile) that
+        are no longer linked to from anywhere.  Those are kept next to
+        the directory holding the links, so in images/ for distro files.
+        """
+        for dirtree in [self.bootloc, self.images_dir, self.settings.webdir, os.path.join(self.settings.webdir, "images")]:
+            utils.sweep_link_cache(os.path.join(dirtree, ".link_cache"), api=self.api, logger=self.logger)
 
     def rsync_gen(self):
         """
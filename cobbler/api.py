@@ -26,6 +26,7 @@ import yaml
 import config
 import utils
 import action_sync
+import action_litesync
 import action_check
 import action_import
 import action_reposync
@@ -52,6 +53,7 @@ from utils import _
 
 import logging
 import time
+import threading
 import random
 import os
 import xmlrpclib
@@ -122,6 +124,10 @@ class BootAPI:
 
             BootAPI.__has_loaded   = True
 
+            # made here rather than on first use, where two threads
+            # could each make one, see utils.sync_state
+            self.thread_sync_state = threading.local()
+
             module_loader.load_modules()
 
             self._config         = config.Config(self)
@@ -389,9 +395,9 @@ class BootAPI:
 
     # ==========================================================================
 
-    def add_item(self, what, ref, check_for_duplicate_names=False, save=True,logger=None):
+    def add_item(self, what, ref, check_for_duplicate_names=False, check_for_duplicate_netinfo=False, save=True,logger=None):
         self.log("add_item(%s)"%what,[ref.name])
-        return self.get_items(what).add(ref,check_for_duplicate_names=check_for_duplicate_names,save=save,logger=logger)
+        return self.get_items(what).add(ref,check_for_duplicate_names=check_for_duplicate_names,check_for_duplicate_netinfo=check_for_duplicate_netinfo,save=save,logger=logger)
 
     def add_distro(self, ref, check_for_duplicate_names=False, save=True, logger=None):
         return self.add_item("distro", ref, check_for_duplicate_names=check_for_duplicate_names, save=save,logger=logger)
@@ -400,7 +406,7 @@ class BootAPI:
         return self.add_item("profile", ref, check_for_duplicate_names=check_for_duplicate_names, save=save,logger=logger)
 
     def add_system(self, ref, check_for_duplicate_names=False, check_for_duplicate_netinfo=False, save=True, logger=None):
-        return self.add_item("system", ref, check_for_duplicate_names=check_for_duplicate_names, save=save,logger=logger)
+        return self.add_item("system", ref, check_for_duplicate_names=check_for_duplicate_names, check_for_duplicate_netinfo=check_for_duplicate_netinfo, save=save,logger=logger)
 
     def add_repo(self, ref, check_for_duplicate_names=False,save=True,logger=None):
         return self.add_item("repo", ref, check_for_duplicate_names=check_for_duplicate_names, save=save,logger=logger)
@@ -598,20 +604,59 @@ class BootAPI:
 
     # ==========================================================================
 
-    def sync(self,verbose=False, logger=None):
+    def begin_batch(self):
+        """
+        Start a bulk operation, such as adding many systems.  Until the
+        matching end_batch(), the work the API does after every change
+        to keep generated files up to date (rewriting /etc/ethers for
+        dnsmasq, rebuilding the PXE menu) is deferred, so that it is
+        done once for the whole batch.  Batches may be nested, and
+        belong to the calling thread (see utils.batch_depth).  Always
+        end them in a finally clause, so an error does not leave the
+        thread stuck in the batch:
+
+            api.begin_batch()
+            try:
+                ...
+            finally:
+                api.end_batch()
+        """
+        utils.sync_state(self).batch_depth = utils.batch_depth(self) + 1
+
+    def end_batch(self, logger=None):
+        """
+        Finish a bulk operation started with begin_batch().
+        """
+        depth = utils.batch_depth(self) - 1
+        utils.sync_state(self).batch_depth = depth
+        if depth == 0:
+            action_litesync.BootLiteSync(self._config, logger=logger).end_batch()
+
+    # ==========================================================================
+
+    def sync(self,verbose=False, logger=None, full=False, profile=False, dry_run=False):
         """
         Take the values currently written to the configuration files in
         /etc, and /var, and build out the information tree found in
         /tftpboot.  Any operations done in the API that have not been
         saved with serialize() will NOT be synchronized with this command.
+        Only files whose content changed are rewritten, unless full is
+        set, in which case the trees are emptied and rebuilt.
+        With profile, each phase of the sync is timed, and with dry_run
+        nothing is written, only the files that would change are found.
+        Either way what was found is logged and returned as a hash, see
+        action_sync.BootSync.make_report.
         """
         self.log("sync")
-        sync = self.get_sync(verbose=verbose, logger=logger)
-        return sync.run()
+        sync = self.get_sync(verbose=verbose, logger=logger, full=full, profile=profile, dry_run=dry_run)
+        rc = sync.run()
+        if profile or dry_run:
+            return sync.report
+        return rc
 
     # ==========================================================================
 
-    def get_sync(self,verbose=False,logger=None):
+    def get_sync(self,verbose=False,logger=None,full=False,profile=False,dry_run=False):
         self.dhcp = self.get_module_from_file(
            "dhcp",
            "module",
@@ -628,7 +673,7 @@ class BootAPI:
            "in_tftpd",
         ).get_manager(self._config,logger)
 
-        return action_sync.BootSync(self._config,dhcp=self.dhcp,dns=self.dns,tftpd=self.tftpd,verbose=verbose,logger=logger)
+        return action_sync.BootSync(self._config,dhcp=self.dhcp,dns=self.dns,tftpd=self.tftpd,verbose=verbose,logger=logger,full=full,profile=profile,dry_run=dry_run)
 
     # ==========================================================================
 
@@ -661,7 +706,11 @@ class BootAPI:
         importer = action_import.Importer(
             self, self._config, mirror_url, mirror_name, network_root, kickstart_file, rsync_flags, arch, breed, os_version, logger=logger
         )
-        return importer.run()
+        self.begin_batch()
+        try:
+            return importer.run()
+        finally:
+            self.end_batch(logger=logger)
 
     # ==========================================================================
 
@@ -770,21 +819,41 @@ class BootAPI:
 
     # ==========================================================================
 
+    def reserialize(self, logger=None):
+        """
+        Rewrite every object in the current storage format and layout,
+        ex: after changing serializer_shard_depth.  Each collection is
+        rewritten in one go under its own lock, so other processes only
+        wait for the collection being rewritten.
+        """
+        if logger is None:
+            logger = self.logger
+        for collection in [ self.distros(), self.repos(), self.profiles(), self.images(), self.systems() ]:
+            self._config.serialize_collection(collection)
+            logger.info("reserialized %s %ss" % (len(collection), collection.collection_type()))
+        return True
+
+    # ==========================================================================
+
     def replicate(self, cobbler_master = None, distro_patterns="", profile_patterns="", system_patterns="", repo_patterns="", image_patterns="", prune=False, omit_data=False, logger=None):
         """
         Pull down data/configs from a remote cobbler server that is a master to this server.
         """
         replicator = action_replicate.Replicate(self._config, logger=logger)
-        return replicator.run(
-              cobbler_master   = cobbler_master,
-              distro_patterns  = distro_patterns,
-              profile_patterns = profile_patterns,
-              system_patterns  = system_patterns,
-              repo_patterns    = repo_patterns,
-              image_patterns   = image_patterns,
-              prune            = prune,
-              omit_data        = omit_data
-        )
+        self.begin_batch()
+        try:
+            return replicator.run(
+                  cobbler_master   = cobbler_master,
+                  distro_patterns  = distro_patterns,
+                  profile_patterns = profile_patterns,
+                  system_patterns  = system_patterns,
+                  repo_patterns    = repo_patterns,
+                  image_patterns   = image_patterns,
+                  prune            = prune,
+                  omit_data        = omit_data
+            )
+        finally:
+            self.end_batch(logger=logger)
 
     # ==========================================================================
 
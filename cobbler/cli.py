@@ -401,8 +401,11 @@ class BootCLI:
                 print "No configuration problems found.  All systems go."
                 
         elif action_name == "sync":
-            (options, args) = self.parser.parse_args()
             self.parser.add_option("--verbose", dest="verbose", action="store_true", help="run sync with more output")
+            self.parser.add_option("--full",    dest="full",    action="store_true", help="rebuild the boot configuration trees from scratch instead of updating only what changed")
+            self.parser.add_option("--profile", dest="profile", action="store_true", help="report the time taken and files written by each phase of the sync")
+            self.parser.add_option("--dry-run", dest="dry_run", action="store_true", help="report the files that would be added, changed or removed, without changing anything")
+            (options, args) = self.parser.parse_args()
             task_id = self.start_task("sync",options)
         elif action_name == "report":
             (options, args) = self.parser.parse_args()
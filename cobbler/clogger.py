@@ -85,5 +85,36 @@ class Logger:
    def close(self):
       self.logfile.close()
 
+class BufferLogger:
+   """
+   A Logger that keeps messages in memory, so a worker process
+   can hand them back to be written to the real log in one piece.
+   """
+
+   def __init__(self):
+      self.messages = []
+
+   def warning(self, msg):
+      self.messages.append(("warning", msg))
+
+   def error(self, msg):
+      self.messages.append(("error", msg))
+
+   def debug(self, msg):
+      self.messages.append(("debug", msg))
+
+   def info(self, msg):
+      self.messages.append(("info", msg))
+
+   def flat(self, msg):
+      self.messages.append(("flat", msg))
+
+   def replay(self, logger):
+      """
+      Write the messages kept to another logger.
+      """
+      for (level, msg) in self.messages:
+         getattr(logger, level)(msg)
+
 
  
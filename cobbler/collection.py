@@ -27,6 +27,8 @@ import glob
 import time
 import random
 
+import query
+
 import action_litesync
 import item_system
 import item_profile
@@ -37,6 +39,9 @@ from utils import _
 
 class Collection:
 
+    # fields with a lookup index, see index()
+    INDEXED_FIELDS = []
+
     def __init__(self,config):
         """
         Constructor.
@@ -45,6 +50,9 @@ class Collection:
         self.clear()
         self.api = self.config.api
         self.lite_sync = None
+        # while deserializing, the graph is built once at the end
+        # (see Config.rebuild_graph) rather than as each object is added
+        self.loading = False
 
     def factory_produce(self,config,seed_data):
         """
@@ -59,6 +67,19 @@ class Collection:
         """
         self.listing = {}
 
+    def index(self, ref):
+        """
+        Record ref in any lookup indexes the collection keeps, replacing
+        what was recorded for it before.  Called along with Config.link.
+        """
+        pass
+
+    def unindex(self, ref):
+        """
+        Drop ref from any lookup indexes the collection keeps.
+        """
+        pass
+
     def get(self, name):
         """
         Return object with name in the collection
@@ -89,9 +110,27 @@ class Collection:
         if len(kargs) == 1 and kargs.has_key("name") and not return_list:
             return self.listing.get(kargs["name"].lower(), None)
 
-        for (name, obj) in self.listing.iteritems():
-            if obj.find_match(kargs, no_errors=no_errors):
+        # parse the criteria once, not once per object searched
+        q = query.Query(kargs)
+
+        # an exact name narrows the search to at most one object, and an
+        # exact value for an indexed field to those using that value
+        candidates = None
+        if q.exact.has_key("name"):
+            candidates = [ self.listing.get(q.exact["name"], None) ]
+        else:
+            for field in self.INDEXED_FIELDS:
+                if q.exact.has_key(field):
+                    candidates = self.find_by_interface(field, q.exact[field])
+                    break
+        if candidates is None:
+            candidates = self.listing.itervalues()
+
+        for obj in candidates:
+            if obj is not None and q.match(obj):
                 matches.append(obj)
+                if not return_list:
+                    break
 
         if not return_list:
             if len(matches) == 0:
@@ -147,9 +186,13 @@ class Collection:
     def from_datastruct(self,datastruct):
         if datastruct is None:
             return
-        for seed_data in datastruct:
-            item = self.factory_produce(self.config,seed_data)
-            self.add(item)
+        self.loading = True
+        try:
+            for seed_data in datastruct:
+                item = self.factory_produce(self.config,seed_data)
+                self.add(item)
+        finally:
+            self.loading = False
 
     def copy(self,ref,newname,logger=None): 
         ref       = ref.make_clone()
@@ -184,19 +227,32 @@ class Collection:
 
         # now descend to any direct ancestors and point them at the new object allowing
         # the original object to be removed without orphanage.  Direct ancestors
-        # will either be profiles or systems.  Note that we do have to care as
+        # will either be profiles or systems (or, for repos, profiles using the repo).  Note that we do have to care as
         # set_parent is only really meaningful for subprofiles. We ideally want a more
         # generic set_parent.
         kids = ref.get_children()
         for k in kids:
             if k.COLLECTION_TYPE == "distro":
                raise CX(_("internal error, not expected to have distro child objects"))
+            elif k.COLLECTION_TYPE == "profile" and ref.COLLECTION_TYPE == "repo":
+               # profiles depend on repos by listing them
+               repos = []
+               for r in k.repos:
+                  if r == oldname:
+                     repos.append(newname)
+                  else:
+                     repos.append(r)
+               k.set_repos(repos, bypass_check=True)
+               self.api.profiles().add(k, save=True, with_sync=with_sync, with_triggers=with_triggers)
             elif k.COLLECTION_TYPE == "profile":
                if k.parent != "":
                   k.set_parent(newname)
                else:
                   k.set_distro(newname)
                self.api.profiles().add(k, save=True, with_sync=with_sync, with_triggers=with_triggers)
+            elif k.COLLECTION_TYPE == "system" and ref.COLLECTION_TYPE == "image":
+               k.set_image(newname)
+               self.api.systems().add(k, save=True, with_sync=with_sync, with_triggers=with_triggers)
             elif k.COLLECTION_TYPE == "system":
                k.set_profile(newname)
                self.api.systems().add(k, save=True, with_sync=with_sync, with_triggers=with_triggers)
@@ -264,9 +320,18 @@ class Collection:
         if ref.COLLECTION_TYPE != self.collection_type():
             raise CX(_("API error: storing wrong data type in collection"))
 
+        # replacing an object with a different one of the same name:
+        # the objects that depended on the old one now depend on this one
+        old = self.listing.get(ref.name.lower(), None)
+        if old is not None and old is not ref:
+            self.config.unlink(old)
+            ref.children.update(old.children)
+
         if not save:
             # don't need to run triggers, so add it already ...
             self.listing[ref.name.lower()] = ref
+            if not self.loading:
+                self.config.link(ref)
 
         # perform filesystem operations
         if save:
@@ -274,6 +339,9 @@ class Collection:
             if with_triggers:
                 utils.run_triggers(self.api, ref,"/var/lib/cobbler/triggers/add/%s/pre/*" % self.collection_type(), [], logger)
             self.listing[ref.name.lower()] = ref
+            # update the dependency graph first, as lite sync and the
+            # triggers look up parents and children through it
+            self.config.link(ref)
 
             # save just this item if possible, if not, save
             # the whole collection
@@ -300,15 +368,28 @@ class Collection:
             if with_triggers:
                 utils.run_triggers(self.api, ref, "/var/lib/cobbler/triggers/change/*", [], logger)
                 utils.run_triggers(self.api, ref,"/var/lib/cobbler/triggers/add/%s/post/*" % self.collection_type(), [], logger)
-    
-    
-        # update children cache in parent object
-        parent = ref.get_parent()
-        if parent != None:
-            parent.children[ref.name] = ref
+
+        if not with_sync and isinstance(ref, item_system.System):
+            # the cached dnsmasq host tables did not see this change,
+            # see manage_dnsmasq.DnsmasqManager.__regen
+            self.api.dnsmasq_tables = None
 
         return True
 
+    def forget(self,name):
+        """
+        Drop an object from the in-memory collection only, without
+        touching storage or running triggers or sync.  Used when another
+        process has already removed or replaced the object on disk.
+        Returns the object dropped, if any.
+        """
+        ref = self.listing.get(name.lower(), None)
+        if ref is None:
+            return None
+        del self.listing[name.lower()]
+        self.config.unlink(ref)
+        return ref
+
     def __duplication_checks(self,ref,check_for_duplicate_names,check_for_duplicate_netinfo):
         """
         Prevents adding objects with the same name.
@@ -340,32 +421,24 @@ class Collection:
             return
        
         if isinstance(ref, item_system.System):
+           settings = self.api.settings()
            for (name, intf) in ref.interfaces.iteritems():
-               match_ip    = []
-               match_mac   = []
-               match_hosts = []
-               input_mac   = intf["mac_address"] 
-               input_ip    = intf["ip_address"]
-               input_dns   = intf["dns_name"]
-               if not self.api.settings().allow_duplicate_macs and input_mac is not None and input_mac != "":
-                   match_mac = self.api.find_system(mac_address=input_mac,return_list=True)   
-               if not self.api.settings().allow_duplicate_ips and input_ip is not None and input_ip != "":
-                   match_ip  = self.api.find_system(ip_address=input_ip,return_list=True) 
+               checks = []
+               if not settings.allow_duplicate_macs:
+                   checks.append(("mac_address", _("The MAC address")))
+               if not settings.allow_duplicate_ips:
+                   checks.append(("ip_address", _("The IP address")))
+               if not settings.allow_duplicate_hostnames:
+                   checks.append(("dns_name", _("The dns name")))
                # it's ok to conflict with your own net info.
+               for (field, desc) in checks:
+                   value = intf[field]
+                   if value is None or value == "":
+                       continue
+                   for x in self.find_by_interface(field, value):
+                       if x.name != ref.name:
+                           raise CX(_("Can't save system %s. %s (%s) is already used by system %s (%s)") % (ref.name, desc, value, x.name, name))
 
-               if not self.api.settings().allow_duplicate_hostnames and input_dns is not None and input_dns != "":
-                   match_hosts = self.api.find_system(dns_name=input_dns,return_list=True)
-
-               for x in match_mac:
-                   if x.name != ref.name:
-                       raise CX(_("Can't save system %s. The MAC address (%s) is already used by system %s (%s)") % (ref.name, intf["mac_address"], x.name, name))
-               for x in match_ip:
-                   if x.name != ref.name:
-                       raise CX(_("Can't save system %s. The IP address (%s) is already used by system %s (%s)") % (ref.name, intf["ip_address"], x.name, name))
-               for x in match_hosts:
-                   if x.name != ref.name:
-                       raise CX(_("Can't save system %s.  The dns name (%s) is already used by system %s (%s)") % (ref.name, intf["dns_name"], x.name, name))
- 
     def printable(self):
         """
         Creates a printable representation of the collection suitable
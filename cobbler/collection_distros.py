@@ -47,14 +47,13 @@ class Distros(collection.Collection):
         """
         name = name.lower()
 
-        # first see if any Groups use this distro
-        if not recursive:
-            for v in self.config.profiles():
-                if v.distro.lower() == name:
-                    raise CX(_("removal would orphan profile: %s") % v.name)
-
         obj = self.find(name=name)
 
+        # first see if any Groups use this distro
+        if not recursive and obj is not None:
+            for v in obj.get_children():
+                raise CX(_("removal would orphan profile: %s") % v.name)
+
         if obj is not None:
             kernel = obj.kernel
             if recursive:
@@ -69,6 +68,7 @@ class Distros(collection.Collection):
                     lite_sync = action_litesync.BootLiteSync(self.config, logger=logger)
                     lite_sync.remove_single_distro(name)
             del self.listing[name]
+            self.config.unlink(obj)
 
             self.config.serialize_delete(self, obj)
 
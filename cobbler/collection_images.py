@@ -43,14 +43,13 @@ class Images(collection.Collection):
 
         name = name.lower()
 
-        # first see if any Groups use this distro
-        if not recursive:
-            for v in self.config.systems():
-                if v.image is not None and v.image.lower() == name:
-                    raise CX(_("removal would orphan system: %s") % v.name)
-
         obj = self.find(name=name)
 
+        # first see if any Groups use this distro
+        if not recursive and obj is not None:
+            for v in obj.get_children():
+                raise CX(_("removal would orphan system: %s") % v.name)
+
         if obj is not None:
 
             if recursive:
@@ -66,6 +65,7 @@ class Images(collection.Collection):
                     lite_sync.remove_single_image(name)
 
             del self.listing[name]
+            self.config.unlink(obj)
             self.config.serialize_delete(self, obj)
 
             if with_delete:
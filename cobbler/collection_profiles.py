@@ -50,12 +50,12 @@ class Profiles(collection.Collection):
 
         name = name.lower()
 
-        if not recursive:
-            for v in self.config.systems():
-                if v.profile is not None and v.profile.lower() == name:
-                    raise CX(_("removal would orphan system: %s") % v.name)
-
         obj = self.find(name=name)
+
+        if not recursive and obj is not None:
+            for v in obj.get_children():
+                if v.COLLECTION_TYPE == "system":
+                    raise CX(_("removal would orphan system: %s") % v.name)
         if obj is not None:
             if recursive:
                 kids = obj.get_children()
@@ -69,6 +69,7 @@ class Profiles(collection.Collection):
                 if with_triggers: 
                     utils.run_triggers(self.config.api, obj, "/var/lib/cobbler/triggers/delete/profile/pre/*", [], logger)
             del self.listing[name]
+            self.config.unlink(obj)
             self.config.serialize_delete(self, obj)
             if with_delete:
                 if with_triggers: 
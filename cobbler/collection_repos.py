@@ -59,6 +59,7 @@ class Repos(collection.Collection):
                     utils.run_triggers(self.config.api, obj, "/var/lib/cobbler/triggers/delete/repo/pre/*", [], logger)
 
             del self.listing[name]
+            self.config.unlink(obj)
             self.config.serialize_delete(self, obj)
 
             if with_delete:
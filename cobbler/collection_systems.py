@@ -41,6 +41,62 @@ class Systems(collection.Collection):
         """
         return system.System(config).from_datastruct(seed_data)
 
+    # interface fields with a lookup index, for the duplicate checks
+    INDEXED_FIELDS = [ "mac_address", "ip_address", "dns_name" ]
+
+    def clear(self):
+        collection.Collection.clear(self)
+        # field -> lowercased value -> names of systems using it
+        self.indexes = {}
+        for field in self.INDEXED_FIELDS:
+            self.indexes[field] = {}
+        # system name -> (field, value) pairs recorded for it
+        self.indexed = {}
+
+    def index(self, ref):
+        self.unindex(ref)
+        name = ref.name.lower()
+        recorded = []
+        for intf in ref.interfaces.itervalues():
+            for field in self.INDEXED_FIELDS:
+                value = intf.get(field, None)
+                if value is None or value == "":
+                    continue
+                value = value.lower()
+                self.indexes[field].setdefault(value, {})[name] = 1
+                recorded.append((field, value))
+        self.indexed[name] = recorded
+
+    def unindex(self, ref):
+        name = ref.name.lower()
+        for (field, value) in self.indexed.pop(name, []):
+            names = self.indexes[field].get(value, None)
+            if names is not None:
+                names.pop(name, None)
+                if len(names) == 0:
+                    del self.indexes[field][value]
+
+    def find_by_interface(self, field, value):
+        """
+        Return the systems with an interface whose field (one of
+        INDEXED_FIELDS) equals value, ignoring case, without scanning
+        the whole collection.
+        """
+        value = value.lower()
+        results = []
+        for name in self.indexes[field].get(value, {}).keys():
+            obj = self.listing.get(name, None)
+            if obj is None:
+                continue
+            # the index holds what was last saved, so confirm against
+            # the object itself in case it has been edited since
+            for intf in obj.interfaces.itervalues():
+                data = intf.get(field, None)
+                if data is not None and data.lower() == value:
+                    results.append(obj)
+                    break
+        return results
+
     def remove(self,name,with_delete=True,with_sync=True,with_triggers=True,recursive=False, logger=None):
         """
         Remove element named 'name' from the collection
@@ -57,6 +113,10 @@ class Systems(collection.Collection):
                     lite_sync = action_litesync.BootLiteSync(self.config, logger=logger)
                     lite_sync.remove_single_system(name)
             del self.listing[name]
+            if not (with_delete and with_sync):
+                # lite sync did not update the cached dnsmasq host tables
+                self.config.api.dnsmasq_tables = None
+            self.config.unlink(obj)
             self.config.serialize_delete(self, obj)
             if with_delete:
                 if with_triggers: 
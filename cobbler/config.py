@@ -70,6 +70,7 @@ class Config:
 
        self.init_time     = time.time()
        self.current_id    = 0
+       self.generation    = 0
        self.api           = api
        self._distros      = distros.Distros(weakref.proxy(self))
        self._repos        = repos.Repos(weakref.proxy(self))
@@ -88,6 +89,68 @@ class Config:
        data = "%s%s" % (time.time(), random.uniform(1,9999999))
        return binascii.b2a_base64(data).replace("=","").strip()
        
+   def tree_changed(self):
+       """
+       Called whenever objects are added, removed or re-parented, so
+       that items discard the parent objects they have cached.
+       """
+       self.generation = self.generation + 1
+
+   # the dependency graph:  each object's children dict holds the objects
+   # that depend on it (distro -> profiles -> subprofiles -> systems,
+   # image -> systems, repo -> profiles), and its depends_on list names
+   # the objects it is filed under, so it can be moved or removed again
+   # without searching.
+
+   def link(self, item):
+       """
+       File item under the objects it depends on, replacing wherever it
+       was filed before.  Called whenever an object is added or saved.
+       """
+       self.__detach(item)
+       depends_on = []
+       parent = item.get_parent()
+       if parent is not None:
+           depends_on.append(parent)
+       if item.COLLECTION_TYPE == "profile" and type(item.repos) == list:
+           for r in item.repos:
+               repo = self._repos.find(name=r)
+               if repo is not None:
+                   depends_on.append(repo)
+       for dep in depends_on:
+           dep.children[item.name] = item
+           item.depends_on.append((dep.COLLECTION_TYPE, dep.name))
+       self.get_items(item.COLLECTION_TYPE).index(item)
+
+   def unlink(self, item):
+       """
+       Remove item from the dependency graph when it leaves its collection.
+       """
+       self.__detach(item)
+       self.get_items(item.COLLECTION_TYPE).unindex(item)
+       self.tree_changed()
+
+   def __detach(self, item):
+       for (ctype, name) in item.depends_on:
+           dep = self.get_items(ctype).get(name)
+           if dep is not None and dep.children.get(item.name, None) is item:
+               del dep.children[item.name]
+       item.depends_on = []
+
+   def rebuild_graph(self):
+       """
+       Build the dependency graph from scratch, after loading everything
+       so the order objects were loaded in does not matter.
+       """
+       collections = [ self._distros, self._repos, self._profiles, self._images, self._systems ]
+       for collection in collections:
+           for item in collection:
+               item.children = {}
+               item.depends_on = []
+       for collection in collections:
+           for item in collection:
+               self.link(item)
+
    def __cmp(self,a,b):
        return cmp(a.name,b.name)
 
@@ -180,6 +243,12 @@ class Config:
        serializer.serialize(self._systems)
        return True
 
+   def serialize_collection(self,collection):
+       """
+       Save every item in one collection, in one go.
+       """
+       return serializer.serialize(collection)
+
    def serialize_item(self,collection,item):
        """
        Save item in the collection, resaving the whole collection if needed,
@@ -208,6 +277,7 @@ class Config:
        serializer.deserialize(self._profiles)
        serializer.deserialize(self._images)
        serializer.deserialize(self._systems)
+       self.rebuild_graph()
        return True
 
    def deserialize_raw(self,collection_type):
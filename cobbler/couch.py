@@ -1,12 +1,14 @@
 
 import httplib, simplejson  # http://cheeseshop.python.org/pypi/simplejson
                             # Here only used for prettyprinting
+import socket
+import threading
 
 def prettyPrint(s):
-    """Prettyprints the json response of an HTTPResponse object"""
+    """Prettyprints the json body of a response"""
 
-    # HTTPResponse instance -> Python object -> str
-    print simplejson.dumps(simplejson.loads(s.read()), sort_keys=True, indent=4)
+    # str -> Python object -> str
+    print simplejson.dumps(simplejson.loads(s), sort_keys=True, indent=4)
 
 class Couch:
     """Basic wrapper class for operations on a couchDB"""
@@ -14,88 +16,137 @@ class Couch:
     def __init__(self, host, port=5984, options=None):
         self.host = host
         self.port = port
+        self.conn = None
+        # the connection carries one request at a time, see request()
+        self.lock = threading.Lock()
 
     def connect(self):
-        return httplib.HTTPConnection(self.host, self.port) # No close()
+        """
+        Returns the connection to the server, which is kept open and
+        reused (HTTP/1.1 keep-alive) across requests.
+        """
+        if self.conn is None:
+            self.conn = httplib.HTTPConnection(self.host, self.port)
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
 
     # Database operations
 
     def createDb(self, dbName):
         """Creates a new database on the server"""
 
-        r = self.put(''.join(['/',dbName,'/']), "")
-        return r.read()
+        return self.put(''.join(['/',dbName,'/']), "")
 
     def deleteDb(self, dbName):
         """Deletes the database on the server"""
 
-        r = self.delete(''.join(['/',dbName,'/']))
-        return r.read()
+        return self.delete(''.join(['/',dbName,'/']))
 
     def listDb(self):
         """List the databases on the server"""
 
-        r = self.get('/_all_dbs')
-        return r.read()
+        return self.get('/_all_dbs')
 
     def infoDb(self, dbName):
         """Returns info about the couchDB"""
-        r = self.get(''.join(['/', dbName, '/']))
-        return r.read()
+        return self.get(''.join(['/', dbName, '/']))
 
     # Document operations
 
-    def listDoc(self, dbName):
-        """List all documents in a given database"""
+    def listDoc(self, dbName, include_docs=False):
+        """List all documents in a given database, optionally with
+        their contents, in a single request"""
 
-        r = self.get(''.join(['/', dbName, '/', '_all_docs']))
-        return r.read()
+        uri = ''.join(['/', dbName, '/', '_all_docs'])
+        if include_docs:
+            uri = uri + "?include_docs=true"
+        return self.get(uri)
+
+    def bulkDocs(self, dbName, body):
+        """Create/update many documents in one request, body is
+        a JSON object with a "docs" list"""
+
+        return self.post(''.join(['/', dbName, '/', '_bulk_docs']), body)
 
     def openDoc(self, dbName, docId):
         """Open a document in a given database"""
-        r = self.get(''.join(['/', dbName, '/', docId,]))
-        return r.read()
+        return self.get(''.join(['/', dbName, '/', docId,]))
 
     def saveDoc(self, dbName, body, docId=None):
         """Save/create a document to/in a given database"""
         if docId:
-            r = self.put(''.join(['/', dbName, '/', docId]), body)
+            return self.put(''.join(['/', dbName, '/', docId]), body)
         else:
-            r = self.post(''.join(['/', dbName, '/']), body)
-        return r.read()
+            return self.post(''.join(['/', dbName, '/']), body)
 
-    def deleteDoc(self, dbName, docId):
-        # XXX Crashed if resource is non-existent; not so for DELETE on db. Bug?
-        # XXX Does not work any more, on has to specify an revid 
-        #     Either do html head to get the recten revid or provide it as parameter
-        r = self.delete(''.join(['/', dbName, '/', docId]))
-        return r.read()
+    def deleteDoc(self, dbName, docId, rev=None):
+        """Delete a document, couchdb requires the current revision"""
+        uri = ''.join(['/', dbName, '/', docId])
+        if rev:
+            uri = ''.join([uri, '?rev=', rev])
+        return self.delete(uri)
 
     # Basic http methods
+    #
+    # Each returns the body of the response.
+
+    # methods that may be sent again without knowing whether the
+    # server got them the first time
+    IDEMPOTENT = [ "GET", "HEAD" ]
+
+    def request(self, method, uri, body=None, headers={}):
+        """
+        Issue a request on the persistent connection and read the
+        response, holding the lock so that threads sharing this object
+        take turns.  If the server has dropped a reused connection,
+        the request is made again on a new one, but only if it cannot
+        have reached the server the first time (it could not be sent)
+        or is IDEMPOTENT: resending a bulk save that did get through
+        would report conflicts for every document.
+        """
+        self.lock.acquire()
+        try:
+            reused = self.conn is not None
+            try:
+                return self.__request(method, uri, body, headers)
+            except (httplib.HTTPException, socket.error), e:
+                self.close()
+                if not reused:
+                    raise
+                if not (getattr(e, "unsent", False) or method in self.IDEMPOTENT):
+                    raise
+                return self.__request(method, uri, body, headers)
+        finally:
+            self.lock.release()
+
+    def __request(self, method, uri, body, headers):
+        c = self.connect()
+        try:
+            c.request(method, uri, body, headers)
+        except (httplib.HTTPException, socket.error), e:
+            e.unsent = True
+            raise
+        return c.getresponse().read()
 
     def get(self, uri):
-        c = self.connect()
         headers = {"Accept": "application/json"}
-        c.request("GET", uri, None, headers)
-        return c.getresponse()
+        return self.request("GET", uri, None, headers)
 
     def post(self, uri, body):
-        c = self.connect()
         headers = {"Content-type": "application/json"}
-        c.request('POST', uri, body, headers)
-        return c.getresponse()
+        return self.request('POST', uri, body, headers)
 
     def put(self, uri, body):
-        c = self.connect()
         if len(body) > 0:
             headers = {"Content-type": "application/json"}
-            c.request("PUT", uri, body, headers)
+            return self.request("PUT", uri, body, headers)
         else:
-            c.request("PUT", uri, body)
-        return c.getresponse()
+            return self.request("PUT", uri, body)
 
     def delete(self, uri):
-        c = self.connect()
-        c.request("DELETE", uri)
-        return c.getresponse()
+        return self.request("DELETE", uri)
 
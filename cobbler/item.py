@@ -17,7 +17,8 @@ import utils
 from cexceptions import *
 from utils import _
 import pprint
-import fnmatch
+import weakref
+import query
 
 class Item:
 
@@ -52,7 +53,10 @@ class Item:
         self.settings = self.config._settings
         self.clear(is_subobject)      # reset behavior differs for inheritance cases
         self.parent = ''              # all objects by default are not subobjects
-        self.children = {}            # caching for performance reasons, not serialized
+        self.children = {}            # objects that depend on this one, see Config.link
+        self.depends_on = []          # (type, name) of objects this one is filed under
+        self.parent_ref = None        # cached get_parent() result, see __cached
+        self.conceptual_parent_ref = None
         self.log_func = self.config.api.log        
         self.ctime = 0 # to be filled in by collection class
         self.mtime = 0 # to be filled in by collection class
@@ -103,19 +107,38 @@ class Item:
     def get_descendants(self):
         """
         Get objects that depend on this object, i.e. those that
-        would be affected by a cascading delete, etc.
+        would be affected by a cascading delete, etc.  Each object
+        is only returned once.
         """
         results = []
-        kids = self.get_children(sorted=False)
-        results.extend(kids)
-        for kid in kids:
-            grandkids = kid.get_descendants()
-            results.extend(grandkids)
+        seen = {}
+        todo = self.get_children(sorted=False)
+        while len(todo) > 0:
+            kid = todo.pop()
+            key = (kid.COLLECTION_TYPE, kid.name)
+            if seen.has_key(key):
+                continue
+            seen[key] = 1
+            results.append(kid)
+            todo.extend(kid.get_children(sorted=False))
         return results
 
     def get_parent(self):
         """
         For objects with a tree relationship, what's the parent object?
+        The object found by find_parent is remembered until the object
+        tree changes, so walking up the tree doesn't repeat name lookups.
+        """
+        parent = self.__cached(self.parent_ref)
+        if parent is None:
+            parent = self.find_parent()
+            self.parent_ref = self.__remember(parent)
+        return parent
+
+    def find_parent(self):
+        """
+        Look up the parent object by name.  Override in subclasses
+        that have parents.
         """
         return None
 
@@ -124,20 +147,36 @@ class Item:
         The parent may just be a superclass for something like a
         subprofile.  Get the first parent of a different type.
         """
-
-        # FIXME: this is a workaround to get the type of an instance var
-        # what's a more clean way to do this that's python 2.3 friendly?
-        # this returns something like:  cobbler.item_system.System
-        mtype = str(self).split(" ")[0][1:]
+        parent = self.__cached(self.conceptual_parent_ref)
+        if parent is not None:
+            return parent
         parent = self.get_parent()
         while parent is not None:
-           ptype = str(parent).split(" ")[0][1:]
-           if mtype != ptype:
-              self.conceptual_parent = parent
+           if parent.COLLECTION_TYPE != self.COLLECTION_TYPE:
+              self.conceptual_parent_ref = self.__remember(parent)
               return parent
            parent = parent.get_parent()
         return None
 
+    def __cached(self, ref):
+        """
+        Returns the object behind a reference made by __remember, or None
+        if objects have been added, removed or re-parented since (see
+        Config.tree_changed) or it no longer exists.
+        """
+        if ref is None or ref[0] != self.config.generation:
+            return None
+        return ref[1]()
+
+    def __remember(self, obj):
+        """
+        Weakly reference obj, so cached parents never keep removed
+        objects alive.
+        """
+        if obj is None:
+            return None
+        return (self.config.generation, weakref.ref(obj))
+
     def set_name(self,name):
         """
         All objects have names, and with the exception of System
@@ -296,86 +335,9 @@ class Item:
         return [data.get(x,"") for x in sort_fields]
         
     def find_match(self,kwargs,no_errors=False):
-        # used by find() method in collection.py
-        data = self.to_datastruct()
-        for (key, value) in kwargs.iteritems():
-            # Allow ~ to negate the compare
-            if value is not None and value.startswith("~"):
-                res=not self.find_match_single_key(data,key,value[1:],no_errors)
-            else:
-                res=self.find_match_single_key(data,key,value,no_errors)
-            if not res:
-                return False
-                
-        return True
- 
-
-    def find_match_single_key(self,data,key,value,no_errors=False):
-        # special case for systems
-        key_found_already = False
-        if data.has_key("interfaces"):
-            if key in [ "mac_address", "ip_address", "subnet", "virt_bridge", "dhcp_tag", "dns_name", "static_routes", "bonding", "bonding_opts", "bonding_master" ]:
-                key_found_already = True
-                for (name, interface) in data["interfaces"].iteritems(): 
-                    if value is not None:
-                        if self.__find_compare(interface[key], value):
-                            return True
-
-        if not data.has_key(key):
-            if not key_found_already:
-                if not no_errors:
-                   # FIXME: removed for 2.0 code, shouldn't cause any problems to not have an exception here?
-                   # raise CX(_("searching for field that does not exist: %s" % key))
-                   return False
-            else:
-                if value is not None: # FIXME: new?
-                   return False
-
-        if value is None:
-            return True
-        else:
-            return self.__find_compare(value, data[key])
-
-
-    def __find_compare(self, from_search, from_obj):
-
-        if isinstance(from_obj, basestring):
-            # FIXME: fnmatch is only used for string to string comparisions
-            # which should cover most major usage, if not, this deserves fixing
-            if fnmatch.fnmatch(from_obj.lower(), from_search.lower()):
-                return True
-            else:
-                return False    
-        
-        else:
-            if isinstance(from_search, basestring):
-                if type(from_obj) == type([]):
-                    from_search = utils.input_string_or_list(from_search)
-                    for x in from_search:
-                        if x not in from_obj:
-                            return False
-                    return True            
-
-                if type(from_obj) == type({}):
-                    (junk, from_search) = utils.input_string_or_hash(from_search,allow_multiples=True)
-                    for x in from_search.keys():
-                        y = from_search[x]
-                        if not from_obj.has_key(x):
-                            return False
-                        if not (y == from_obj[x]):
-                            return False
-                    return True
-
-                if type(from_obj) == type(True):
-                    if from_search.lower() in [ "true", "1", "y", "yes" ]:
-                        inp = True
-                    else:
-                        inp = False
-                    if inp == from_obj:
-                        return True
-                    return False
-                
-            raise CX(_("find cannot compare type: %s") % type(from_obj)) 
+        # used by find() method in collection.py, which compiles the
+        # criteria once for the whole collection instead
+        return query.Query(kwargs).match(self)
 
     def dump_vars(self,data,format=True):
         raw = utils.blender(self.config.api, False, self)
@@ -138,7 +138,7 @@ class Distro(item.Item):
     def get_fields(self):
         return FIELDS
 
-    def get_parent(self):
+    def find_parent(self):
         """
         Return object next highest up the tree.
         NOTE: conceptually there is no need for subdistros
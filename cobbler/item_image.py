@@ -189,7 +189,7 @@ class Image(item.Item):
     def set_virt_path(self,path):
         return utils.set_virt_path(self,path)
 
-    def get_parent(self):
+    def find_parent(self):
         """
         Return object next highest up the tree.
         """
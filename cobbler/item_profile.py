@@ -93,6 +93,7 @@ class Profile(item.Item):
         """
         if parent_name is None or parent_name == '':
            self.parent = ''
+           self.config.tree_changed()
            return True
         if parent_name == self.name:
            # check must be done in two places as set_parent could be called before/after
@@ -103,6 +104,7 @@ class Profile(item.Item):
            raise CX(_("profile %s not found, inheritance not possible") % parent_name)
         self.parent = parent_name       
         self.depth = found.depth + 1
+        self.config.tree_changed()
         return True
 
     def set_distro(self,distro_name):
@@ -114,6 +116,7 @@ class Profile(item.Item):
         if d is not None:
             self.distro = distro_name
             self.depth  = d.depth +1 # reset depth if previously a subprofile and now top-level
+            self.config.tree_changed()
             return True
         raise CX(_("distribution not found"))
 
@@ -207,7 +210,7 @@ class Profile(item.Item):
     def set_repos(self,repos,bypass_check=False):
         return utils.set_repos(self,repos,bypass_check)
 
-    def get_parent(self):
+    def find_parent(self):
         """
         Return object next highest up the tree.
         """
@@ -182,7 +182,7 @@ class Repo(item.Item):
         self.mirror_locally = utils.input_boolean(value)
         return True
 
-    def get_parent(self):
+    def find_parent(self):
         """
         currently the Cobbler object space does not support subobjects of this object
         as it is conceptually not useful.
@@ -108,7 +108,9 @@ class System(item.Item):
         Used to remove an interface.
         """
         if self.interfaces.has_key(name) and len(self.interfaces) > 1:
-            del self.interfaces[name]
+            interfaces = self.interfaces.copy()
+            del interfaces[name]
+            self.interfaces = interfaces
         else:
             if not self.interfaces.has_key(name):
                 # no interface here to delete
@@ -119,10 +121,29 @@ class System(item.Item):
         return True
         
 
-    def __get_interface(self,name):
+    # interfaces is copy-on-write: to_datastruct, blender and friends
+    # share the dicts rather than copying them, so rather than change
+    # an interface in place, setters replace it (and the interfaces
+    # dict holding it) with an edited copy.
 
+    def __get_interface(self,name):
+        """
+        Returns the named interface for reading, creating it if needed.
+        """
         if not self.interfaces.has_key(name):
-            self.interfaces[name] = {
+            return self.__edit_interface(name)
+        return self.interfaces[name]
+
+    def __edit_interface(self,name):
+        """
+        Returns a private copy of the named interface, creating it if
+        needed, that is safe to modify.
+        """
+        interfaces = self.interfaces.copy()
+        if interfaces.has_key(name):
+            intf = interfaces[name].copy()
+        else:
+            intf = {
                 "mac_address"    : "",
                 "mtu"            : "",
                 "ip_address"     : "",
@@ -141,15 +162,16 @@ class System(item.Item):
                 "ipv6_static_routes"  : [],
                 "ipv6_default_gateway" : "",
             }
-
-        return self.interfaces[name]
+        interfaces[name] = intf
+        self.interfaces = interfaces
+        return intf
 
 
     def from_datastruct(self,seed_data):
         # FIXME: most definitely doesn't grok interfaces yet.
         return utils.from_datastruct_from_fields(self,seed_data,FIELDS)
 
-    def get_parent(self):
+    def find_parent(self):
         """
         Return object next highest up the tree.
         """
@@ -178,11 +200,11 @@ class System(item.Item):
         # the default interface behaviour that's now removed. ;)
         # --Jasper Capel
         if utils.is_mac(name):
-           intf = self.__get_interface("eth0")
+           intf = self.__edit_interface("eth0")
            if intf["mac_address"] == "":
                intf["mac_address"] = name
         elif utils.is_ip(name):
-           intf = self.__get_interface("eth0")
+           intf = self.__edit_interface("eth0")
            if intf["ip_address"] == "":
                intf["ip_address"] = name
         self.name = name 
@@ -251,12 +273,15 @@ class System(item.Item):
         return False
 
     def set_dhcp_tag(self,dhcp_tag,interface):
-        intf = self.__get_interface(interface)
+        # with dhcp_tag_fragments, the tag names a file, see manage_isc
+        if dhcp_tag is not None and (str(dhcp_tag).find("/") != -1 or str(dhcp_tag).startswith(".")):
+            raise CX(_("invalid dhcp tag, it may not contain / or start with a dot: %s") % dhcp_tag)
+        intf = self.__edit_interface(interface)
         intf["dhcp_tag"] = dhcp_tag
         return True
 
     def set_dns_name(self,dns_name,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         # FIXME: move duplicate supression code to the object validation
         # functions to take a harder line on supression?
         if dns_name != "" and not str(self.config._settings.allow_duplicate_hostnames).lower() in [ "1", "y", "yes"]:
@@ -270,7 +295,7 @@ class System(item.Item):
         return True
  
     def set_static_routes(self,routes,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         data = utils.input_string_or_list(routes)
         intf["static_routes"] = data
         return True
@@ -282,7 +307,7 @@ class System(item.Item):
         return True
 
     def set_static(self,truthiness,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         intf["static"] = utils.input_boolean(truthiness)
         return True
 
@@ -291,7 +316,7 @@ class System(item.Item):
         Assign a IP or hostname in DHCP when this MAC boots.
         Only works if manage_dhcp is set in /etc/cobbler/settings
         """
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
 
         # FIXME: move duplicate supression code to the object validation
         # functions to take a harder line on supression?
@@ -319,7 +344,7 @@ class System(item.Item):
                if x.name != self.name:
                    raise CX("MAC address duplicated: %s" % address)
 
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         if address == "" or utils.is_mac(address):
            intf["mac_address"] = address.strip()
            return True
@@ -350,14 +375,14 @@ class System(item.Item):
         return True
 
     def set_subnet(self,subnet,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         intf["subnet"] = subnet
         return True
     
     def set_virt_bridge(self,bridge,interface):
         if bridge == "":
             bridge = self.settings.default_virt_bridge
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         intf["virt_bridge"] = bridge
         return True
 
@@ -366,17 +391,17 @@ class System(item.Item):
             raise CX(_("bonding value must be one of: master, slave, na"))
         if bonding == "na":
             bonding = ""
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         intf["bonding"] = bonding
         return True
 
     def set_bonding_master(self,bonding_master,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         intf["bonding_master"] = bonding_master
         return True
 
     def set_bonding_opts(self,bonding_opts,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         intf["bonding_opts"] = bonding_opts
         return True
 
@@ -395,14 +420,14 @@ class System(item.Item):
         Assign a IP or hostname in DHCP when this MAC boots.
         Only works if manage_dhcp is set in /etc/cobbler/settings
         """
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         if address == "" or utils.is_ip(address):
            intf["ipv6_address"] = address.strip()
            return True
         raise CX(_("invalid format for IPv6 IP address (%s)") % address)
 
     def set_ipv6_secondaries(self,addresses,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         data = utils.input_string_or_list(addresses)
         secondaries = []
         for address in data:
@@ -415,25 +440,25 @@ class System(item.Item):
         return True
 
     def set_ipv6_default_gateway(self,address,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         if address == "" or utils.is_ip(address):
            intf["ipv6_default_gateway"] = address.strip()
            return True
         raise CX(_("invalid format for IPv6 IP address (%s)") % address)
 
     def set_ipv6_static_routes(self,routes,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         data = utils.input_string_or_list(routes)
         intf["ipv6_static_routes"] = data
         return True
 
     def set_ipv6_mtu(self,mtu,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         intf["ipv6_mtu"] = mtu
         return True
 
     def set_mtu(self,mtu,interface):
-        intf = self.__get_interface(interface)
+        intf = self.__edit_interface(interface)
         intf["mtu"] = mtu
         return True
 
@@ -444,6 +469,7 @@ class System(item.Item):
         """
         if profile_name in [ "delete", "None", "~", ""] or profile_name is None:
             self.profile = ""
+            self.config.tree_changed()
             return True
 
         self.image = "" # mutual exclusion rule
@@ -452,6 +478,7 @@ class System(item.Item):
         if p is not None:
             self.profile = profile_name
             self.depth = p.depth + 1 # subprofiles have varying depths.
+            self.config.tree_changed()
             return True
         raise CX(_("invalid profile name: %s") % profile_name)
 
@@ -462,6 +489,7 @@ class System(item.Item):
         """
         if image_name in [ "delete", "None", "~", ""] or image_name is None:
             self.image = ""
+            self.config.tree_changed()
             return True
 
         self.profile = "" # mutual exclusion rule
@@ -471,6 +499,7 @@ class System(item.Item):
         if img is not None:
             self.image = image_name
             self.depth = img.depth + 1
+            self.config.tree_changed()
             return True
         raise CX(_("invalid image name (%s)") % image_name)
 
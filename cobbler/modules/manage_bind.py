@@ -29,8 +29,8 @@ import sys
 import glob
 import traceback
 import errno
-import re
 from shlex import shlex
+import simplejson
 
 
 import utils
@@ -45,6 +45,13 @@ import item_system
 from utils import _
 
 
+# where the BIND configuration and the zone files go
+NAMED_CONF = "/etc/named.conf"
+ZONE_DIR   = "/var/named"
+
+# serial and contents digest of each zone file as last written
+ZONE_STATE = "/var/lib/cobbler/zone_state"
+
 def register():
    """
    The mandatory cobbler module registration hook.
@@ -71,35 +78,34 @@ class BindManager:
         self.repos       = config.repos()
         self.templar     = templar.Templar(config)
 
-    def regen_hosts(self):
+    def regen_hosts(self, system=None, removed=False):
         pass # not used
 
+    def __zone_list(self, zones):
+        if type(zones) != type([]):
+           # gracefully handle when user inputs only a single zone
+           # as a string instead of a list with only a single item
+           zones = [zones]
+        return zones
+
     def __forward_zones(self):
         """
         Returns a map of zones and the records that belong
         in them
         """
         zones = {}
-        forward_zones = self.settings.manage_forward_zones
-        if type(forward_zones) != type([]):
-           # gracefully handle when user inputs only a single zone
-           # as a string instead of a list with only a single item
-           forward_zones = [forward_zones]
-
-        for zone in forward_zones:
+        for zone in self.__zone_list(self.settings.manage_forward_zones):
            zones[zone] = {}
 
         for system in self.systems:
+            if not system.is_management_supported(cidr_ok=False):
+                continue
             for (name, interface) in system.interfaces.iteritems():
                 host = interface["dns_name"]
                 ip   = interface["ip_address"]
-                if not system.is_management_supported(cidr_ok=False):
-                    continue
                 if not host or not ip:
                     # gotsta have some dns_name and ip or else!
                     continue
-                if host.find(".") == -1:
-                    continue
 
                 # match the longest zone!
                 # e.g. if you have a host a.b.c.d.e
@@ -107,19 +113,16 @@ class BindManager:
                 # - c.d.e
                 # - b.c.d.e
                 # then a.b.c.d.e should go in b.c.d.e
-                best_match = ''
-                for zone in zones.keys():
-                   if re.search('\.%s$' % zone, host) and len(zone) > len(best_match):
-                      best_match = zone
-
-                if best_match == '': # no match
-                   continue
-
-                # strip the zone off the dns_name and append the
-                # remainder + ip to the zone list
-                host = re.sub('\.%s$' % best_match, '', host)
-
-                zones[best_match][host] = ip
+                # so try the suffixes of the name, longest first, stopping
+                # at the first one that is a zone
+                labels = host.split(".")
+                for i in range(1, len(labels)):
+                    zone = ".".join(labels[i:])
+                    if zones.has_key(zone):
+                        # strip the zone off the dns_name and append the
+                        # remainder + ip to the zone list
+                        zones[zone][".".join(labels[:i])] = ip
+                        break
 
         return zones
 
@@ -129,21 +132,15 @@ class BindManager:
         in them
         """
         zones = {}
-        reverse_zones = self.settings.manage_reverse_zones
-        if type(reverse_zones) != type([]):
-           # gracefully handle when user inputs only a single zone
-           # as a string instead of a list with only a single item
-           reverse_zones = [reverse_zones]
-
-        for zone in reverse_zones:
+        for zone in self.__zone_list(self.settings.manage_reverse_zones):
            zones[zone] = {}
 
         for sys in self.systems:
+            if not sys.is_management_supported(cidr_ok=False):
+                continue
             for (name, interface) in sys.interfaces.iteritems():
                 host = interface["dns_name"]
                 ip   = interface["ip_address"]
-                if not sys.is_management_supported(cidr_ok=False):
-                    continue
                 if not host or not ip:
                     # gotsta have some dns_name and ip or else!
                     continue
@@ -154,38 +151,30 @@ class BindManager:
                 # - 1.2
                 # - 1.2.3
                 # then 1.2.3.4 should go in 1.2.3
-                best_match = ''
-                for zone in zones.keys():
-                   if re.search('^%s\.' % zone, ip) and len(zone) > len(best_match):
-                      best_match = zone
-
-                if best_match == '': # no match
-                   continue
-
-                # strip the zone off the front of the ip
-                # reverse the rest of the octets
-                # append the remainder + dns_name
-                ip = ip.replace(best_match, '', 1)
-                if ip[0] == '.': # strip leading '.' if it's there
-                   ip = ip[1:]
-                tokens = ip.split('.')
-                tokens.reverse()
-                ip = '.'.join(tokens)
-                zones[best_match][ip] = host + '.'
+                # so try the prefixes of the ip, longest first
+                octets = ip.split(".")
+                for i in range(len(octets) - 1, 0, -1):
+                    zone = ".".join(octets[:i])
+                    if zones.has_key(zone):
+                        # strip the zone off the front of the ip
+                        # reverse the rest of the octets
+                        # append the remainder + dns_name
+                        tokens = octets[i:]
+                        tokens.reverse()
+                        zones[zone][".".join(tokens)] = host + '.'
+                        break
 
         return zones
 
 
-    def __write_named_conf(self):
+    def __write_named_conf(self, forward, reverse):
         """
         Write out the named.conf main config file from the template.
         """
-        settings_file = "/etc/named.conf"
+        settings_file = NAMED_CONF
         template_file = "/etc/cobbler/named.template"
-        forward_zones = self.settings.manage_forward_zones
-        reverse_zones = self.settings.manage_reverse_zones
 
-        metadata = {'forward_zones': self.__forward_zones().keys(),
+        metadata = {'forward_zones': forward.keys(),
                     'reverse_zones': [],
                     'zone_include': ''}
 
@@ -198,7 +187,7 @@ zone "%(zone)s." {
 """ % {'zone': zone}
                 metadata['zone_include'] = metadata['zone_include'] + txt
 
-        for zone in self.__reverse_zones().keys():
+        for zone in reverse.keys():
                 tokens = zone.split('.')
                 tokens.reverse()
                 arpa = '.'.join(tokens) + '.in-addr.arpa'
@@ -256,15 +245,16 @@ zone "%(arpa)s." {
            s += "%s  %s  %s  %s\n" % (my_name, rclass, rectype, my_host)
         return s
 
-    def __write_zone_files(self):
+    def __write_zone_files(self, forward, reverse):
         """
-        Write out the forward and reverse zone files for all configured zones
+        Write out the forward and reverse zone files for all configured
+        zones.  A zone file is only rewritten, with a new serial, if its
+        records changed since it was last written (see ZONE_STATE), so
+        BIND and its secondaries only reload zones that did change.
+        Returns the names of the zones written.
         """
         default_template_file = "/etc/cobbler/zone.template"
         cobbler_server = self.settings.server
-        serial = int(time.time())
-        forward = self.__forward_zones()
-        reverse = self.__reverse_zones()
 
         try:
             f2 = open(default_template_file,"r")
@@ -274,35 +264,17 @@ zone "%(arpa)s." {
         default_template_data = f2.read()
         f2.close()
 
-        for (zone, hosts) in forward.iteritems():
-            metadata = {
-                'cobbler_server': cobbler_server,
-                'serial': serial,
-                'host_record': ''
-            }
-
-            # grab zone-specific template if it exists
-            try:
-               fd = open('/etc/cobbler/zone_templates/%s' % zone)
-               template_data = fd.read()
-               fd.close()
-            except:
-               template_data = default_template_data
-
-            metadata['host_record'] = self.__pretty_print_host_records(hosts)
-
-            zonefilename='/var/named/' + zone
-            if self.logger is not None:
-               self.logger.info("generating (forward) %s" % zonefilename)
-            self.templar.render(template_data, metadata, zonefilename, None)
+        state = self.__load_zone_state()
+        new_state = {}
+        changed = []
 
+        zones = []
+        for (zone, hosts) in forward.iteritems():
+            zones.append((zone, hosts, 'A'))
         for (zone, hosts) in reverse.iteritems():
-            metadata = {
-                'cobbler_server': cobbler_server,
-                'serial': serial,
-                'host_record': ''
-            }
+            zones.append((zone, hosts, 'PTR'))
 
+        for (zone, hosts, rectype) in zones:
             # grab zone-specific template if it exists
             try:
                fd = open('/etc/cobbler/zone_templates/%s' % zone)
@@ -311,22 +283,77 @@ zone "%(arpa)s." {
             except:
                template_data = default_template_data
 
-            metadata['host_record'] = self.__pretty_print_host_records(hosts, rectype='PTR')
-
-            zonefilename='/var/named/' + zone
-            if self.logger is not None:
-               self.logger.info("generating (reverse) %s" % zonefilename)
-            self.templar.render(template_data, metadata, zonefilename, None)
+            host_record = self.__pretty_print_host_records(hosts, rectype=rectype)
+            zonefilename = os.path.join(ZONE_DIR, zone)
+
+            # render with the serial last written, which gives the same
+            # contents as last time if none of the records changed
+            (serial, digest) = state.get(zone, (0, None))
+            data = self.__render_zone(template_data, cobbler_server, serial, host_record)
+            if utils.md5(data).hexdigest() != digest or not os.path.exists(zonefilename):
+                serial = max(int(time.time()), serial + 1)
+                data = self.__render_zone(template_data, cobbler_server, serial, host_record)
+                if self.logger is not None:
+                    if rectype == 'PTR':
+                        self.logger.info("generating (reverse) %s" % zonefilename)
+                    else:
+                        self.logger.info("generating (forward) %s" % zonefilename)
+                utils.write_if_changed(zonefilename, data, api=self.api)
+                changed.append(zone)
+            else:
+                utils.note_output(self.api, zonefilename)
+            new_state[zone] = (serial, utils.md5(data).hexdigest())
+
+        self.__save_zone_state(new_state)
+        return changed
+
+    def __render_zone(self, template_data, cobbler_server, serial, host_record):
+        metadata = {
+            'cobbler_server': cobbler_server,
+            'serial': serial,
+            'host_record': host_record
+        }
+        return self.templar.render(template_data, metadata, None)
+
+    def __load_zone_state(self):
+        """
+        The serial and a digest of the contents of each zone file as
+        last written, keyed by zone.
+        """
+        try:
+            fd = open(ZONE_STATE)
+            data = fd.read()
+            fd.close()
+            state = simplejson.loads(data)
+        except:
+            return {}
+        result = {}
+        for (zone, entry) in state.iteritems():
+            result[zone] = (entry[0], entry[1])
+        return result
 
+    def __save_zone_state(self, state):
+        if utils.dry_run(self.api) is None:
+            utils.write_if_changed(ZONE_STATE, simplejson.dumps(state))
 
     def write_dns_files(self):
         """
         BIND files are written when manage_dns is set in
-        /var/lib/cobbler/settings.
+        /var/lib/cobbler/settings.  Returns the names of the zones whose
+        files changed, which are the only ones BIND needs to reload.
         """
 
-        self.__write_named_conf()
-        self.__write_zone_files()
+        # work out which records go in which zones just once
+        forward = self.__forward_zones()
+        reverse = self.__reverse_zones()
+        self.__write_named_conf(forward, reverse)
+        changed = self.__write_zone_files(forward, reverse)
+        if self.logger is not None:
+            if len(changed) > 0:
+                self.logger.info("zones changed: %s" % ", ".join(changed))
+            else:
+                self.logger.info("no zones changed")
+        return changed
 
 def get_manager(config,logger):
     return BindManager(config,logger)
@@ -42,6 +42,36 @@ from utils import _
 def register():
     return "manage"
 
+class HostTable:
+    """
+    The lines generated into a file such as /etc/ethers, kept by system
+    name, so that saving one system only recomputes that system's lines
+    and the file is only rewritten (atomically) if they changed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries  = {}
+        self.dirty    = True
+
+    def set(self, name, lines):
+        if self.entries.get(name, "") == lines:
+            return
+        if lines == "":
+            del self.entries[name]
+        else:
+            self.entries[name] = lines
+        self.dirty = True
+
+    def write(self, api):
+        if not self.dirty:
+            return
+        names = self.entries.keys()
+        names.sort()
+        data = "".join([ self.entries[x] for x in names ])
+        utils.write_if_changed(self.filename, data, api=api)
+        self.dirty = False
+
 class DnsmasqManager:
     """
     Handles conversion of internal state to the tftpboot tree layout
@@ -162,40 +192,67 @@ class DnsmasqManager:
 
         self.templar.render(template_data, metadata, settings_file, None)
 
-    def regen_ethers(self):
+    def regen_ethers(self, system=None, removed=False):
         # dnsmasq knows how to read this database of MACs -> IPs, so we'll keep it up to date
         # every time we add a system.
         # read 'man ethers' for format info
-        fh = open("/etc/ethers","w+")
-        for system in self.systems:
-            if not system.is_management_supported(cidr_ok=False):
-                continue
-            for (name, interface) in system.interfaces.iteritems():
-                mac = interface["mac_address"]
-                ip  = interface["ip_address"]
-                if mac is None or mac == "":
-                    # can't write this w/o a MAC address
-                    continue
-                if ip is not None and ip != "":
-                    fh.write(mac.upper() + "\t" + ip + "\n")
-        fh.close()
+        self.__regen("/etc/ethers", self.__ethers_lines, system, removed)
 
-    def regen_hosts(self):
+    def regen_hosts(self, system=None, removed=False):
         # dnsmasq knows how to read this database for host info
         # (other things may also make use of this later)
-        fh = open("/var/lib/cobbler/cobbler_hosts","w+")
-        for system in self.systems:
-            if not system.is_management_supported(cidr_ok=False):
+        self.__regen("/var/lib/cobbler/cobbler_hosts", self.__hosts_lines, system, removed)
+
+    def __regen(self, filename, lines_fn, system, removed):
+        """
+        Bring filename up to date, for all systems or (faster) only for
+        the given system, which has just been saved or is being removed.
+        Inside a batch (see BootAPI.begin_batch) the file is written
+        when the batch ends instead.
+        """
+        tables = getattr(self.api, "dnsmasq_tables", None)
+        if tables is None:
+            tables = self.api.dnsmasq_tables = {}
+        table = tables.get(filename, None)
+        if system is None or table is None:
+            table = tables[filename] = HostTable(filename)
+            for x in self.systems:
+                table.set(x.name, lines_fn(x))
+        # a system being removed is still listed until lite sync is done
+        if system is not None and removed:
+            table.set(system.name, "")
+        elif system is not None:
+            table.set(system.name, lines_fn(system))
+        if utils.batch_depth(self.api) == 0:
+            table.write(self.api)
+
+    def __ethers_lines(self, system):
+        if not system.is_management_supported(cidr_ok=False):
+            return ""
+        lines = ""
+        for (name, interface) in system.interfaces.iteritems():
+            mac = interface["mac_address"]
+            ip  = interface["ip_address"]
+            if mac is None or mac == "":
+                # can't write this w/o a MAC address
                 continue
-            for (name, interface) in system.interfaces.iteritems():
-                mac  = interface["mac_address"]
-                host = interface["dns_name"]
-                ip   = interface["ip_address"]
-                if mac is None or mac == "":
-                    continue
-                if host is not None and host != "" and ip is not None and ip != "":
-                    fh.write(ip + "\t" + host + "\n")
-        fh.close()
+            if ip is not None and ip != "":
+                lines = lines + mac.upper() + "\t" + ip + "\n"
+        return lines
+
+    def __hosts_lines(self, system):
+        if not system.is_management_supported(cidr_ok=False):
+            return ""
+        lines = ""
+        for (name, interface) in system.interfaces.iteritems():
+            mac  = interface["mac_address"]
+            host = interface["dns_name"]
+            ip   = interface["ip_address"]
+            if mac is None or mac == "":
+                continue
+            if host is not None and host != "" and ip is not None and ip != "":
+                lines = lines + ip + "\t" + host + "\n"
+        return lines
 
     def write_dns_files(self):
         # already taken care of by the regen_hosts()
@@ -53,7 +53,7 @@ class InTftpdManager:
         self.systems       = config.systems()
         self.bootloc       = utils.tftpboot_location()
 
-    def regen_hosts(self):
+    def regen_hosts(self, system=None, removed=False):
         pass # not used
 
     def write_dns_files(self):
@@ -130,8 +130,7 @@ class InTftpdManager:
 
         # the actual pxelinux.cfg files, for each interface
         self.logger.info("generating PXE configuration files")
-        for x in self.systems:
-            self.pxegen.write_all_system_files(x)
+        self.pxegen.write_system_files_parallel(self.systems, self.config.settings().sync_processes)
 
         self.logger.info("generating PXE menu structure")
         self.pxegen.make_pxe_menu()
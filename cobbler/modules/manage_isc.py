@@ -27,10 +27,12 @@ import shutil
 import time
 import sys
 import glob
+import urllib
 import traceback
 import errno
 from utils import popen2
 from shlex import shlex
+import simplejson
 
 
 import utils
@@ -45,6 +47,30 @@ import item_system
 from utils import _
 
 
+# with dhcp_tag_fragments, where the per-tag files go, relative to
+# the directory holding dhcpd.conf
+FRAGMENT_DIR = "cobbler.d"
+
+# the templates of dhcpd.conf and, with dhcp_tag_fragments, of the
+# file of each dhcp_tag
+DHCP_TEMPLATE = "/etc/cobbler/dhcp.template"
+TAG_TEMPLATE  = "/etc/cobbler/dhcp_tag.template"
+
+# what was last written, see IscManager.__load_state
+DHCP_STATE = "/var/lib/cobbler/dhcp_state"
+
+def fragment_name(tag):
+   """
+   The file name of the fragment for a dhcp_tag.  Tags are checked
+   when set (see item_system.System.set_dhcp_tag), but ones stored
+   before that are escaped too, so no tag can name a file outside
+   FRAGMENT_DIR.
+   """
+   name = urllib.quote(tag, safe="")
+   if name.startswith("."):
+       name = "%2E" + name[1:]
+   return "%s.conf" % name
+
 def register():
    """
    The mandatory cobbler module registration hook.
@@ -75,11 +101,15 @@ class IscManager:
     def write_dhcp_file(self):
         """
         DHCP files are written when manage_dhcp is set in
-        /var/lib/cobbler/settings.
+        /var/lib/cobbler/settings.  Returns True if the DHCP
+        configuration changed, False if everything written was already
+        up to date (so dhcpd need not be restarted).
         """
 
-        template_file = "/etc/cobbler/dhcp.template"
-        blender_cache = {}
+        template_file = DHCP_TEMPLATE
+        state = self.__load_state()
+        new_state = { "fragments" : {}, "systems" : {} }
+        blended = {}
 
         try:
             f2 = open(template_file,"r")
@@ -111,6 +141,11 @@ class IscManager:
 
             for (name, interface) in system.interfaces.iteritems():
 
+                # the template gets a copy, as the interface itself
+                # belongs to the system (and may be shared, see
+                # item_system) and must not pick up these fields
+                interface = interface.copy()
+
                 # this is really not a per-interface setting
                 # but we do this to make the templates work
                 # without upgrade
@@ -149,11 +184,9 @@ class IscManager:
 
                 # add references to the system, profile, and distro
                 # for use in the template
-                if blender_cache.has_key(system.name):
-                    blended_system = blender_cache[system.name]
-                else:
-                    blended_system  = utils.blender( self.api, False, system )
-                    blender_cache[system.name] = blended_system
+                if not blended.has_key(system.name):
+                    blended[system.name] = self.__blended_fields(system, state, new_state)
+                blended_system = blended[system.name]
 
                 interface["next_server"] = blended_system["server"]
                 interface["netboot_enabled"] = blended_system["netboot_enabled"]
@@ -186,14 +219,138 @@ class IscManager:
            "next_server"    : self.settings.next_server,
            "elilo"          : elilo,
            "yaboot"         : yaboot,
-           "dhcp_tags"      : dhcp_tags
+           "dhcp_tags"      : dhcp_tags,
+           "dhcp_includes"  : []
         }
 
-        if self.logger is not None:
-            self.logger.info("generating %s" % self.settings_file)
-        self.templar.render(template_data, metadata, self.settings_file, None)
+        changed = False
+
+        if self.settings.dhcp_tag_fragments:
+            if template_data.find("dhcp_includes") == -1:
+                # the hosts would go missing from dhcpd.conf
+                if self.logger is not None:
+                    self.logger.warning("%s does not include $dhcp_includes, writing the hosts into %s instead of fragments" % (template_file, self.settings_file))
+            else:
+                # the hosts of each tag go in their own file, which is
+                # only rendered again if its contents would change
+                (changed, metadata["dhcp_includes"]) = self.__write_fragments(metadata, state, new_state)
+                metadata["dhcp_tags"] = {}
+
+        # dhcpd.conf is only rendered again (and the date in its header
+        # updated) if what it is rendered from, or the file itself, has
+        # changed
+        inputs = simplejson.dumps([ template_data, self.settings.fingerprint(), metadata["next_server"], metadata["cobbler_server"], metadata["dhcp_tags"], metadata["dhcp_includes"] ], sort_keys=True)
+        digest = utils.md5(inputs).hexdigest()
+        fingerprint = utils.file_fingerprint(self.settings_file)
+        if state.get("digest", None) == digest and fingerprint is not None and state.get("file", None) == fingerprint:
+            utils.note_output(self.api, self.settings_file)
+            metadata["date"] = state["date"]
+        else:
+            if self.logger is not None:
+                self.logger.info("generating %s" % self.settings_file)
+            self.templar.render(template_data, metadata, self.settings_file, None)
+            fingerprint = utils.file_fingerprint(self.settings_file)
+            changed = True
+        new_state["digest"] = digest
+        new_state["file"] = fingerprint
+        new_state["date"] = metadata["date"]
+
+        self.__save_state(new_state)
+        return changed
+
+    def __blended_fields(self, system, state, new_state):
+        """
+        The fields of the blended system that the DHCP template uses.
+        Those are kept in the state, along with a version of everything
+        they are blended from (the system, its parents and the
+        settings), so a system is only blended again once that changes.
+        """
+        version = [ self.settings.fingerprint() ]
+        obj = system
+        while obj is not None:
+            version.append((obj.COLLECTION_TYPE, obj.name, obj.uid, obj.mtime))
+            obj = obj.get_parent()
+        version = utils.md5(repr(version)).hexdigest()
+        fields = state.get("systems", {}).get(system.name, None)
+        if fields is None or fields["version"] != version:
+            blended_system = utils.blender(self.api, False, system)
+            fields = { "version" : version }
+            for key in [ "server", "netboot_enabled", "hostname" ]:
+                fields[key] = blended_system[key]
+        new_state["systems"][system.name] = fields
+        return fields
+
+    def __write_fragments(self, metadata, state, new_state):
+        """
+        Write the hosts of each dhcp_tag to a file of their own in
+        FRAGMENT_DIR, from the dhcp_tag.template, skipping tags whose
+        hosts and template are the same as when last written.  Returns
+        whether any fragment changed, and the list of fragment files.
+        """
+        template_file = TAG_TEMPLATE
+        try:
+            f2 = open(template_file,"r")
+        except:
+            raise CX(_("error reading template: %s") % template_file)
+        template_data = f2.read()
+        f2.close()
+
+        fragment_dir = os.path.join(os.path.dirname(self.settings_file), FRAGMENT_DIR)
+        if not os.path.exists(fragment_dir):
+            utils.mkdir(fragment_dir, logger=self.logger, api=self.api)
+
+        changed = False
+        includes = []
+        tags = metadata["dhcp_tags"].keys()
+        tags.sort()
+        for tag in tags:
+            hosts = metadata["dhcp_tags"][tag]
+            fragment = os.path.join(fragment_dir, fragment_name(tag))
+            includes.append(fragment)
+            inputs = simplejson.dumps([ template_data, metadata["next_server"], metadata["cobbler_server"], hosts ], sort_keys=True)
+            digest = utils.md5(inputs).hexdigest()
+            new_state["fragments"][tag] = digest
+            if state.get("fragments",{}).get(tag, None) == digest and os.path.exists(fragment):
+                utils.note_output(self.api, fragment)
+                continue
+            if self.logger is not None:
+                self.logger.info("generating %s" % fragment)
+            fragment_metadata = metadata.copy()
+            fragment_metadata["dhcp_tag"] = tag
+            fragment_metadata["dhcp_tags"] = { tag : hosts }
+            self.templar.render(template_data, fragment_metadata, fragment, None)
+            changed = True
+
+        # fragments of tags no longer in use, only those written by
+        # earlier syncs, as others may have put files here too
+        for tag in state.get("fragments",{}).keys():
+            fragment = os.path.join(fragment_dir, fragment_name(tag))
+            if not fragment in includes and os.path.exists(fragment):
+                utils.rmfile(fragment, logger=self.logger, api=self.api)
+                changed = True
+
+        return (changed, includes)
+
+    def __load_state(self):
+        """
+        The date last written into the DHCP configuration, its
+        fingerprint, digests of what it and each fragment (see
+        __write_fragments) were rendered from, and the blended fields
+        of each system (see __blended_fields).
+        """
+        try:
+            fd = open(DHCP_STATE)
+            data = fd.read()
+            fd.close()
+            return simplejson.loads(data)
+        except:
+            return {}
+
+    def __save_state(self, state):
+        if utils.dry_run(self.api) is None:
+            utils.write_if_changed(DHCP_STATE, simplejson.dumps(state))
 
-    def regen_ethers(self):
+    def regen_ethers(self, system=None, removed=False):
         pass # ISC/BIND do not use this
 
 
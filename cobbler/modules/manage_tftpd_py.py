@@ -51,7 +51,7 @@ class TftpdPyManager:
         self.templar       = templar.Templar(config)
 	self.settings_file = "/etc/xinetd.d/tftp"
 
-    def regen_hosts(self):
+    def regen_hosts(self, system=None, removed=False):
         pass # not used
 
     def write_dns_files(self):
@@ -5,6 +5,8 @@ It uses multiple files in /var/lib/cobbler/config/distros.d, profiles.d, etc
 And JSON, when possible, and YAML, when not.
 It is particularly fast, especially when using JSON.   YAML, not so much.
 It also knows how to upgrade the old "single file" configs to .d versions.
+Large catalogs can optionally be sharded into hashed subdirectories,
+see serializer_shard_depth in /etc/cobbler/settings.
 
 Copyright 2006-2009, Red Hat, Inc
 Michael DeHaan <mdehaan@redhat.com>
@@ -28,11 +30,11 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 import distutils.sysconfig
 import os
 import sys
-import glob
 import traceback
 import yaml # PyYAML
 import simplejson
 import exceptions
+import tempfile
 
 plib = distutils.sysconfig.get_python_lib()
 mod_path="%s/cobbler" % plib
@@ -43,6 +45,16 @@ import utils
 from cexceptions import *
 import os
 
+# temp files written by serialize_item that have not yet been renamed
+# into place.  Only used when serializer_fsync is "batch", in which case
+# flush() commits them all at once at the end of the transaction.
+PENDING = []
+
+# the .d directories may be split into up to this many levels of
+# two character md5 prefix directories, ex: systems.d/3f/a0/name.json
+MAX_SHARD_DEPTH = 2
+SHARD_CHARS = "0123456789abcdef"
+
 def can_use_json():
     version = sys.version[:3]
     version = float(version)
@@ -54,12 +66,22 @@ def register():
     """
     return "serializer"
 
+# the shard depth each collection has been checked to be stored at,
+# see __check_layout
+LAYOUTS = {}
+
 def serialize_item(obj, item):
+    depth = __shard_depth(obj)
+    __check_layout(obj, depth)
+    return __save_item(obj, item, depth)
+
+def __save_item(obj, item, depth, remove_stale=False):
 
     if item.name is None or item.name == "":
        raise exceptions.RuntimeError("name unset for object!")
 
-    filename = "/var/lib/cobbler/config/%ss.d/%s" % (obj.collection_type(),item.name)
+    ctype = obj.collection_type()
+    filename = __item_filename(ctype, item.name, depth)
     datastruct = item.to_datastruct()
 
     jsonable = can_use_json()
@@ -73,49 +95,244 @@ def serialize_item(obj, item):
             print "upgrading yaml file to json: %s" % filename
             os.remove(filename)
         filename = filename + ".json"
-        datastruct = item.to_datastruct()
-        fd = open(filename,"w+")
         data = simplejson.dumps(datastruct, encoding="utf-8")
-        #data = data.encode('utf-8')
-        fd.write(data)
 
     else:
 
         if os.path.exists(filename + ".json"):
             print "downgrading json file back to yaml: %s" % filename
             os.remove(filename + ".json")
-        datastruct = item.to_datastruct()
-        fd = open(filename,"w+")
         data = yaml.dump(datastruct)
-        fd.write(data)
 
-    fd.close()
+    # copies of this item left behind in another layout are removed
+    # once the new file is in place, which is how the catalog migrates
+    # when serializer_shard_depth changes
+    stale = []
+    if remove_stale:
+        for other in range(0, MAX_SHARD_DEPTH + 1):
+            if other == depth:
+                continue
+            oldname = __item_filename(ctype, item.name, other)
+            for f in [ oldname, oldname + ".json" ]:
+                if os.path.exists(f):
+                    stale.append(f)
+
+    dirname = os.path.dirname(filename)
+    if depth > 0 and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    __write_atomic(filename, data, __fsync_mode(obj), stale)
+    return True
+
+def __shard_depth(obj):
+    """
+    Returns the serializer_shard_depth setting, 0 (flat) to MAX_SHARD_DEPTH.
+    """
+    try:
+        depth = int(obj.config.settings().serializer_shard_depth)
+    except:
+        depth = 0
+    if depth < 0 or depth > MAX_SHARD_DEPTH:
+        depth = 0
+    return depth
+
+def __layout_filename(collection_type):
+    return "/var/lib/cobbler/config/%ss.d/.shard_depth" % collection_type
+
+def __stored_depth(collection_type):
+    """
+    The shard depth a collection was last written out at by serialize,
+    or 0, the only layout there was before sharding, if not recorded.
+    """
+    try:
+        fd = open(__layout_filename(collection_type))
+        depth = int(fd.read().strip())
+        fd.close()
+        return depth
+    except (IOError, ValueError):
+        return 0
+
+def __check_layout(obj, depth):
+    """
+    If serializer_shard_depth has changed since the collection was last
+    written, move all of it to the new layout before saving anything
+    else, so items are never left stored in two places.  Checked once
+    per process, rather than looking for old copies on every save.
+    """
+    ctype = obj.collection_type()
+    if LAYOUTS.get(ctype, None) == depth:
+        return
+    if __stored_depth(ctype) != depth:
+        serialize(obj)
+    LAYOUTS[ctype] = depth
+
+def __item_filename(collection_type, name, depth):
+    """
+    Returns the path of an item (less any .json extension), either
+    directly in the .d directory (depth 0) or hashed into depth levels
+    of subdirectories.
+    """
+    dirname = "/var/lib/cobbler/config/%ss.d" % collection_type
+    if depth > 0:
+        key = name
+        if type(key) == unicode:
+            key = key.encode("utf-8")
+        key = utils.md5(key).hexdigest()
+        for i in range(0, depth):
+            dirname = os.path.join(dirname, key[i*2:i*2+2])
+    return os.path.join(dirname, name)
+
+def __item_filenames(collection_type, name):
+    """
+    All the places an item may be stored, in any layout.
+    """
+    results = []
+    for depth in range(0, MAX_SHARD_DEPTH + 1):
+        filename = __item_filename(collection_type, name, depth)
+        results.append(filename)
+        results.append(filename + ".json")
+    return results
+
+def catalog_files(collection_type):
+    """
+    Returns the paths of all stored objects of a given type.
+    """
+    return __catalog_files("/var/lib/cobbler/config/%ss.d" % collection_type)
+
+def __is_shard(name):
+    if len(name) != 2:
+        return False
+    for c in name:
+        if c not in SHARD_CHARS:
+            return False
+    return True
+
+def __catalog_files(dirname, depth=0):
+    """
+    List the item files under a .d directory, in both the flat and the
+    sharded layouts.  Unlike os.walk this only stats entries that look
+    like shard directories, which matters with tens of thousands of files.
+    """
+    results = []
+    if depth == 0 and not os.path.isdir(dirname):
+        return results
+    for f in os.listdir(dirname):
+        if f.startswith("."):
+            # in-progress temp files from __write_atomic
+            continue
+        path = os.path.join(dirname, f)
+        if depth < MAX_SHARD_DEPTH and __is_shard(f) and os.path.isdir(path):
+            results.extend(__catalog_files(path, depth + 1))
+        else:
+            results.append(path)
+    return results
+
+def __fsync_mode(obj):
+    """
+    Returns the serializer_fsync setting: "none", "item" or "batch".
+    """
+    try:
+        mode = str(obj.config.settings().serializer_fsync).lower()
+    except:
+        mode = "none"
+    if mode not in [ "none", "item", "batch" ]:
+        mode = "none"
+    return mode
+
+def __fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def __write_atomic(filename, data, mode, stale=[]):
+    """
+    Write data to a temp file next to filename and rename() it into
+    place, so a crash mid-write never leaves a truncated record behind.
+    In "item" mode the data and the directory entry are fsynced before
+    returning, in "batch" mode the rename is deferred until flush().
+    Files listed in stale are removed only after the rename.
+    """
+    dirname = os.path.dirname(filename)
+    (fd, tmpname) = tempfile.mkstemp(prefix=".%s." % os.path.basename(filename), dir=dirname)
+    fh = os.fdopen(fd, "w")
+    try:
+        try:
+            # mkstemp creates files 0600, keep the old umask based permissions
+            umask = os.umask(0)
+            os.umask(umask)
+            os.fchmod(fd, 0666 & ~umask)
+            fh.write(data)
+            fh.flush()
+            if mode == "item":
+                os.fsync(fh.fileno())
+        finally:
+            fh.close()
+    except:
+        os.remove(tmpname)
+        raise
+
+    if mode == "batch":
+        PENDING.append((tmpname, filename, stale))
+        return
+
+    os.rename(tmpname, filename)
+    if mode == "item":
+        __fsync_path(dirname)
+    __remove_files(stale)
+
+def __remove_files(filenames):
+    for f in filenames:
+        if os.path.exists(f):
+            os.remove(f)
+
+def flush():
+    """
+    Commit the writes queued up in "batch" mode: fsync all of the temp
+    files, rename them into place and then fsync each directory once.
+    Called by serializer.py at the end of every transaction.
+    """
+    global PENDING
+    if len(PENDING) == 0:
+        return True
+    pending = PENDING
+    PENDING = []
+    dirs = {}
+    for (tmpname, filename, stale) in pending:
+        __fsync_path(tmpname)
+    for (tmpname, filename, stale) in pending:
+        os.rename(tmpname, filename)
+        dirs[os.path.dirname(filename)] = 1
+    for dirname in dirs.keys():
+        __fsync_path(dirname)
+    for (tmpname, filename, stale) in pending:
+        __remove_files(stale)
     return True
 
 def serialize_delete(obj, item):
-    filename = "/var/lib/cobbler/config/%ss.d/%s" % (obj.collection_type(),item.name)
-    filename2 = filename + ".json"
-    if os.path.exists(filename):
-        os.remove(filename)
-    if os.path.exists(filename2):
-        os.remove(filename2)
+    filenames = __item_filenames(obj.collection_type(), item.name)
+    # drop any batched write of this object that has not been committed yet
+    for entry in PENDING[:]:
+        if entry[1] in filenames:
+            PENDING.remove(entry)
+            os.remove(entry[0])
+    __remove_files(filenames)
     return True
 
 def deserialize_item_raw(collection_type, item_name):
     # this new fn is not really implemented performantly in this module.
     # yet.
-    filename = "/var/lib/cobbler/config/%ss.d/%s" % (collection_type,item_name)
-    filename2 = filename + ".json"
-    if os.path.exists(filename): 
+    for filename in __item_filenames(collection_type, item_name):
+        if not os.path.exists(filename):
+            continue
         fd = open(filename)
         data = fd.read()
+        fd.close()
+        if filename.endswith(".json"):
+            return simplejson.loads(data, encoding="utf-8")
         return yaml.load(data)
-    elif os.path.exists(filename2):
-        fd = open(filename2)
-        data = fd.read()
-        return simplejson.loads(data, encoding="utf-8")
-    else: 
-        return None  
+    return None
 
 
 def serialize(obj):
@@ -127,8 +344,14 @@ def serialize(obj):
     ctype = obj.collection_type()
     if ctype == "settings":
         return True
+    depth = __shard_depth(obj)
     for x in obj:
-        serialize_item(obj,x)
+        __save_item(obj, x, depth, remove_stale=True)
+    dirname = os.path.dirname(__layout_filename(ctype))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    __write_atomic(__layout_filename(ctype), "%d\n" % depth, __fsync_mode(obj))
+    LAYOUTS[ctype] = depth
     return True
 
 def deserialize_raw(collection_type):
@@ -146,7 +369,7 @@ def deserialize_raw(collection_type):
          return datastruct
     else:
          results = []
-         all_files = glob.glob("/var/lib/cobbler/config/%ss.d/*" % collection_type)
+         all_files = catalog_files(collection_type)
          all_files = filter_upgrade_duplicates(all_files)
          for f in all_files:
              fd = open(f)
@@ -164,11 +387,15 @@ def filter_upgrade_duplicates(file_list):
     """
     In a set of files, some ending with .json, some not, return
     the list of files with the .json ones taking priority over
-    the ones that are not.
+    the ones that are not.  Files are keyed on their basename, so
+    an item found in both the flat and sharded layouts (ex: after
+    an interrupted migration) is only loaded once.
     """
     bases = {}
     for f in file_list:
-       basekey = f.replace(".json","")
+       basekey = os.path.basename(f)
+       if basekey.endswith(".json"):
+           basekey = basekey[:-5]
        if f.endswith(".json"):
            bases[basekey] = f
        else:
@@ -182,18 +409,31 @@ def deserialize(obj,topological=True):
     Populate an existing object with the contents of datastruct.
     Object must "implement" Serializable.  
     """
-    old_filename = "/var/lib/cobbler/%ss" % obj.collection_type()
     datastruct = deserialize_raw(obj.collection_type())
     if topological and type(datastruct) == list:
        datastruct.sort(__depth_cmp)
     obj.from_datastruct(datastruct)
-    if os.path.exists(old_filename):
-       # we loaded it in from the old filename, so now migrate to new fmt
-       sys.stderr.write("auto-removing old config format: %s\n" % old_filename)
-       serialize(obj)
-       os.remove(old_filename)
     return True
 
+def needs_migration(collection_type):
+    """
+    Whether this collection is still stored in the old single file
+    format, see migrate.
+    """
+    return collection_type != "settings" and os.path.exists("/var/lib/cobbler/%ss" % collection_type)
+
+def migrate(obj):
+    """
+    Save a collection loaded from the old single file format in the
+    new format, and remove the old file.  serializer.py calls this,
+    holding the exclusive lock, after deserialize.
+    """
+    old_filename = "/var/lib/cobbler/%ss" % obj.collection_type()
+    sys.stderr.write("auto-removing old config format: %s\n" % old_filename)
+    serialize(obj)
+    flush()
+    os.remove(old_filename)
+
 def __depth_cmp(item1, item2):
     d1 = item1.get("depth",1)
     d2 = item2.get("depth",1)
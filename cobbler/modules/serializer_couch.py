@@ -43,10 +43,46 @@ import couch
 typez = [ "distro", "profile", "system", "image", "repo" ]
 couchdb = couch.Couch('127.0.0.1')
 
+# the databases only need creating once per process
+CONNECTED = False
+
+# last known couchdb revision of each document, keyed on
+# (collection_type, name), so updates and deletes can send the
+# _rev couchdb requires without fetching the document first.
+REVS = {}
+
 def __connect():
+   global CONNECTED
+   if CONNECTED:
+       return
    couchdb.connect()
    for x in typez:
        couchdb.createDb(x)
+   CONNECTED = True
+
+def __remember(collection_type, datastruct):
+   """
+   Record the revision of a document read from couchdb.
+   """
+   if type(datastruct) == dict and datastruct.has_key("_id") and datastruct.has_key("_rev"):
+       REVS[(collection_type, datastruct["_id"])] = datastruct["_rev"]
+
+def __fetch_rev(collection_type, name):
+   """
+   Look up the current revision of a document on the server, used
+   when our cached copy is missing or stale.
+   """
+   data = simplejson.loads(couchdb.openDoc(collection_type, name))
+   __remember(collection_type, data)
+   return REVS.get((collection_type, name), None)
+
+def __to_doc(obj, item):
+   datastruct = item.to_datastruct()
+   datastruct["_id"] = item.name
+   rev = REVS.get((obj.collection_type(), item.name), None)
+   if rev is not None:
+       datastruct["_rev"] = rev
+   return datastruct
 
 def register():
     """
@@ -57,62 +93,99 @@ def register():
 
 def serialize_item(obj, item):
     __connect()
-    datastruct = item.to_datastruct()
-    # blindly prevent conflict resolution
-    couchdb.openDoc(obj.collection_type(), item.name)
-    data = couchdb.saveDoc(obj.collection_type(),
+    ctype = obj.collection_type()
+    datastruct = __to_doc(obj, item)
+    data = couchdb.saveDoc(ctype,
                   simplejson.dumps(datastruct, encoding="utf-8"),
                   item.name)
     data = simplejson.loads(data)
+    if data.get("error","") == "conflict":
+        # someone else updated it since we last looked, take their
+        # revision and save over it
+        datastruct["_rev"] = __fetch_rev(ctype, item.name)
+        data = couchdb.saveDoc(ctype,
+                      simplejson.dumps(datastruct, encoding="utf-8"),
+                      item.name)
+        data = simplejson.loads(data)
+    if data.has_key("error"):
+        raise CX(_("couchdb save of %s %s failed: %s") % (ctype, item.name, data.get("reason",data["error"])))
+    REVS[(ctype, item.name)] = data["rev"]
     return True
 
 def serialize_delete(obj, item):
     __connect()
-    couchdb.deleteDoc(obj.collection_type(),
-                    item.name)
+    ctype = obj.collection_type()
+    rev = REVS.get((ctype, item.name), None)
+    if rev is None:
+        rev = __fetch_rev(ctype, item.name)
+    data = simplejson.loads(couchdb.deleteDoc(ctype, item.name, rev))
+    if data.get("error","") == "conflict":
+        data = simplejson.loads(couchdb.deleteDoc(ctype, item.name, __fetch_rev(ctype, item.name)))
+    if REVS.has_key((ctype, item.name)):
+        del REVS[(ctype, item.name)]
     return True
 
 def deserialize_item_raw(collection_type, item_name):
     __connect()
     data = couchdb.openDoc(collection_type, item_name)
-    return simplejson.loads(data, encoding="utf-8")
+    datastruct = simplejson.loads(data, encoding="utf-8")
+    __remember(collection_type, datastruct)
+    return datastruct
 
 def serialize(obj):
     """
     Save an object to disk.  Object must "implement" Serializable.
     FIXME: Return False on access/permission errors.
     This should NOT be used by API if serialize_item is available.
+    All objects are sent in a single _bulk_docs request.
     """
     __connect()
     ctype = obj.collection_type()
     if ctype == "settings":
         return True
+    docs = []
+    items = {}
     for x in obj:
-        serialize_item(obj,x)
+        docs.append(__to_doc(obj, x))
+        items[x.name] = x
+    if len(docs) == 0:
+        return True
+    data = couchdb.bulkDocs(ctype, simplejson.dumps({ "docs" : docs }, encoding="utf-8"))
+    results = simplejson.loads(data)
+    if type(results) == dict:
+        # older couchdb releases wrap the per document results
+        if results.has_key("error"):
+            raise CX(_("couchdb bulk save of %ss failed: %s") % (ctype, results.get("reason",results["error"])))
+        results = results.get("new_revs", [])
+    for r in results:
+        if r.has_key("rev"):
+            REVS[(ctype, r["id"])] = r["rev"]
+        elif items.has_key(r.get("id",None)):
+            # conflicted, retry this one on its own
+            serialize_item(obj, items[r["id"]])
     return True
 
 def deserialize_raw(collection_type):
-    __connect()
-    contents = simplejson.loads(couchdb.listDoc(collection_type))
-    items = []
-    if contents.has_key("error") and contents.get("reason","").find("Missing") != -1:
-        # no items in the DB yet
-        return []
-    for x in contents["rows"]:
-       items.append(x["key"])
-
     if collection_type == "settings":
          fd = open("/etc/cobbler/settings")
          datastruct = yaml.load(fd.read())
          fd.close()
          return datastruct
-    else:
-         results = []
-         for f in items:
-             data = couchdb.openDoc(collection_type, f)
-             datastruct = simplejson.loads(data, encoding='utf-8')
-             results.append(datastruct)
-         return results    
+
+    __connect()
+    contents = simplejson.loads(couchdb.listDoc(collection_type, include_docs=True), encoding='utf-8')
+    if contents.has_key("error") and contents.get("reason","").find("Missing") != -1:
+        # no items in the DB yet
+        return []
+
+    results = []
+    for x in contents["rows"]:
+        if x["id"].startswith("_design/"):
+            continue
+        datastruct = x["doc"]
+        __remember(collection_type, datastruct)
+        results.append(datastruct)
+    return results    
 
 def deserialize(obj,topological=True):
     """
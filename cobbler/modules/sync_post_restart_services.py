@@ -18,6 +18,24 @@ def register():
     # the return of this method indicates the trigger type
     return "/var/lib/cobbler/triggers/sync/post/*"
 
+# the files each service reads, where a trailing / stands for
+# everything in the directory
+DNSMASQ_FILES = [ "/etc/dnsmasq.conf", "/etc/ethers", "/var/lib/cobbler/cobbler_hosts" ]
+NAMED_CONF    = "/etc/named.conf"
+ZONE_DIR      = "/var/named/"
+
+def changed_files(changed, paths):
+    """
+    Those of the files changed by the sync that are in paths.
+    """
+    result = []
+    for path in changed.keys():
+        for p in paths:
+            if path == p or (p.endswith("/") and path.startswith(p)):
+                result.append(path)
+                break
+    return result
+
 def run(api,args,logger):
 
     settings = api.settings()
@@ -28,6 +46,13 @@ def run(api,args,logger):
     restart_dhcp       = str(settings.restart_dhcp).lower()
     restart_dns        = str(settings.restart_dns).lower()
 
+    # the configuration files the sync changed, see
+    # BootSync.fingerprint_configs.  If this is unknown, everything
+    # is restarted.
+    changed = getattr(utils.sync_state(api), "changed_outputs", None)
+    def affected(paths):
+        return changed is None or len(changed_files(changed, paths)) > 0
+
     which_dhcp_module = module_loader.get_module_from_file("dhcp","module",just_name=True).strip()
     which_dns_module  = module_loader.get_module_from_file("dns","module",just_name=True).strip()
 
@@ -37,14 +62,19 @@ def run(api,args,logger):
     rc = 0
     if manage_dhcp != "0":
         if which_dhcp_module == "manage_isc":
-            if restart_dhcp != "0":
+            dhcpconf = utils.dhcpconf_location(api)
+            if restart_dhcp != "0" and not affected([ dhcpconf, os.path.join(os.path.dirname(dhcpconf), "cobbler.d/") ]):
+                logger.info("DHCP configuration unchanged, not restarting dhcpd")
+            elif restart_dhcp != "0":
                 rc = utils.subprocess_call(logger, "dhcpd -t -q", shell=True)
                 if rc != 0:
                    logger.error("dhcpd -t failed")
                    return 1
                 rc = utils.subprocess_call(logger,"/etc/rc.d/init.d/dhcpd restart", shell=True)
         elif which_dhcp_module == "manage_dnsmasq":
-            if restart_dhcp != "0":
+            if restart_dhcp != "0" and not affected(DNSMASQ_FILES):
+                logger.info("dnsmasq configuration unchanged, not restarting dnsmasq")
+            elif restart_dhcp != "0":
                 rc = utils.subprocess_call(logger, "/etc/rc.d/init.d/dnsmasq restart")
                 has_restarted_dnsmasq = True
         else:
@@ -53,9 +83,21 @@ def run(api,args,logger):
 
     if manage_dns != "0" and restart_dns != "0":
         if which_dns_module == "manage_bind":
-            rc = utils.subprocess_call(logger, "/etc/rc.d/init.d/named restart", shell=True)
+            if affected([ NAMED_CONF ]):
+                rc = utils.subprocess_call(logger, "/etc/rc.d/init.d/named restart", shell=True)
+            elif affected([ ZONE_DIR ]):
+                # only some zones changed, which can be reloaded alone
+                for path in changed_files(changed, [ ZONE_DIR ]):
+                    rc = utils.subprocess_call(logger, "rndc reload %s" % zone_name(settings, path), shell=True)
+                    if rc != 0:
+                        break
+            else:
+                logger.info("DNS configuration unchanged, not restarting named")
         elif which_dns_module == "manage_dnsmasq" and not has_restarted_dnsmasq:
-            rc = utils.subprocess_call(logger, "/etc/rc.d/init.d/dnsmasq restart", shell=True)
+            if affected(DNSMASQ_FILES):
+                rc = utils.subprocess_call(logger, "/etc/rc.d/init.d/dnsmasq restart", shell=True)
+            else:
+                logger.info("dnsmasq configuration unchanged, not restarting dnsmasq")
         elif which_dns_module == "manage_dnsmasq" and has_restarted_dnsmasq:
             rc = 0
         else:
@@ -64,3 +106,17 @@ def run(api,args,logger):
 
     return rc
 
+def zone_name(settings, path):
+    """
+    The name BIND knows the zone in a zone file written by manage_bind
+    by, which for reverse zones is the in-addr.arpa one.
+    """
+    zone = os.path.basename(path)
+    reverse_zones = settings.manage_reverse_zones
+    if type(reverse_zones) != type([]):
+        reverse_zones = [reverse_zones]
+    if zone in reverse_zones:
+        tokens = zone.split('.')
+        tokens.reverse()
+        zone = '.'.join(tokens) + '.in-addr.arpa'
+    return zone
@@ -0,0 +1,51 @@
+"""
+A PXE file worker process started afresh, for when the process running
+the sync cannot safely fork (see PXEGen.write_system_files_parallel).
+It reads the job (see PXEGen.worker_job) from stdin, loads the saved
+config and sends back what happened on stdout.
+
+Copyright 2006-2009, Red Hat, Inc
+Michael DeHaan <mdehaan@redhat.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301  USA
+"""
+
+import os
+import sys
+import simplejson
+
+def main():
+    job = simplejson.loads(sys.stdin.read())
+    # the result goes to the real stdout, anything else printed
+    # along the way to stderr
+    wfd = os.dup(1)
+    os.dup2(2, 1)
+
+    import api as cobbler_api
+    import pxegen
+    import clogger
+
+    api = cobbler_api.BootAPI()
+    if not api.perms_ok:
+        print >>sys.stderr, "cannot load the cobbler config"
+        return 1
+    gen = pxegen.PXEGen(api._config, clogger.BufferLogger())
+    systems = gen.start_worker(job)
+    gen.run_worker(systems, wfd)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
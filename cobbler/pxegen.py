@@ -23,6 +23,7 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 
 import os
 import os.path
+import stat
 import shutil
 import shlex
 import time
@@ -30,6 +31,7 @@ import sys
 import glob
 import traceback
 import errno
+import threading
 try:
     import subprocess as sub_process
 except:
@@ -40,6 +42,8 @@ import socket
 import utils
 from cexceptions import *
 import templar 
+import clogger
+import simplejson
 
 import item_distro
 import item_profile
@@ -125,7 +129,19 @@ class PXEGen:
     def copy_single_distro_files(self, d, dirtree, symlink_ok):
         distros = os.path.join(dirtree, "images")
         distro_dir = os.path.join(distros,d.name)
-        utils.mkdir(distro_dir)
+
+        # nothing to do if neither the kernel and initrd nor their links
+        # have changed since they were last linked into place
+        fingerprints = getattr(self.api, "distro_link_fingerprints", None)
+        if fingerprints is None:
+            fingerprints = self.api.distro_link_fingerprints = {}
+        fingerprint = self.__distro_fingerprint(d, distro_dir)
+        if fingerprint is not None and fingerprints.get(distro_dir, None) == fingerprint:
+            for x in fingerprint:
+                utils.note_output(self.api, x[0])
+            return
+
+        utils.mkdir(distro_dir, api=self.api)
         kernel = utils.find_kernel(d.kernel) # full path
         initrd = utils.find_initrd(d.initrd) # full path
 
@@ -151,13 +167,44 @@ class PXEGen:
             utils.linkfile(initrd, dst2, symlink_ok=symlink_ok, 
                     api=self.api, logger=self.logger)
 
+        if utils.dry_run(self.api) is not None:
+            # nothing was linked, so the files are as they were
+            return
+        fingerprint = self.__distro_fingerprint(d, distro_dir)
+        if fingerprint is not None:
+            fingerprints[distro_dir] = fingerprint
+        elif fingerprints.has_key(distro_dir):
+            del fingerprints[distro_dir]
+
+    def __distro_fingerprint(self, d, distro_dir):
+        """
+        Stat information for a distro's kernel and initrd and the links
+        to them in distro_dir, or None if they are not plain local files
+        or are not linked yet.
+        """
+        fingerprint = []
+        for src in [ d.kernel, d.initrd ]:
+            if utils.file_is_remote(src):
+                return None
+            dst = os.path.join(distro_dir, os.path.basename(src))
+            try:
+                st = os.stat(src)
+                dst_st = os.stat(dst)
+            except OSError:
+                return None
+            if not stat.S_ISREG(st.st_mode):
+                # a directory, for find_kernel or find_initrd to search
+                return None
+            fingerprint.append((dst, src, st.st_dev, st.st_ino, st.st_size, st.st_mtime, dst_st.st_dev, dst_st.st_ino, dst_st.st_mtime))
+        return fingerprint
+
     def copy_single_image_files(self, img):
         images_dir = os.path.join(self.bootloc, "images2")
         filename = img.file 
         if not os.path.exists(filename):
             # likely for virtual usage, cannot use
             return
-        if not os.path.exists(images_dir):
+        if not os.path.exists(images_dir) and utils.dry_run(self.api) is None:
             os.makedirs(images_dir)
         basename = os.path.basename(img.file)
         newfile = os.path.join(images_dir, img.name)
@@ -205,7 +252,7 @@ class PXEGen:
                 self.write_pxe_file(f2,system,profile,distro,distro.arch)
             else:
                 # ensure the file doesn't exist
-                utils.rmfile(f2)
+                utils.rmfile(f2, api=self.api)
             return
 
         # generate one record for each described NIC ..
@@ -246,9 +293,18 @@ class PXEGen:
 
                 # Link to the yaboot binary
                 f3 = os.path.join(self.bootloc, "ppc", filename)
-                if os.path.lexists(f3):
-                    utils.rmfile(f3)
-                os.symlink("../yaboot", f3)
+                utils.note_output(self.api, f3)
+                f3 = utils.staged_path(self.api, f3)
+                if not (os.path.islink(f3) and os.readlink(f3) == "../yaboot"):
+                    if utils.dry_run(self.api) is not None:
+                        if os.path.lexists(f3):
+                            utils.plan_file(self.api, f3, "changed")
+                        else:
+                            utils.plan_file(self.api, f3, "added")
+                    else:
+                        utils.rmfile(f3, api=self.api)
+                        os.symlink("../yaboot", f3)
+                        utils.count_stat(self.api, "files_written")
             else:
                 continue 
 
@@ -259,33 +315,237 @@ class PXEGen:
                     self.write_pxe_file(f2,system,None,None,working_arch,image=profile)
             else:
                 # ensure the file doesn't exist
-                utils.rmfile(f2)
+                utils.rmfile(f2, api=self.api)
+
+    def write_system_files_parallel(self,systems,processes=1):
+        """
+        Same as calling write_all_system_files for each of systems, but
+        shared out between processes worker processes.  Log messages
+        from the workers are passed back and logged here, one worker
+        after another, and so are the files they wrote, so sync's stale
+        file removal sees them.  Processes of 0 means one per CPU.
+
+        Where this is the only thread, the workers are forked and
+        inherit the loaded objects.  Forking a process that runs other
+        threads (cobblerd does) can leave the child stuck on a lock one
+        of those threads held, so there the workers are started afresh
+        (see pxe_worker.py) and load the saved config themselves.
+        """
+        systems = [x for x in systems]
+        processes = int(processes)
+        if processes < 1:
+            processes = utils.cpu_count()
+        processes = min(processes, len(systems))
+        if processes <= 1:
+            for x in systems:
+                self.write_all_system_files(x)
+            return
+
+        workers = []
+        if threading.activeCount() > 1:
+            self.logger.info("generating PXE files in %s new processes" % processes)
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pxe_worker.py")
+            for i in range(0, processes):
+                job = self.worker_job([x.name for x in systems[i::processes]])
+                p = sub_process.Popen([sys.executable, script], stdin=sub_process.PIPE, stdout=sub_process.PIPE, close_fds=True)
+                workers.append((p.pid, p.stdout, p.wait))
+                p.stdin.write(simplejson.dumps(job))
+                p.stdin.close()
+        else:
+            self.logger.info("generating PXE files in %s processes" % processes)
+            for i in range(0, processes):
+                (rfd, wfd) = os.pipe()
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        os.close(rfd)
+                        self.run_worker(systems[i::processes], wfd)
+                    finally:
+                        # never fall back into the parent's code
+                        os._exit(0)
+                os.close(wfd)
+                workers.append((pid, os.fdopen(rfd), lambda pid=pid: os.waitpid(pid, 0)))
+
+        errors = []
+        for (pid, fd, wait) in workers:
+            data = fd.read()
+            fd.close()
+            wait()
+            try:
+                result = simplejson.loads(data)
+            except ValueError:
+                errors.append(_("PXE worker process %s died") % pid)
+                continue
+            for (level, msg) in result["log"]:
+                getattr(self.logger, level)(msg)
+            for path in result["outputs"]:
+                utils.note_output(self.api, path)
+            for (key, amount) in result["stats"].iteritems():
+                utils.count_stat(self.api, key, amount)
+            for (change, paths) in result["plan"].iteritems():
+                for path in paths:
+                    utils.plan_file(self.api, path, change)
+            errors.extend(result["errors"])
+
+        if len(errors) > 0:
+            raise CX(_("error generating PXE files: %s") % "; ".join(errors))
+
+    def worker_job(self,names):
+        """
+        What a worker started afresh needs to know to take part in the
+        sync running in this thread (see start_worker), besides the
+        names of the systems to write files for.
+        """
+        state = utils.sync_state(self.api)
+        return {
+            "systems"  : names,
+            "staging"  : getattr(state, "staging", None),
+            "tracking" : getattr(state, "outputs", None) is not None,
+            "stats"    : getattr(state, "stats", None) is not None,
+            "dry_run"  : utils.dry_run(self.api) is not None
+        }
+
+    def start_worker(self,job):
+        """
+        Takes part in a sync as described by job (see worker_job) in a
+        worker process started afresh: sets up this thread's sync state
+        to match and returns the systems to write files for, which
+        are then passed to run_worker.  Systems that are gone are left
+        out.
+        """
+        state = utils.sync_state(self.api)
+        state.staging = job["staging"]
+        if job["tracking"]:
+            utils.track_outputs(self.api)
+        if job["stats"]:
+            state.stats = {}
+        if job["dry_run"]:
+            state.plan = { "added" : {}, "changed" : {}, "removed" : {} }
+        systems = []
+        for name in job["systems"]:
+            system = self.systems.get(name)
+            if system is not None:
+                systems.append(system)
+        return systems
+
+    def run_worker(self,systems,wfd):
+        """
+        Runs in a worker process: writes the files for systems and
+        sends back what happened through the file descriptor wfd.
+        """
+        buffer = clogger.BufferLogger()
+        self.logger = buffer
+        self.templar.logger = buffer
+        state = utils.sync_state(self.api)
+        tracking = getattr(state, "outputs", None) is not None
+        if tracking:
+            utils.track_outputs(self.api)
+        # counters and plan entries start afresh, to be added to
+        # the parent's
+        if getattr(state, "stats", None) is not None:
+            state.stats = {}
+        if utils.dry_run(self.api) is not None:
+            state.plan = { "added" : {}, "changed" : {}, "removed" : {} }
+        # a system that fails does not stop the others
+        errors = []
+        for x in systems:
+            try:
+                self.write_all_system_files(x)
+            except CX, e:
+                errors.append("%s: %s" % (x.name, e.value))
+            except:
+                utils.log_exc(buffer)
+                errors.append("%s: %s" % (x.name, sys.exc_info()[1]))
+        outputs = []
+        if tracking:
+            outputs = utils.track_outputs(self.api, False).keys()
+        stats = getattr(state, "stats", None) or {}
+        plan = {}
+        if utils.dry_run(self.api) is not None:
+            for (change, paths) in state.plan.iteritems():
+                plan[change] = paths.keys()
+        fd = os.fdopen(wfd, "w")
+        fd.write(simplejson.dumps({ "log" : buffer.messages, "outputs" : outputs, "stats" : stats, "plan" : plan, "errors" : errors }))
+        fd.close()
 
     def make_pxe_menu(self):
+        # forget the cached entries of profiles that are gone
+        fragments = self.menu_fragments()
+        for key in fragments.keys():
+            if self.profiles.find(name=key[1]) is None:
+                del fragments[key]
         self.make_s390_pseudo_pxe_menu()
         self.make_actual_pxe_menu() 
 
+    def menu_fragments(self):
+        """
+        Menu entries rendered by earlier menu builds, keyed by kind and
+        profile name, each stored with the menu_version it was rendered
+        from.  Kept on
+        the (shared) API handle so every PXEGen reuses them.
+        """
+        fragments = getattr(self.api, "pxe_menu_fragments", None)
+        if fragments is None:
+            fragments = self.api.pxe_menu_fragments = {}
+        return fragments
+
+    def forget_menu_fragments(self):
+        self.api.pxe_menu_fragments = {}
+
+    def menu_base_version(self, templates):
+        """
+        What every menu entry rendered with the given templates depends
+        on: the settings and the templates themselves.
+        """
+        version = [ self.settings.fingerprint() ]
+        for template in templates:
+            try:
+                version.append(os.path.getmtime(template))
+            except OSError:
+                version.append(None)
+        return version
+
+    def menu_version(self, profile, base):
+        """
+        Identifies everything a profile's menu entry is rendered from:
+        the profile and the parents it inherits from, plus base (see
+        menu_base_version).  Saving an object updates its mtime.
+        """
+        version = base[:]
+        obj = profile
+        while obj is not None:
+            version.append((obj.COLLECTION_TYPE, obj.name, obj.uid, obj.mtime))
+            obj = obj.get_parent()
+        return version
+
     def make_s390_pseudo_pxe_menu(self):
         s390path = os.path.join(self.bootloc, "s390x")
         if not os.path.exists(s390path):
-            utils.mkdir(s390path)
+            utils.mkdir(s390path, api=self.api)
         profile_list = [profile for profile in self.profiles]
         image_list = [image for image in self.images]
         def sort_name(a,b):
            return cmp(a.name,b.name)
         profile_list.sort(sort_name)
         image_list.sort(sort_name)
-        listfile = open(os.path.join(s390path, "profile_list"),"w+")
+        fragments = self.menu_fragments()
+        base = self.menu_base_version([ os.path.join(self.settings.pxe_template_dir,"pxeprofile_s390x.template"), "/etc/cobbler/pxe/s390x_conf.template", "/etc/cobbler/pxe/s390x_parm.template" ])
+        listfile = ""
         for profile in profile_list:
             distro = profile.get_conceptual_parent()
             if distro is None:
                 raise CX("profile is missing distribution: %s, %s" % (profile.name, profile.distro))
             if distro.arch.startswith("s390"):
-                listfile.write("%s\n" % profile.name)
+                listfile = listfile + "%s\n" % profile.name
                 f2 = os.path.join(self.bootloc, "s390x", "p_%s" % profile.name)
-                self.write_pxe_file(f2,None,profile,distro,distro.arch)
                 cf = "%s_conf" % f2
                 pf = "%s_parm" % f2
+                key = ("s390", profile.name)
+                version = self.menu_version(profile, base)
+                if self.__still_current(fragments.get(key, None), version, [ f2, cf, pf ]):
+                    continue
+                fragments[key] = None
+                self.write_pxe_file(f2,None,profile,distro,distro.arch)
                 template_cf = open("/etc/cobbler/pxe/s390x_conf.template")
                 template_pf = open("/etc/cobbler/pxe/s390x_parm.template")
                 blended = utils.blender(self.api, True, profile)
@@ -300,8 +560,24 @@ class PXEGen:
                 blended["kickstart_expanded"] = "ks=%s" % kickstart_path
                 blended["kernel_options"] = hkopts
                 self.templar.render(template_pf, blended, pf)
+                fragments[key] = (version, None)
+
+        utils.write_if_changed(os.path.join(s390path, "profile_list"), listfile, api=self.api)
 
-        listfile.close()
+    def __still_current(self, fragment, version, paths):
+        """
+        Whether the files rendered for a cached menu fragment are
+        up to date, so they need not be rendered again.  They are still
+        recorded as produced by the current sync, if one is running.
+        """
+        if fragment is None or fragment[0] != version:
+            return False
+        for path in paths:
+            if utils.staged_path(self.api, path) != path or not os.path.exists(path):
+                return False
+        for path in paths:
+            utils.note_output(self.api, path)
+        return True
 
     def make_actual_pxe_menu(self):
         # only do this if there is NOT a system named default.
@@ -322,7 +598,10 @@ class PXEGen:
         image_list = [image for image in self.images]
         image_list.sort(sort_name)
 
-        # build out the menu entries
+        # build out the menu entries, reusing those of profiles that
+        # have not changed since the menu was last built
+        fragments = self.menu_fragments()
+        base = self.menu_base_version([ os.path.join(self.settings.pxe_template_dir,"pxeprofile.template") ])
         pxe_menu_items = ""
         for profile in profile_list:
             if not profile.enable_menu:
@@ -333,7 +612,14 @@ class PXEGen:
             if distro.name.find("-xen") != -1 or distro.arch not in ["i386", "x86_64"]:
                 # can't PXE Xen
                 continue
-            contents = self.write_pxe_file(None,None,profile,distro,distro.arch,include_header=False)
+            key = ("menu", profile.name)
+            version = self.menu_version(profile, base)
+            fragment = fragments.get(key, None)
+            if fragment is not None and fragment[0] == version:
+                contents = fragment[1]
+            else:
+                contents = self.write_pxe_file(None,None,profile,distro,distro.arch,include_header=False)
+                fragments[key] = (version, contents)
             if contents is not None:
                 pxe_menu_items = pxe_menu_items + contents + "\n"
 
@@ -482,13 +768,11 @@ class PXEGen:
 
                         # Remove symlink to the yaboot binary
                         f3 = os.path.join(self.bootloc, "ppc", filename)
-                        if os.path.lexists(f3):
-                            utils.rmfile(f3)
+                        utils.rmfile(f3, api=self.api)
 
                         # Remove the interface-specific config file
                         f3 = os.path.join(self.bootloc, "etc", filename)
-                        if os.path.lexists(f3):
-                            utils.rmfile(f3)
+                        utils.rmfile(f3, api=self.api)
 
                     # Yaboot/OF doesn't support booting locally once you've
                     # booted off the network, so nothing left to do
@@ -619,9 +903,7 @@ class PXEGen:
         buffer = self.templar.render(template_data, metadata, None)
         if filename is not None:
             self.logger.info("generating: %s" % filename)
-            fd = open(filename, "w")
-            fd.write(buffer)
-            fd.close()
+            utils.write_if_changed(filename, buffer, api=self.api)
         return buffer
 
     def write_templates(self,obj,write_file=False,path=None):
@@ -695,7 +977,7 @@ class PXEGen:
                 dest_dir = os.path.join(self.settings.webdir, "rendered", dest_dir)
                 dest = os.path.join(dest_dir, os.path.basename(dest))
                 if not os.path.exists(dest_dir):
-                    utils.mkdir(dest_dir)
+                    utils.mkdir(dest_dir, api=self.api)
 
             # Check for problems
             if not os.path.exists(template):
@@ -723,9 +1005,7 @@ class PXEGen:
 
             if write_file:
                 self.logger.info("generating: %s" % dest)
-                fd = open(dest, "w")
-                fd.write(buffer)
-                fd.close()
+                utils.write_if_changed(dest, buffer, api=self.api)
 
         return results
 
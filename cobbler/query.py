@@ -0,0 +1,164 @@
+"""
+Search criteria for Collection.find, compiled once per search rather
+than re-parsed for every object searched.
+
+Copyright 2009, Red Hat, Inc
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301  USA
+"""
+
+import fnmatch
+import re
+import utils
+from cexceptions import *
+from utils import _
+
+# system fields stored per interface, which match if any interface matches
+INTERFACE_KEYS = [ "mac_address", "ip_address", "subnet", "virt_bridge", "dhcp_tag", "dns_name", "static_routes", "bonding", "bonding_opts", "bonding_master" ]
+
+# searchable fields of each object type, as in to_datastruct
+FIELD_NAMES = {}
+
+def field_names(obj):
+    names = FIELD_NAMES.get(obj.COLLECTION_TYPE, None)
+    if names is None:
+        names = {}
+        for elem in obj.get_fields():
+            k = elem[0]
+            if k.startswith("*") or k.find("widget") != -1:
+                continue
+            names[k] = 1
+        if obj.COLLECTION_TYPE == "system":
+            names["interfaces"] = 1
+        FIELD_NAMES[obj.COLLECTION_TYPE] = names
+    return names
+
+class Query:
+    """
+    A set of key=value criteria.  Values are fnmatch style patterns
+    compared case insensitively, or for list, hash and boolean fields
+    a string in the format the CLI accepts.  A leading "~" negates.
+    """
+
+    def __init__(self, criteria):
+        self.terms = []
+        self.exact = {}
+        for (key, value) in criteria.iteritems():
+            term = Term(key, value)
+            self.terms.append(term)
+            if term.literal is not None and not term.negate:
+                self.exact[key] = term.literal
+        # cheapest and most selective tests first, so match() can stop early
+        self.terms.sort(lambda a, b: cmp(a.cost, b.cost))
+
+    def match(self, obj):
+        fields = field_names(obj)
+        for term in self.terms:
+            if not term.match(obj, fields):
+                return False
+        return True
+
+class Term:
+
+    def __init__(self, key, value):
+        self.key       = key
+        self.negate    = False
+        self.literal   = None
+        self.pattern   = None
+        self.operands  = {}
+        self.interface = key in INTERFACE_KEYS
+
+        if value is not None and not isinstance(value, basestring):
+            value = str(value)
+        if value is not None and value.startswith("~"):
+            self.negate = True
+            value = value[1:]
+        self.value = value
+
+        if value is None:
+            # only checks the field exists
+            self.cost = 9
+        else:
+            lower = value.lower()
+            if lower.find("*") == -1 and lower.find("?") == -1 and lower.find("[") == -1:
+                self.literal = lower
+                self.cost = 1
+            else:
+                self.pattern = re.compile(fnmatch.translate(lower))
+                self.cost = 2
+            if self.interface:
+                self.cost = self.cost + 2
+            if self.negate:
+                self.cost = self.cost + 4
+
+    def match(self, obj, fields):
+        return self.__match(obj, fields) != self.negate
+
+    def __match(self, obj, fields):
+        if self.interface and obj.COLLECTION_TYPE == "system":
+            if self.value is None:
+                return True
+            for interface in obj.interfaces.itervalues():
+                data = interface.get(self.key, None)
+                if data is not None and self.__compare(data):
+                    return True
+            return False
+        if not fields.has_key(self.key):
+            return False
+        if self.value is None:
+            return True
+        return self.__compare(getattr(obj, self.key))
+
+    def __compare(self, from_obj):
+        if isinstance(from_obj, basestring):
+            if self.literal is not None:
+                return from_obj.lower() == self.literal
+            return self.pattern.match(from_obj.lower()) is not None
+
+        if type(from_obj) == type([]):
+            for x in self.__operand("list"):
+                if x not in from_obj:
+                    return False
+            return True
+
+        if type(from_obj) == type({}):
+            search = self.__operand("hash")
+            for x in search.keys():
+                if not from_obj.has_key(x):
+                    return False
+                if not (search[x] == from_obj[x]):
+                    return False
+            return True
+
+        if type(from_obj) == type(True):
+            return self.__operand("bool") == from_obj
+
+        raise CX(_("find cannot compare type: %s") % type(from_obj))
+
+    def __operand(self, kind):
+        """
+        The search value parsed for comparison with a list, hash or
+        boolean field, parsed on first use and then remembered.
+        """
+        if not self.operands.has_key(kind):
+            if kind == "list":
+                result = utils.input_string_or_list(self.value)
+            elif kind == "hash":
+                (junk, result) = utils.input_string_or_hash(self.value,allow_multiples=True)
+            else:
+                result = self.value.lower() in [ "true", "1", "y", "yes" ]
+            self.operands[kind] = result
+        return self.operands[kind]
@@ -33,7 +33,7 @@ try:
     import subprocess
 except:
     import sub_process as subprocess
-from threading import Thread
+from threading import Thread, Condition
 
 import api as cobbler_api
 import utils
@@ -45,6 +45,7 @@ import item_repo
 import item_image
 import clogger
 import pxegen
+import watcher
 import utils
 #from utils import * # BAD!
 from utils import _
@@ -95,6 +96,133 @@ class CobblerThread(Thread):
             self.remote._set_task_state(self,self.event_id,EVENT_FAILED)
             return False  
  
+class SyncQueue:
+    """
+    Runs the syncs requested over XMLRPC one at a time.  A request
+    made while no sync is running or waiting starts one right away.
+    Otherwise it joins the sync waiting to start, if there is one, so
+    what is asked for while a sync runs is done by a single run after
+    it, reported under a single task id.  That run waits until no
+    request has come in for sync_coalesce_window seconds, but no longer
+    than sync_coalesce_max_delay seconds after the first.  Dry runs are
+    only ever merged with other dry runs.
+    """
+
+    def __init__(self,remote):
+        self.remote   = remote
+        self.cond     = Condition()
+        self.pending  = []     # [ event_id, logger, options, first request time, last request time or None to start right away ]
+        self.running  = None
+        self.finished = {}     # event_id -> True on success
+        self.reports  = {}     # event_id -> what a profile or dry run found
+        self.worker   = None
+
+    def request(self,options):
+        if options is None:
+            options = {}
+        dry_run = bool(options.get("dry_run",False))
+        self.cond.acquire()
+        try:
+            entry = None
+            for x in self.pending:
+                if x[2]["dry_run"] == dry_run:
+                    entry = x
+                    self.remote._log("sync request merged into %s" % x[0])
+            now = time.time()
+            if entry is None:
+                (event_id, logatron) = self.remote._new_task("sync", "Sync")
+                last = now
+                if self.running is None and len(self.pending) == 0:
+                    # nothing to coalesce with
+                    last = None
+                entry = [ event_id, logatron, { "dry_run" : dry_run }, now, last ]
+                self.pending.append(entry)
+            elif entry[4] is not None:
+                entry[4] = now
+            (event_id, logatron, merged, first, last) = entry
+            flags = []
+            for key in [ "verbose", "full", "profile" ]:
+                if options.get(key,False):
+                    merged[key] = True
+                    flags.append(key)
+            if dry_run:
+                flags.append("dry_run")
+            logatron.info("sync requested (%s)" % (" ".join(flags) or "default"))
+            if self.worker is None:
+                self.worker = Thread(target=self.__work)
+                self.worker.start()
+            self.cond.notifyAll()
+            return event_id
+        finally:
+            self.cond.release()
+
+    def wait(self,event_id):
+        """
+        Blocks until the given sync has run, returning whether it worked.
+        """
+        self.cond.acquire()
+        try:
+            while not self.finished.has_key(event_id):
+                self.cond.wait()
+            return self.finished[event_id]
+        finally:
+            self.cond.release()
+
+    def forget(self,event_id):
+        self.cond.acquire()
+        try:
+            for table in [ self.finished, self.reports ]:
+                if table.has_key(event_id):
+                    del table[event_id]
+        finally:
+            self.cond.release()
+
+    def __start_time(self,entry):
+        (event_id, logatron, options, first, last) = entry
+        if last is None:
+            return first
+        settings = self.remote.api.settings()
+        return min(last + float(settings.sync_coalesce_window), first + float(settings.sync_coalesce_max_delay))
+
+    def __work(self):
+        while 1:
+            self.cond.acquire()
+            try:
+                while 1:
+                    if len(self.pending) == 0:
+                        self.worker = None
+                        return
+                    remaining = self.__start_time(self.pending[0]) - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                self.running = self.pending.pop(0)
+            finally:
+                self.cond.release()
+
+            (event_id, logatron, options, first, last) = self.running
+            ok = True
+            try:
+                rc = self.remote.api.sync(options.get("verbose",False),logger=logatron,full=options.get("full",False),
+                                          profile=options.get("profile",False),dry_run=options["dry_run"])
+                self.remote._set_task_state(None,event_id,EVENT_COMPLETE)
+                logatron.info("### TASK COMPLETE ###")
+            except:
+                utils.log_exc(logatron)
+                self.remote._set_task_state(None,event_id,EVENT_FAILED)
+                logatron.error("### TASK FAILED ###")
+                ok = False
+
+            self.cond.acquire()
+            try:
+                self.running = None
+                self.finished[event_id] = ok
+                if ok and type(rc) == type({}):
+                    self.reports[event_id] = rc
+                self.cond.notifyAll()
+            finally:
+                self.cond.release()
+
 # *********************************************************************
 # *********************************************************************
 
@@ -121,6 +249,10 @@ class CobblerXMLRPCInterface:
         random.seed(time.time())
         self.translator = utils.Translator(keep=string.printable)
         self.pxegen = pxegen.PXEGen(api._config,self.logger)
+        self.sync_queue = SyncQueue(self)
+        self.watcher = None
+        if self.api.settings().watch_config_changes:
+            self.watcher = watcher.Watcher(api, logger=self.logger)
 
     def check(self, token):
         """
@@ -175,15 +307,23 @@ class CobblerXMLRPCInterface:
         return self.__start_task(runner, token, "get_loaders", "Download Bootloader Content", options)
 
     def background_sync(self, options, token):
-        def runner(self):
-            return self.remote.api.sync(self.options.get("verbose",False),logger=self.logger)
-        return self.__start_task(runner, token, "sync", "Sync", options) 
+        """
+        Queues a sync.  Requests arriving within sync_coalesce_window
+        seconds of each other share one run and one task id.
+        """
+        self.check_access(token, "sync")
+        return self.sync_queue.request(options)
 
     def background_hardlink(self, options, token):
         def runner(self):
             return self.remote.api.hardlink(logger=self.logger)
         return self.__start_task(runner, token, "hardlink", "Hardlink", options)
 
+    def background_reserialize(self, options, token):
+        def runner(self):
+            return self.remote.api.reserialize(logger=self.logger)
+        return self.__start_task(runner, token, "reserialize", "Reserialize", options)
+
     def background_validateks(self, options, token):
         def runner(self):
             return self.remote.api.validateks(logger=self.logger)
@@ -311,12 +451,7 @@ class CobblerXMLRPCInterface:
         Returns a task id.
         """
         self.check_access(token, role_name)
-        event_id = self.__generate_event_id(role_name) # use short form for logfile suffix
-        event_id = str(event_id)
-        self.events[event_id] = [ float(time.time()), str(name), EVENT_RUNNING, [] ]
-        
-        self._log("start_task(%s); event_id(%s)"%(name,event_id))
-        logatron = clogger.Logger("/var/log/cobbler/tasks/%s.log" % event_id)
+        (event_id, logatron) = self._new_task(role_name, name)
 
         thr_obj = CobblerThread(event_id,self,logatron,args)
         thr_obj._run = thr_obj_fn
@@ -325,6 +460,26 @@ class CobblerXMLRPCInterface:
         thr_obj.start()
         return event_id
 
+    def _new_task(self, role_name, name):
+        """
+        Registers a new running task and opens its log.
+        Returns the task id and the logger.
+        """
+        event_id = self.__generate_event_id(role_name) # use short form for logfile suffix
+        event_id = str(event_id)
+        # ids only go down to the second, so number any further tasks
+        # started within it
+        count = 1
+        base = event_id
+        while self.events.has_key(event_id):
+            count = count + 1
+            event_id = "%s_%s" % (base, count)
+        self.events[event_id] = [ float(time.time()), str(name), EVENT_RUNNING, [] ]
+
+        self._log("start_task(%s); event_id(%s)"%(name,event_id))
+        logatron = clogger.Logger("/var/log/cobbler/tasks/%s.log" % event_id)
+        return (event_id, logatron)
+
     def _set_task_state(self,thread_obj,event_id,new_state):
         event_id = str(event_id)
         if self.events.has_key(event_id):
@@ -336,6 +491,26 @@ class CobblerXMLRPCInterface:
             if new_state == EVENT_FAILED: 
                 thread_obj.logger.error("### TASK FAILED ###")
 
+    def get_sync_report(self, event_id):
+        """
+        What a sync run with the profile or dry_run option found, see
+        action_sync.BootSync.make_report.
+        """
+        event_id = str(event_id)
+        report = self.sync_queue.reports.get(event_id, None)
+        if report is None:
+            raise CX("no sync report for that id")
+        # byte counts can be too large for an XMLRPC integer
+        report = report.copy()
+        phases = []
+        for phase in report.get("phases", []):
+            phase = phase.copy()
+            phase["bytes_written"] = float(phase["bytes_written"])
+            phases.append(phase)
+        if report.has_key("phases"):
+            report["phases"] = phases
+        return self.xmlrpc_hacks(report)
+
     def get_task_status(self, event_id):
         event_id = str(event_id)
         if self.events.has_key(event_id):
@@ -1479,6 +1654,7 @@ class CobblerXMLRPCInterface:
             (eventtime, name, status, who) = self.events[tid]
             if (timenow > eventtime + EVENT_TIMEOUT):
                 del self.events[tid]
+                self.sync_queue.forget(tid)
             # logfile cleanup should be dealt w/ by logrotate
 
     def __validate_user(self,input_user,input_password):
@@ -1611,10 +1787,12 @@ class CobblerXMLRPCInterface:
         do reposync this way.  Would be nice to send output over AJAX/other
         later.
         """
-        # FIXME: performance
         self._log("sync",token=token)
         self.check_access(token,"sync")
-        return self.api.sync()
+        event_id = self.sync_queue.request({})
+        if not self.sync_queue.wait(event_id):
+            raise CX(_("sync failed, see /var/log/cobbler/tasks/%s.log") % event_id)
+        return True
 
     def read_or_write_kickstart_template(self,kickstart_file,is_read,new_data,token):
         """
@@ -1755,6 +1933,12 @@ class ProxiedXMLRPCInterface:
 
         method_handle = getattr(self.proxied, method)
 
+        # pick up changes made by other processes before answering.
+        # The mod_wsgi services (services.py) and the web app hold no
+        # objects of their own, they read everything through here.
+        if self.proxied.watcher is not None:
+            self.proxied.watcher.refresh()
+
         # FIXME: see if this works without extra boilerplate
         try:
             return method_handle(*params)
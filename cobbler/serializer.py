@@ -31,96 +31,188 @@ import signal
 import time
 
 from cexceptions import *
+import clogger
 import api as cobbler_api
 
 LOCK_ENABLED = True
-LOCK_HANDLE = None
+LOCK_DIR = "/var/lib/cobbler"
+
+# waits on a collection lock longer than this many seconds get logged
+LOCK_WAIT_WARN = 1.0
+
+# running totals of time spent waiting on collection locks, see lock_stats()
+LOCK_STATS = {
+    "shared"        : 0,
+    "exclusive"     : 0,
+    "wait_time"     : 0.0,
+    "max_wait_time" : 0.0
+}
+
+# functions called with the previous and the new contents of .mtime
+# each time this process records a change, see watcher.Watcher
+MTIME_LISTENERS = []
 
 def handler(num,frame): 
    print >> sys.stderr, "Ctrl-C not allowed during writes.  Please wait."
    return True
     
-def __grab_lock():
+def __grab_lock(collection_type, exclusive=True):
     """
     Dual purpose locking:
     (A) flock to avoid multiple process access
     (B) block signal handler to avoid ctrl+c while writing YAML
+
+    Each collection has its own lock file, so writing a system does not
+    hold up a reader of distros.  Readers take a shared lock and only
+    mutations take the exclusive one, so concurrent read-only processes
+    no longer queue behind each other.  Returns the handle that must be
+    passed to __release_lock.
     """
     try:
-        if LOCK_ENABLED:
-            if not os.path.exists("/var/lib/cobbler/lock"):
-                fd = open("/var/lib/cobbler/lock","w+")
-                fd.close()
-            LOCK_HANDLE = open("/var/lib/cobbler/lock","r")
-            fcntl.flock(LOCK_HANDLE.fileno(), fcntl.LOCK_EX)
-        return True
+        if not LOCK_ENABLED:
+            return None
+        lockfile = "%s/lock.%s" % (LOCK_DIR, collection_type)
+        if not os.path.exists(lockfile):
+            fd = open(lockfile,"w+")
+            fd.close()
+        handle = open(lockfile,"r")
+        if exclusive:
+            mode = fcntl.LOCK_EX
+        else:
+            mode = fcntl.LOCK_SH
+        start = time.time()
+        fcntl.flock(handle.fileno(), mode)
+        __record_wait(collection_type, exclusive, time.time() - start)
+        return handle
     except:
         # this is pretty much FATAL, avoid corruption and quit now.
         traceback.print_exc()
         sys.exit(7)
 
-def __release_lock(with_changes=False):
+def __release_lock(handle, with_changes=False):
     if with_changes:
-        # this file is used to know when the last config change
-        # was made -- allowing the API to work more smoothly without
-        # a lot of unneccessary reloads.  
+        __touch_mtime()
+    if handle is not None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        handle.close()
+    return True
+
+def __touch_mtime():
+    """
+    This file is used to know when the last config change was made --
+    allowing the API to work more smoothly without a lot of
+    unneccessary reloads.  Its own lock makes reading the previous
+    value and writing the new one a single step, as writers of
+    different collections do not otherwise exclude each other.
+    """
+    mtime_lock = __grab_lock("mtime")
+    try:
+        try:
+            fd = open("/var/lib/cobbler/.mtime")
+            previous = float(fd.read().strip())
+            fd.close()
+        except (IOError, ValueError):
+            previous = None
+        data = "%f" % time.time()
         old = os.umask(0x777)
         fd = open("/var/lib/cobbler/.mtime","w")
-        fd.write("%f" % time.time())
+        fd.write(data)
         fd.close()
         os.umask(old)
-    if LOCK_ENABLED:
-        LOCK_HANDLE = open("/var/lib/cobbler/lock","r")
-        fcntl.flock(LOCK_HANDLE.fileno(), fcntl.LOCK_UN)
-        LOCK_HANDLE.close()
-    return True
+        for fn in MTIME_LISTENERS:
+            fn(previous, float(data))
+    finally:
+        if mtime_lock is not None:
+            fcntl.flock(mtime_lock.fileno(), fcntl.LOCK_UN)
+            mtime_lock.close()
+
+def __record_wait(collection_type, exclusive, elapsed):
+    """
+    Account for time spent blocked in flock.
+    """
+    if exclusive:
+        LOCK_STATS["exclusive"] = LOCK_STATS["exclusive"] + 1
+        kind = "exclusive"
+    else:
+        LOCK_STATS["shared"] = LOCK_STATS["shared"] + 1
+        kind = "shared"
+    LOCK_STATS["wait_time"] = LOCK_STATS["wait_time"] + elapsed
+    if elapsed > LOCK_STATS["max_wait_time"]:
+        LOCK_STATS["max_wait_time"] = elapsed
+    if elapsed > LOCK_WAIT_WARN:
+        try:
+            logger = clogger.Logger()
+            logger.warning("waited %0.2f seconds for %s lock on %s" % (elapsed, kind, collection_type))
+            logger.close()
+        except:
+            # logging must never break serialization
+            pass
+
+def lock_stats():
+    """
+    Return the lock wait counters for this process.
+    """
+    return LOCK_STATS.copy()
 
 def serialize(obj):
     """
     Save a collection to disk or other storage.  
     """
-    __grab_lock()
+    handle = __grab_lock(obj.collection_type())
     storage_module = __get_storage_module(obj.collection_type())
     storage_module.serialize(obj)
-    __release_lock()
+    __flush(storage_module)
+    __release_lock(handle)
     return True
 
 def serialize_item(collection, item):
     """
     Save an item.
     """
-    __grab_lock()
+    handle = __grab_lock(collection.collection_type())
     storage_module = __get_storage_module(collection.collection_type())
     save_fn = getattr(storage_module, "serialize_item", None)
     if save_fn is None:
         rc = storage_module.serialize(collection)
     else:
         rc = save_fn(collection,item)
-    __release_lock(with_changes=True)
+    __flush(storage_module)
+    __release_lock(handle, with_changes=True)
     return rc
 
 def serialize_delete(collection, item):
     """
     Delete an object from a saved state.
     """
-    __grab_lock()
+    handle = __grab_lock(collection.collection_type())
     storage_module = __get_storage_module(collection.collection_type())
     delete_fn = getattr(storage_module, "serialize_delete", None)
     if delete_fn is None:
         rc = storage_module.serialize(collection)
     else:
         rc = delete_fn(collection,item)
-    __release_lock(with_changes=True)
+    __flush(storage_module)
+    __release_lock(handle, with_changes=True)
     return rc
 
 def deserialize(obj,topological=True):
     """
     Fill in an empty collection from disk or other storage
     """
-    __grab_lock()
+    handle = __grab_lock(obj.collection_type(), exclusive=False)
     storage_module = __get_storage_module(obj.collection_type())
     rc = storage_module.deserialize(obj,topological)
-    __release_lock()
+    __release_lock(handle)
+    needs_fn = getattr(storage_module, "needs_migration", None)
+    if needs_fn is not None and needs_fn(obj.collection_type()):
+        # upgrading the stored format writes, so it takes the exclusive
+        # lock, and checks again as another process may have done it
+        # while this one waited
+        handle = __grab_lock(obj.collection_type())
+        if needs_fn(obj.collection_type()):
+            storage_module.migrate(obj)
+            __flush(storage_module)
+        __release_lock(handle, with_changes=True)
     return rc
 
 def deserialize_raw(collection_type):
@@ -129,29 +221,39 @@ def deserialize_raw(collection_type):
     disk state, without going through the Cobbler object system.
     Much faster, when you don't need the objects.
     """
-    __grab_lock()
+    handle = __grab_lock(collection_type, exclusive=False)
     storage_module = __get_storage_module(collection_type)
     rc = storage_module.deserialize_raw(collection_type)
-    __release_lock()
+    __release_lock(handle)
     return rc
 
 def deserialize_item(collection_type, item_name):
     """
     Get a specific record.
     """
-    __grab_lock()
+    handle = __grab_lock(collection_type, exclusive=False)
     storage_module = __get_storage_module(collection_type)
     rc = storage_module.deserialize_item(collection_type, item_name)
-    __release_lock()
+    __release_lock(handle)
     return rc
 
 def deserialize_item_raw(collection_type, item_name):
-    __grab_lock()
+    handle = __grab_lock(collection_type, exclusive=False)
     storage_module = __get_storage_module(collection_type)
     rc = storage_module.deserialize_item_raw(collection_type, item_name)
-    __release_lock()
+    __release_lock(handle)
     return rc
 
+def __flush(storage_module):
+    """
+    Storage modules that batch up their writes (see serializer_fsync)
+    commit them here, at the end of the transaction, while the lock is
+    still held.
+    """
+    flush_fn = getattr(storage_module, "flush", None)
+    if flush_fn is not None:
+        flush_fn()
+
 def __get_storage_module(collection_type):
     """
     Look up serializer in /etc/cobbler/modules.conf
@@ -163,6 +265,5 @@ def __get_storage_module(collection_type):
         return capi.get_module_by_name("serializer_couch")
 
 if __name__ == "__main__":
-    __grab_lock()
-    __release_lock()
+    __release_lock(__grab_lock("settings"))
 
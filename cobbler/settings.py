@@ -50,6 +50,7 @@ DEFAULTS = {
     "default_virt_file_size"      : "5",
     "default_virt_ram"            : "512",
     "default_ownership"           : [ "admin" ],
+    "dhcp_tag_fragments"          : 0,
     "enable_menu"                 : 1,
     "func_master"                 : "overlord.example.org",
     "func_auto_setup"             : 0,
@@ -82,6 +83,7 @@ DEFAULTS = {
     "power_management_default_type" : "ipmitool",
     "power_template_dir"          : "/etc/cobbler/power",
     "pxe_just_once"               : 0,
+    "pxe_menu_rebuild_delay"      : 2,
     "pxe_template_dir"            : "/etc/cobbler/pxe",
     "redhat_management_permissive" : 0,
     "redhat_management_type"      : "off",
@@ -94,10 +96,16 @@ DEFAULTS = {
     "run_install_triggers"        : 1,
     "scm_track_enabled"           : 0,
     "scm_track_mode"              : "git",
+    "serializer_fsync"            : "none",
+    "serializer_shard_depth"      : 0,
     "server"                      : "127.0.0.1",
     "snippetsdir"                 : "/var/lib/cobbler/snippets",
+    "sync_coalesce_max_delay"     : 30,
+    "sync_coalesce_window"        : 5,
+    "sync_processes"              : 1,
     "template_remote_kickstarts"  : 0,
     "virt_auto_boot"              : 0,
+    "watch_config_changes"        : 0,
     "webdir"                      : "/var/www/cobbler",
     "xmlrpc_port"                 : 25151,
     "yum_post_install_mirror"     : 1,
@@ -124,6 +132,7 @@ class Settings:
        Reset this object to reasonable default values.
        """
        self._attributes = DEFAULTS
+       self._fingerprint = None
 
    def printable(self):
        buf = ""
@@ -147,9 +156,20 @@ class Settings:
   
        self._attributes = DEFAULTS
        self._attributes.update(datastruct)
+       self._fingerprint = None
 
        return self
 
+   def fingerprint(self):
+       """
+       A string that changes whenever the settings are loaded with
+       different values, for caching what is rendered from them (see
+       pxegen.PXEGen.menu_base_version).  Worked out once per load.
+       """
+       if self._fingerprint is None:
+           self._fingerprint = repr(sorted(self._attributes.items()))
+       return self._fingerprint
+
    def __getattr__(self,name):
        if self._attributes.has_key(name):
            if name == "kernel_options":
@@ -71,6 +71,9 @@ class Templar:
         subject is a profile or system object, if available (for snippet eval)
         """
 
+        api = getattr(self, "api", None)
+        utils.count_stat(api, "templates_rendered")
+
         if not isinstance(data_input, basestring):
            raw_data = data_input.read()
         else:
@@ -149,9 +152,7 @@ class Templar:
             data_out = data_out.lstrip()
 
         if out_path is not None:
-            utils.mkdir(os.path.dirname(out_path))
-            fd = open(out_path, "w+")
-            fd.write(data_out)
-            fd.close()
+            utils.mkdir(os.path.dirname(out_path), api=api)
+            utils.write_if_changed(out_path, data_out, api=api)
 
         return data_out
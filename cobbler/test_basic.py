@@ -8,12 +8,18 @@ import os
 import tempfile
 import shutil
 import traceback
+import threading
 
 from cexceptions import *  
 
 import modules.authz_ownership as authz_module
+import modules.manage_dnsmasq as dnsmasq_module
+import modules.manage_bind as bind_module
+import modules.manage_isc as isc_module
 import api
 import config
+import pxegen
+import clogger
 import utils
 utils.TEST_MODE = True
 
@@ -801,6 +807,262 @@ class SyncContents(BootTest):
         fh.close()
 
 
+class ParallelPXEFiles(BootTest):
+
+    def test_workers_run_beside_other_threads(self):
+        # as inside cobblerd, where the workers cannot be forked and
+        # have to be started afresh
+        names = []
+        for x in range(0,4):
+            system = self.api.new_system()
+            self.assertTrue(system.set_name("parallel%s" % x))
+            self.assertTrue(system.set_mac_address("BB:EE:EE:EE:EE:0%s" % x,"eth0"))
+            self.assertTrue(system.set_profile("testprofile0"))
+            self.assertTrue(self.api.add_system(system))
+            names.append("parallel%s" % x)
+        pxedir = os.path.join(utils.tftpboot_location(), "pxelinux.cfg")
+        paths = [ os.path.join(pxedir, "01-bb-ee-ee-ee-ee-0%s" % x) for x in range(0,4) ]
+        for path in paths:
+            os.unlink(path)
+
+        logger = clogger.BufferLogger()
+        gen = pxegen.PXEGen(self.api._config, logger)
+        done = threading.Event()
+        other = threading.Thread(target=done.wait)
+        other.start()
+        try:
+            gen.write_system_files_parallel([self.api.find_system(name=x) for x in names], 2)
+        finally:
+            done.set()
+            other.join()
+
+        self.assertTrue(("info", "generating PXE files in 2 new processes") in logger.messages)
+        for path in paths:
+            self.assertTrue(os.path.exists(path))
+        for x in range(0,4):
+            self.assertTrue(self.api.remove_system("parallel%s" % x))
+
+
+class Finds(BootTest):
+
+    def test_find_semantics(self):
+        systems = self.api.systems()
+        system = self.api.find_system(name="testsystem0")
+        self.assertTrue(system.set_ks_meta("tree=http://example.org/tree color=red"))
+        self.assertTrue(self.api.add_system(system))
+
+        # names, exact or as patterns, ignoring case, and negated
+        self.assertTrue(systems.find(name="TestSystem0") is not None)
+        self.assertTrue(system in systems.find(name="testsys*", return_list=True))
+        self.assertTrue(system in systems.find(name="TESTSYSTEM?", return_list=True))
+        self.assertFalse(system in systems.find(name="~testsystem0", return_list=True))
+        self.assertEquals(systems.find(name="testsystem0", return_list=True), [system])
+
+        # interface fields match if any interface does
+        self.assertEquals(systems.find(mac_address="bb:ee:ee:ee:ee:ff", return_list=True), [system])
+        self.assertEquals(systems.find(mac="BB:EE:EE:EE:EE:FF", return_list=True), [system])
+        self.assertEquals(systems.find(ip="192.51.51.50"), system)
+
+        # every criterion has to match
+        self.assertTrue(systems.find(name="testsystem0", profile="testprofile0") is not None)
+        self.assertTrue(systems.find(name="testsystem0", profile="testprofile9") is None)
+        self.assertTrue(systems.find(name="testsystem0", mac_address="BB:EE:EE:EE:EE:00") is None)
+        profile = self.api.find_profile(name="testprofile0")
+        self.assertTrue(profile in self.api.find_profile(distro="testdistro0", return_list=True))
+        self.assertFalse(profile in self.api.find_profile(distro="~testdistro0", return_list=True))
+
+        # hashes match on the given keys, booleans on any of their spellings
+        self.assertTrue(systems.find(name="testsystem0", ksmeta="color=red") is not None)
+        self.assertTrue(systems.find(name="testsystem0", ks_meta="color=blue") is None)
+        self.assertTrue(systems.find(name="testsystem0", netboot_enabled="yes") is not None)
+        self.assertTrue(systems.find(name="testsystem0", netboot_enabled="0") is None)
+
+        # no criteria is an error
+        self.failUnlessRaises(CX, systems.find)
+
+class IndexUpkeep(BootTest):
+
+    def test_rename_and_remove(self):
+        systems = self.api.systems()
+        mac = "BB:EE:EE:EE:EE:FF"
+        self.assertEquals(systems.find(mac_address=mac).name, "testsystem0")
+
+        # a renamed system is found by its new name only
+        self.assertTrue(self.api.rename_system(self.api.find_system(name="testsystem0"), "testsystem9"))
+        self.assertEquals([x.name for x in systems.find(mac_address=mac, return_list=True)], ["testsystem9"])
+
+        # an address that was changed is no longer found
+        system = self.api.find_system(name="testsystem9")
+        self.assertTrue(system.set_mac_address("BB:EE:EE:EE:EE:09","eth0"))
+        self.assertTrue(self.api.add_system(system))
+        self.assertTrue(systems.find(mac_address=mac) is None)
+        self.assertEquals(systems.find(mac_address="bb:ee:ee:ee:ee:09").name, "testsystem9")
+
+        # nor is a removed system, and the index forgets it
+        self.assertTrue(self.api.remove_system("testsystem9"))
+        self.assertTrue(systems.find(mac_address="BB:EE:EE:EE:EE:09") is None)
+        self.assertFalse(systems.indexes["mac_address"].has_key("bb:ee:ee:ee:ee:09"))
+        self.assertFalse(systems.indexed.has_key("testsystem9"))
+
+class StaleFiles(BootTest):
+
+    def __write(self, path):
+        fd = open(path, "w")
+        fd.write("stale?")
+        fd.close()
+
+    def test_stale_files_removed(self):
+        top = tempfile.mkdtemp()
+        try:
+            self.__check(top)
+        finally:
+            shutil.rmtree(top, ignore_errors=True)
+
+    def __check(self, top):
+        os.makedirs(os.path.join(top, "old", "empty"))
+        os.makedirs(os.path.join(top, ".link_cache"))
+        for x in [ "current", "stale", "old/stale", ".link_cache/cached" ]:
+            self.__write(os.path.join(top, x))
+        outputs = { os.path.join(top, "current") : 1 }
+
+        sync = self.api.get_sync()
+        sync.generated_dirs = lambda: [ top ]
+
+        # a dry run only plans the removals
+        sync.dry_run = True
+        plan = { "added" : {}, "changed" : {}, "removed" : {} }
+        utils.sync_state(self.api).plan = plan
+        try:
+            sync.remove_stale_files(outputs)
+        finally:
+            utils.sync_state(self.api).plan = None
+        self.assertEquals(sorted(plan["removed"].keys()), [ os.path.join(top, "old", "stale"), os.path.join(top, "stale") ])
+        self.assertTrue(os.path.exists(os.path.join(top, "stale")))
+
+        # a real one removes what this sync did not produce, and the
+        # directories left empty, but not the link cache
+        sync.dry_run = False
+        sync.remove_stale_files(outputs)
+        self.assertTrue(os.path.exists(os.path.join(top, "current")))
+        self.assertFalse(os.path.exists(os.path.join(top, "stale")))
+        self.assertFalse(os.path.exists(os.path.join(top, "old")))
+        self.assertTrue(os.path.exists(os.path.join(top, ".link_cache", "cached")))
+
+class HostTables(BootTest):
+
+    def test_add_and_remove(self):
+        top = tempfile.mkdtemp()
+        try:
+            self.__check(os.path.join(top, "ethers"))
+        finally:
+            shutil.rmtree(top, ignore_errors=True)
+
+    def __check(self, path):
+        table = dnsmasq_module.HostTable(path)
+        table.set("s2", "BB:EE:EE:EE:EE:02\t192.51.51.52\n")
+        table.set("s1", "BB:EE:EE:EE:EE:01\t192.51.51.51\n")
+        table.write(None)
+        self.assertEquals(open(path).read(), "BB:EE:EE:EE:EE:01\t192.51.51.51\nBB:EE:EE:EE:EE:02\t192.51.51.52\n")
+
+        # systems without lines, or with the same ones, change nothing
+        # and the file is left alone
+        os.unlink(path)
+        table.set("s3", "")
+        table.set("s1", "BB:EE:EE:EE:EE:01\t192.51.51.51\n")
+        table.write(None)
+        self.assertFalse(os.path.exists(path))
+
+        table.set("s1", "")
+        table.set("s2", "BB:EE:EE:EE:EE:02\t192.51.51.62\n")
+        table.write(None)
+        self.assertEquals(open(path).read(), "BB:EE:EE:EE:EE:02\t192.51.51.62\n")
+
+class ZoneChanges(BootTest):
+
+    def test_only_changed_zones_written(self):
+        settings = self.api.settings()
+        top = tempfile.mkdtemp()
+        saved = (bind_module.NAMED_CONF, bind_module.ZONE_DIR, bind_module.ZONE_STATE)
+        bind_module.NAMED_CONF = os.path.join(top, "named.conf")
+        bind_module.ZONE_DIR = top
+        bind_module.ZONE_STATE = os.path.join(top, "zone_state")
+        settings.manage_forward_zones = [ "zonetest.example.org", "zonetest.example.net" ]
+        settings.manage_reverse_zones = []
+        try:
+            system = self.api.find_system(name="testsystem0")
+            self.assertTrue(system.set_dns_name("test0.zonetest.example.org","eth0"))
+            manager = bind_module.get_manager(self.api._config, None)
+            org = os.path.join(top, "zonetest.example.org")
+            net = os.path.join(top, "zonetest.example.net")
+
+            self.assertEquals(sorted(manager.write_dns_files()), [ "zonetest.example.net", "zonetest.example.org" ])
+            self.assertTrue(open(org).read().find("192.51.51.50") != -1)
+            self.assertEquals(manager.write_dns_files(), [])
+
+            # only the zone holding the record is written, with a new serial
+            old_org = open(org).read()
+            old_net = open(net).read()
+            self.assertTrue(system.set_ip_address("192.51.51.59","eth0"))
+            self.assertEquals(manager.write_dns_files(), [ "zonetest.example.org" ])
+            self.assertTrue(open(org).read().find("192.51.51.59") != -1)
+            self.assertNotEquals(open(org).read(), old_org)
+            self.assertEquals(open(net).read(), old_net)
+
+            # a zone file that went missing is written again
+            os.unlink(net)
+            self.assertEquals(manager.write_dns_files(), [ "zonetest.example.net" ])
+            self.assertTrue(os.path.exists(net))
+        finally:
+            (bind_module.NAMED_CONF, bind_module.ZONE_DIR, bind_module.ZONE_STATE) = saved
+            del settings.manage_forward_zones
+            del settings.manage_reverse_zones
+            shutil.rmtree(top, ignore_errors=True)
+
+class DhcpFragments(BootTest):
+
+    def __template(self, top, name, data):
+        path = os.path.join(top, name)
+        fd = open(path, "w")
+        fd.write(data)
+        fd.close()
+        return path
+
+    def test_only_changed_fragments_written(self):
+        settings = self.api.settings()
+        top = tempfile.mkdtemp()
+        saved = (isc_module.DHCP_TEMPLATE, isc_module.TAG_TEMPLATE, isc_module.DHCP_STATE)
+        isc_module.DHCP_TEMPLATE = self.__template(top, "dhcp.template", "#for include in $dhcp_includes:\ninclude \"$include\";\n#end for\n")
+        isc_module.TAG_TEMPLATE = self.__template(top, "dhcp_tag.template", "#for mac in $dhcp_tags[$dhcp_tag].keys():\nhost $mac\n#end for\n")
+        isc_module.DHCP_STATE = os.path.join(top, "dhcp_state")
+        settings.dhcp_tag_fragments = 1
+        try:
+            system = self.api.find_system(name="testsystem0")
+            self.assertTrue(system.set_dhcp_tag("fragtest","eth0"))
+            manager = isc_module.get_manager(self.api._config, None)
+            manager.settings_file = os.path.join(top, "dhcpd.conf")
+            fragments = os.path.join(top, "cobbler.d")
+            fragment = os.path.join(fragments, "fragtest.conf")
+
+            self.assertTrue(manager.write_dhcp_file())
+            self.assertTrue(open(fragment).read().lower().find("bb:ee:ee:ee:ee:ff") != -1)
+            self.assertTrue(open(manager.settings_file).read().find(fragment) != -1)
+            self.assertFalse(manager.write_dhcp_file())
+
+            # moving the host to another tag writes its fragment and
+            # removes the old one, but no file sync did not write
+            self.__template(top, os.path.join("cobbler.d", "local.conf"), "# not cobbler's\n")
+            self.assertTrue(system.set_dhcp_tag("fragtest2","eth0"))
+            self.assertTrue(manager.write_dhcp_file())
+            self.assertFalse(os.path.exists(fragment))
+            self.assertTrue(open(os.path.join(fragments, "fragtest2.conf")).read().lower().find("bb:ee:ee:ee:ee:ff") != -1)
+            self.assertTrue(os.path.exists(os.path.join(fragments, "local.conf")))
+            self.assertFalse(manager.write_dhcp_file())
+        finally:
+            (isc_module.DHCP_TEMPLATE, isc_module.TAG_TEMPLATE, isc_module.DHCP_STATE) = saved
+            del settings.dhcp_tag_fragments
+            shutil.rmtree(top, ignore_errors=True)
+
+
 class Deletions(BootTest):
 
     #def test_invalid_delete_profile_doesnt_exist(self):
@@ -23,7 +23,6 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 import sys
 import os
 import re
-import copy
 import socket
 import glob
 import random
@@ -42,6 +41,7 @@ import signal
 from cexceptions import *
 import codes
 import time
+import threading
 import netaddr
 import shlex
 import field_info
@@ -54,11 +54,16 @@ try:
     import hashlib as fiver
     def md5(key):
         return fiver.md5(key)
+    def sha1(key=""):
+        return fiver.sha1(key)
 except ImportError: 
     # for Python < 2.5
     import md5 as fiver
+    import sha
     def md5(key):
         return fiver.md5(key)
+    def sha1(key=""):
+        return sha.new(key)
 
 # python-netaddr 0.7 broke backward compatability, try to use the old IP
 # classes, and fallback on the newer if there's an import error.
@@ -288,7 +293,7 @@ def get_random_mac(api_handle,virt_type="xenpv"):
         
     mac = ':'.join(map(lambda x: "%02x" % x, mac))
     systems = api_handle.systems()
-    while ( systems.find(mac_address=mac) ):
+    while ( systems.find_by_interface("mac_address", mac) ):
         mac = get_random_mac(api_handle)
 
     return mac
@@ -604,6 +609,7 @@ def blender(api_handle,remove_hashes, root_obj):
     consolidated data.
     """
  
+    count_stat(api_handle, "blender_calls")
     settings = api_handle.settings()
     tree = grab_tree(api_handle, root_obj)
     tree.reverse()  # start with top of tree, override going down
@@ -760,7 +766,22 @@ def __consolidate(node,results):
     for key in node_data:
        value = node_data[key]
        if value != "<<inherit>>":
-          if isinstance(value, dict):
+          if key == "interfaces":
+              # the interfaces are shared with the system (copy on write,
+              # see item_system), so whoever gets the blended data, such
+              # as a template, gets copies it is free to change
+              interfaces = {}
+              for (name, interface) in value.iteritems():
+                  interface = interface.copy()
+                  # such as static_routes
+                  for (field, data) in interface.items():
+                      if isinstance(data, list):
+                          interface[field] = data[:]
+                      elif isinstance(data, dict):
+                          interface[field] = data.copy()
+                  interfaces[name] = interface
+              node_data_copy[key] = interfaces
+          elif isinstance(value, dict):
               node_data_copy[key] = value.copy()
           elif isinstance(value, list):
               node_data_copy[key] = value[:]
@@ -1016,33 +1037,107 @@ def is_safe_to_hardlink(src,dst,api):
     # we're dealing with SELinux and files that are not safe to chcon
     return False
 
-def hashfile(fn, lcache=None, logger=None):
+# files are hashed this much at a time
+HASH_BUFFER = 1024*1024
+
+def hashfile(fn, lcache=None, api=None, logger=None):
     """
-    Returns the sha1sum of the file
+    Returns the sha1sum of the file, or None if it does not exist.
+    With lcache, sums are remembered in the index of that link cache,
+    keyed by the device, inode, size and mtime of the file, so a file
+    is only read again once it has changed.
     """
-
-    db = {}
     try:
-        dbfile = os.path.join(lcache,'link_cache.json')
-        if os.path.exists(dbfile):
-            db = simplejson.load(open(dbfile, 'r'))
+        st = os.stat(fn)
+    except OSError:
+        return None
+    stamp = "%d:%d:%d:%r" % (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+    index = None
+    if lcache is not None:
+        index = link_cache_index(lcache, api)
+        if index.has_key(stamp):
+            return index[stamp]
+
+    digest = sha1()
+    fd = open(fn, "rb")
+    while True:
+        data = fd.read(HASH_BUFFER)
+        if not data:
+            break
+        digest.update(data)
+    fd.close()
+    key = digest.hexdigest()
+
+    if index is not None:
+        index[stamp] = key
+        if getattr(api, "link_caches", None) is None:
+            # not inside a sync, so nothing will save it later
+            save_link_cache_index(lcache, index, api)
+    return key
+
+def load_link_caches(api):
+    """
+    Keep the index of each link cache used (see hashfile) in memory
+    from now on, and write them out only when save_link_caches is
+    called, rather than after every file hashed.
+    """
+    api.link_caches = {}
+
+def save_link_caches(api):
+    caches = getattr(api, "link_caches", None)
+    api.link_caches = None
+    if caches:
+        for (lcache, index) in caches.iteritems():
+            save_link_cache_index(lcache, index, api)
+
+def link_cache_index(lcache, api=None):
+    """
+    The index of the link cache in directory lcache, mapping file
+    stamps to sha1sums, as kept in memory by load_link_caches or else
+    read from disk.
+    """
+    caches = getattr(api, "link_caches", None)
+    if caches is not None and caches.has_key(lcache):
+        return caches[lcache]
+    index = {}
+    try:
+        fd = open(os.path.join(lcache, "link_cache.json"))
+        index = simplejson.loads(fd.read())
+        fd.close()
     except:
         pass
+    if caches is not None:
+        caches[lcache] = index
+    return index
 
-    mtime = os.stat(fn).st_mtime
-    if db.has_key(fn):
-        if db[fn][0] >= mtime:
-            return db[fn][1]
-
-    if os.path.exists(fn):
-        cmd = '/usr/bin/sha1sum %s'%fn
-        key = subprocess_get(logger,cmd).split(' ')[0]
-        if lcache is not None:
-            db[fn] = (mtime,key)
-            simplejson.dump(db, open(dbfile,'w'))
-        return key
-    else:
-        return None
+def save_link_cache_index(lcache, index, api=None):
+    # a dry run leaves the disk alone, index included
+    if dry_run(api) is None:
+        write_if_changed(os.path.join(lcache, "link_cache.json"), simplejson.dumps(index), api=api)
+
+def sweep_link_cache(lcache, api=None, logger=None):
+    """
+    Remove the files in the link cache that nothing links to anymore,
+    and forget the sums of files not in the cache.
+    """
+    if not os.path.isdir(lcache):
+        return
+    present = {}
+    for f in os.listdir(lcache):
+        path = os.path.join(lcache, f)
+        if f == "link_cache.json" or not os.path.isfile(path):
+            continue
+        if os.stat(path).st_nlink == 1:
+            rmfile(path, logger=logger, api=api)
+        else:
+            present[f] = 1
+    index = link_cache_index(lcache, api)
+    for (stamp, key) in index.items():
+        if not isinstance(key, basestring) or not present.has_key(key):
+            del index[stamp]
+    if getattr(api, "link_caches", None) is None:
+        save_link_cache_index(lcache, index, api)
 
 def cachefile(src, dst, api=None, logger=None):
     """
@@ -1051,19 +1146,221 @@ def cachefile(src, dst, api=None, logger=None):
     copying data twice if the cache is not on the same device
     as the destination
     """
+    # the cache is next to the live tree, not in staging
     lcache = os.path.join(os.path.dirname(os.path.dirname(dst)),'.link_cache')
+    dst = staged_path(api, dst)
     if not os.path.isdir(lcache):
         os.mkdir(lcache)
-    key = hashfile(src, lcache=lcache, logger=logger)
+    key = hashfile(src, lcache=lcache, api=api, logger=logger)
     cachefile = os.path.join(lcache, key)
     if not os.path.exists(cachefile):
         logger.info("trying to create cache file %s"%cachefile)
         copyfile(src,cachefile,api=api,logger=logger)
 
+    if os.path.exists(dst):
+        if os.path.samefile(cachefile, dst):
+            # linked by an earlier sync and src has not changed since
+            return True
+        # left over from an older version of src
+        os.remove(dst)
+
     logger.info("trying cachelink %s -> %s -> %s"%(src,cachefile,dst))
     rc = os.link(cachefile,dst)
+    count_stat(api, "files_written")
     return rc
 
+def cpu_count():
+    """
+    The number of CPUs online, or 1 if that can't be found out.
+    """
+    try:
+        return max(int(os.sysconf("SC_NPROCESSORS_ONLN")), 1)
+    except (ValueError, OSError, AttributeError):
+        return 1
+
+def sync_state(api):
+    """
+    What the sync running in this thread keeps track of as it goes:
+    the "outputs" it produced (see track_outputs), where its "staging"
+    directories are (see staged_path), its "stats" (see count_stat),
+    its dry run "plan" (see dry_run) and the "changed_outputs" for its
+    triggers.  Each is None when not in use.  The thread's batch depth
+    is kept here too, see batch_depth.
+
+    This is kept on the (shared) API handle, as modules loaded by
+    module_loader get their own copy of this module, but per thread,
+    so that a lite sync or menu rebuild in another thread of cobblerd
+    is neither tracked, counted nor planned as part of the sync.
+    Returns None for no API handle.
+    """
+    if api is None:
+        return None
+    state = getattr(api, "thread_sync_state", None)
+    if state is None:
+        state = api.thread_sync_state = threading.local()
+    return state
+
+def batch_depth(api):
+    """
+    How many batches (see BootAPI.begin_batch) the calling thread is
+    in.  Batches are per thread, so one client's batch inside cobblerd
+    does not hold up the files and menu rebuilds of any other.
+    """
+    return getattr(sync_state(api), "batch_depth", 0)
+
+def track_outputs(api, enable=True):
+    """
+    Start (or with enable=False, stop) recording the path of every file
+    written or found already up to date by write_if_changed, linkfile
+    and copyfile, so that a sync can tell which of the files already
+    on disk it did not produce.  Returns what the previous tracking
+    recorded, as a hash keyed by path.
+    """
+    state = sync_state(api)
+    previous = getattr(state, "outputs", None)
+    if enable:
+        state.outputs = {}
+    else:
+        state.outputs = None
+    return previous
+
+def note_output(api, path):
+    """
+    Record path as produced by the current sync, if one is tracking.
+    """
+    outputs = getattr(sync_state(api), "outputs", None)
+    if outputs is not None:
+        outputs[os.path.normpath(path)] = 1
+
+def staged_path(api, path):
+    """
+    Where a file that belongs under one of the trees a full sync is
+    rebuilding in a staging directory should really be written (see
+    action_sync.BootSync.start_staging), else path unchanged.  The
+    file helpers below (write_if_changed, linkfile, copyfile, rmfile,
+    rmtree and mkdir) all apply it when given the API handle, so
+    that a full sync leaves the live trees alone.
+    """
+    staging = getattr(sync_state(api), "staging", None)
+    if staging:
+        for (live, stage) in staging.iteritems():
+            if path.startswith(live + os.sep):
+                return stage + path[len(live):]
+    return path
+
+# what a profiled sync counts, see count_stat
+SYNC_STATS = [ "files_written", "bytes_written", "templates_rendered", "blender_calls" ]
+
+def count_stat(api, key, amount=1):
+    """
+    Add amount to one of the SYNC_STATS, if a sync is being profiled
+    (see action_sync.SyncProfile).
+    """
+    stats = getattr(sync_state(api), "stats", None)
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + amount
+
+def dry_run(api):
+    """
+    The plan of a sync that only works out what it would do, or None
+    if files are really being written.  The plan holds the paths that
+    would be "added", "changed" and "removed", each as a hash keyed
+    by path.
+    """
+    return getattr(sync_state(api), "plan", None)
+
+def plan_file(api, path, change):
+    dry_run(api)[change][os.path.normpath(path)] = 1
+
+def plan_link(src, dst, api):
+    """
+    Plan what linkfile would do to dst.  It is left alone if it is
+    already src, the link cache's copy of src or identical to it.
+    """
+    if not os.path.lexists(dst):
+        plan_file(api, dst, "added")
+        return
+    try:
+        if os.path.samefile(src, dst):
+            return
+        lcache = os.path.join(os.path.dirname(os.path.dirname(dst)),'.link_cache')
+        if os.path.isdir(lcache):
+            cached = os.path.join(lcache, hashfile(src, lcache=lcache, api=api))
+            if os.path.exists(cached) and os.path.samefile(cached, dst):
+                return
+        if os.path.getsize(src) == os.path.getsize(dst) and hashfile(src) == hashfile(dst):
+            return
+    except (IOError, OSError):
+        pass
+    plan_file(api, dst, "changed")
+
+def file_fingerprint(path):
+    """
+    A digest of the contents of a file, or None if it cannot be read.
+    """
+    try:
+        fd = open(path)
+        data = fd.read()
+        fd.close()
+    except IOError:
+        return None
+    return md5(data).hexdigest()
+
+def write_if_changed(filename, data, api=None):
+    """
+    Write data to filename, unless the file already holds exactly that
+    data, in which case it is left alone (keeping its mtime).  Changed
+    files are replaced by rename, so readers such as a TFTP server never
+    see them half written.  Returns True if the file was written.
+    """
+    if type(data) == unicode:
+        data = data.encode("utf-8")
+    note_output(api, filename)
+    path = filename
+    filename = staged_path(api, filename)
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        # doesn't exist yet
+        size = None
+    try:
+        if size == len(data):
+            fd = open(filename)
+            old = fd.read()
+            fd.close()
+            if old == data:
+                return False
+    except IOError:
+        pass
+    if dry_run(api) is not None:
+        if size is None:
+            plan_file(api, path, "added")
+        else:
+            plan_file(api, path, "changed")
+        return True
+    # a unique temporary file, so that two writers of the same file
+    # (say a sync and a lite sync) cannot clobber each other's copy
+    (handle, tmp) = tempfile.mkstemp(prefix=".%s." % os.path.basename(filename), suffix=".tmp", dir=os.path.dirname(filename))
+    try:
+        fd = os.fdopen(handle, "w")
+        fd.write(data)
+        fd.close()
+        # mkstemp makes the file private, give it the mode open() would
+        if size is None:
+            mask = os.umask(0)
+            os.umask(mask)
+            os.chmod(tmp, 0666 & ~mask)
+        else:
+            os.chmod(tmp, os.stat(filename).st_mode & 07777)
+        os.rename(tmp, filename)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    count_stat(api, "files_written")
+    count_stat(api, "bytes_written", len(data))
+    return True
+
 def linkfile(src, dst, symlink_ok=False, api=None, logger=None):
     """
     Attempt to create a link dst that points to src.  Because file
@@ -1071,18 +1368,29 @@ def linkfile(src, dst, symlink_ok=False, api=None, logger=None):
     copyfile()
     """
 
+    note_output(api, dst)
+
     if api is None:
         # FIXME: this really should not be a keyword
         # arg
         raise "Internal error: API handle is required"
 
+    if dry_run(api) is not None:
+        plan_link(src, dst, api)
+        return True
+
+    # cachefile and copyfile find the staged path themselves
+    live = dst
+    dst = staged_path(api, dst)
+
     is_remote = is_remote_file(src)
+    safe = is_safe_to_hardlink(src,dst,api)
 
     if os.path.exists(dst):
         # if the destination exists, is it right in terms of accuracy
         # and context?
         if os.path.samefile(src, dst):
-            if not is_safe_to_hardlink(src,dst,api):
+            if not safe:
                 # may have to remove old hardlinks for SELinux reasons
                 # as previous implementations were not complete
                 if logger is not None:
@@ -1096,13 +1404,14 @@ def linkfile(src, dst, symlink_ok=False, api=None, logger=None):
                logger.info("removing: %s" % dst)
             os.remove(dst)
 
-    if is_safe_to_hardlink(src,dst,api):
+    if safe:
         # we can try a hardlink if the destination isn't to NFS or Samba
         # this will help save space and sync time.
         try:
             if logger is not None:
                 logger.info("trying hardlink %s -> %s" % (src,dst))
             rc = os.link(src, dst)
+            count_stat(api, "files_written")
             return rc
         except (IOError, OSError):
             # hardlink across devices, or link already exists
@@ -1117,24 +1426,35 @@ def linkfile(src, dst, symlink_ok=False, api=None, logger=None):
             if logger is not None:
                 logger.info("trying symlink %s -> %s" % (src,dst))
             rc = os.symlink(src, dst)
+            count_stat(api, "files_written")
             return rc
         except (IOError, OSError):
             pass
 
     try:
-        return cachefile(src,dst,api=api,logger=logger)
+        return cachefile(src,live,api=api,logger=logger)
     except (IOError, OSError):
         pass
 
     # we couldn't hardlink and we couldn't symlink so we must copy
 
-    return copyfile(src, dst, api=api, logger=logger)
+    return copyfile(src, live, api=api, logger=logger)
 
 def copyfile(src,dst,api=None,logger=None):
+    note_output(api, dst)
+    if dry_run(api) is not None:
+        if not os.path.exists(dst):
+            plan_file(api, dst, "added")
+        elif file_fingerprint(src) != file_fingerprint(dst):
+            plan_file(api, dst, "changed")
+        return True
+    dst = staged_path(api, dst)
     try:
         if logger is not None:
            logger.info("copying: %s -> %s" % (src,dst))
         rc = shutil.copyfile(src,dst)
+        count_stat(api, "files_written")
+        count_stat(api, "bytes_written", os.path.getsize(dst))
         return rc
     except:
         if not os.access(src,os.R_OK):
@@ -1176,7 +1496,12 @@ def copyfile_pattern(pattern,dst,require_match=True,symlink_ok=False,api=None,lo
         dst1 = os.path.join(dst,os.path.basename(file))
         linkfile(file,dst1,symlink_ok=symlink_ok,api=api,logger=logger)
 
-def rmfile(path,logger=None):
+def rmfile(path,logger=None,api=None):
+    if dry_run(api) is not None:
+        if os.path.lexists(path):
+            plan_file(api, path, "removed")
+        return True
+    path = staged_path(api, path)
     try:
         if logger is not None:
            logger.info("removing: %s" % path)
@@ -1189,15 +1514,22 @@ def rmfile(path,logger=None):
             raise CX(_("Error deleting %s") % path)
         return True
 
-def rmtree_contents(path,logger=None):
+def rmtree_contents(path,logger=None,api=None):
+   path = staged_path(api, path)
    what_to_delete = glob.glob("%s/*" % path)
    for x in what_to_delete:
-       rmtree(x,logger=logger)
+       rmtree(x,logger=logger,api=api)
 
-def rmtree(path,logger=None):
+def rmtree(path,logger=None,api=None):
+   if dry_run(api) is not None and not os.path.isfile(path):
+       for (root, dirs, files) in os.walk(path):
+           for f in files + [ d for d in dirs if os.path.islink(os.path.join(root, d)) ]:
+               plan_file(api, os.path.join(root, f), "removed")
+       return True
+   path = staged_path(api, path)
    try:
        if os.path.isfile(path):
-           return rmfile(path,logger=logger)
+           return rmfile(path,logger=logger,api=api)
        else:
            if logger is not None:
                logger.info("removing: %s" % path)
@@ -1209,7 +1541,10 @@ def rmtree(path,logger=None):
            raise CX(_("Error deleting %s") % path)
        return True
 
-def mkdir(path,mode=0755,logger=None):
+def mkdir(path,mode=0755,logger=None,api=None):
+   if dry_run(api) is not None:
+       return
+   path = staged_path(api, path)
    try:
        if logger is not None:
           logger.info("mkdir: %s" % path)
@@ -1496,8 +1831,17 @@ import random
 
 # We cache the contents of /etc/mtab ... the following variables are used 
 # to keep our cache in sync
-mtab_mtime = None
+mtab_signature = None
+mtab_checked = 0
 mtab_map = []
+# mount point -> device, from mtab_map
+mount_devices = {}
+# directory -> (device, mount point), as found by get_file_device_path
+dir_devices = {}
+
+# when the mount table is in /proc, which gives no mtime to go by,
+# it is read again to look for changes at most this often (seconds)
+MTAB_RECHECK = 1
 
 class MntEntObj(object):
     mnt_fsname = None #* name of mounted file system */
@@ -1520,13 +1864,32 @@ class MntEntObj(object):
                                       self.mnt_opts, self.mnt_freq, self.mnt_passno)
 
 def get_mtab(mtab="/etc/mtab", vfstype=None):
-    global mtab_mtime, mtab_map
+    global mtab_signature, mtab_checked, mtab_map, mount_devices, dir_devices
 
+    if not os.path.exists(mtab):
+        mtab = "/proc/self/mounts"
     mtab_stat = os.stat(mtab)
-    if mtab_stat.st_mtime != mtab_mtime:
+    data = None
+    if mtab_stat.st_size > 0:
+        signature = (mtab, mtab_stat.st_mtime, mtab_stat.st_size)
+    elif time.time() - mtab_checked < MTAB_RECHECK:
+        signature = mtab_signature
+    else:
+        # /etc/mtab is often a link to /proc/self/mounts
+        f = open(mtab)
+        data = f.read()
+        f.close()
+        mtab_checked = time.time()
+        signature = (mtab, data)
+
+    if signature != mtab_signature:
         '''cache is stale ... refresh'''
-        mtab_mtime = mtab_stat.st_mtime
-        mtab_map = __cache_mtab__(mtab)
+        mtab_signature = signature
+        mtab_map = __cache_mtab__(mtab, data)
+        mount_devices = {}
+        for ent in mtab_map:
+            mount_devices[ent.mnt_dir] = ent.mnt_fsname
+        dir_devices = {}
 
     # was a specific fstype requested?
     if vfstype:
@@ -1538,12 +1901,13 @@ def get_mtab(mtab="/etc/mtab", vfstype=None):
 
     return mtab_map
 
-def __cache_mtab__(mtab="/etc/mtab"):
-    global mtab_mtime
+def __cache_mtab__(mtab="/etc/mtab", data=None):
+    if data is None:
+        f = open(mtab)
+        data = f.read()
+        f.close()
 
-    f = open(mtab)
-    mtab = [MntEntObj(line) for line in f.read().split('\n') if len(line) > 0]
-    f.close()
+    mtab = [MntEntObj(line) for line in data.split('\n') if len(line) > 0]
 
     return mtab
 
@@ -1560,23 +1924,24 @@ def get_file_device_path(fname):
     # resolve any symlinks
     fname = os.path.realpath(fname)
 
-    # convert mtab to a dict
-    mtab_dict = {}
-    for ent in get_mtab():
-        mtab_dict[ent.mnt_dir] = ent.mnt_fsname
+    # refreshes mount_devices and dir_devices if mounts have changed
+    get_mtab()
 
-    # find a best match
+    # find the longest mount point containing the directory, which
+    # is remembered for other files in it
     fdir = os.path.dirname(fname)
-    match = mtab_dict.has_key(fdir)
-    while not match:
-        fdir = os.path.realpath(os.path.join(fdir, os.path.pardir))
-        match = mtab_dict.has_key(fdir)
+    if not dir_devices.has_key(fdir):
+        mnt_dir = fdir
+        while not mount_devices.has_key(mnt_dir) and mnt_dir != os.path.sep:
+            mnt_dir = os.path.dirname(mnt_dir)
+        dir_devices[fdir] = (mount_devices.get(mnt_dir, ""), mnt_dir)
+    (device, mnt_dir) = dir_devices[fdir]
 
     # construct file path relative to device
-    if fdir != os.path.sep:
-        fname = fname[len(fdir):]
+    if mnt_dir != os.path.sep:
+        fname = fname[len(mnt_dir):]
 
-    return (mtab_dict[fdir], fname)
+    return (device, fname)
 
 def is_remote_file(file):
     (dev, path) = get_file_device_path(file)
@@ -1669,10 +2034,47 @@ def os_system(cmd):
     rc = sub_process.call(cmd, shell=True, close_fds=True)
     return rc
 
+# item classes -> the field defaults stored once on the class, see
+# shared_defaults
+SHARED_DEFAULTS = {}
+
+def shared_defaults(obj, fields):
+    """
+    The fields of obj whose default is the same for every object of
+    its type: not taken from the settings, and not a list or hash that
+    could be changed in place.
+    Those defaults are stored once, as attributes of the class, which
+    old style classes fall back to when an object has no value of its
+    own, so the thousands of fields left at their default (mostly
+    "<<inherit>>") cost nothing per object.
+    """
+    cls = obj.__class__
+    shared = SHARED_DEFAULTS.get(cls, None)
+    if shared is None:
+        shared = {}
+        for elems in fields:
+            k = elems[0]
+            if k.startswith("*") or k.find("widget") != -1:
+                continue
+            val = elems[1]
+            if isinstance(val, basestring):
+                if val.startswith("SETTINGS:"):
+                    continue
+            elif not (val is None or type(val) in [ int, long, float, bool ]):
+                continue
+            if hasattr(cls, k):
+                # a method or class attribute of the same name
+                continue
+            setattr(cls, k, val)
+            shared[k] = val
+        SHARED_DEFAULTS[cls] = shared
+    return shared
+
 def clear_from_fields(obj, fields, is_subobject=False):
     """
     Used by various item_*.py classes for automating datastructure boilerplate.
     """
+    shared = shared_defaults(obj, fields)
     for elems in fields:
         # if elems startswith * it's an interface field and we do not operate on it.
         if elems[0].startswith("*") or elems[0].find("widget") != -1:
@@ -1685,27 +2087,65 @@ def clear_from_fields(obj, fields, is_subobject=False):
            if val.startswith("SETTINGS:"):
                setkey = val.split(":")[-1]
                val = getattr(obj.settings, setkey)
-        setattr(obj, elems[0], val)
+        k = elems[0]
+        if shared.has_key(k) and type(val) == type(shared[k]) and val == shared[k]:
+           # looked up on the class
+           if obj.__dict__.has_key(k):
+               delattr(obj, k)
+        else:
+           setattr(obj, k, val)
 
     if obj.COLLECTION_TYPE == "system":
         obj.interfaces = {}
 
+def compact(data):
+    """
+    Returns a copy of a loaded datastructure that shares memory with
+    all other loaded objects where it can: strings (and hash keys) are
+    interned, so the many copies of profile names, "<<inherit>>",
+    interface field names and the like across thousands of systems are
+    all one string.  ASCII unicode strings, as the json parser returns,
+    become plain strings so they can be interned.
+    """
+    if isinstance(data, basestring):
+        if type(data) == unicode:
+            try:
+                data = data.encode("ascii")
+            except UnicodeError:
+                return data
+        return intern(data)
+    if type(data) == type([]):
+        return [ compact(x) for x in data ]
+    if type(data) == type({}):
+        result = {}
+        for (k, v) in data.iteritems():
+            result[compact(k)] = compact(v)
+        return result
+    return data
+
 def from_datastruct_from_fields(obj, seed_data, fields):
 
+    shared = shared_defaults(obj, fields)
     for elems in fields:
         # we don't have to load interface fields here
         if elems[0].startswith("*") or elems[0].find("widget") != -1:
             continue
         k = elems[0]
         if seed_data.has_key(k):
-            setattr(obj, k, seed_data[k])
+            value = compact(seed_data[k])
+            if shared.has_key(k) and type(value) == type(shared[k]) and value == shared[k]:
+                # left at the default, which the class holds
+                if obj.__dict__.has_key(k):
+                    delattr(obj, k)
+            else:
+                setattr(obj, k, value)
 
     if obj.uid == '':
         obj.uid = obj.config.generate_uid()
 
-    # special handling for interfaces
+    # special handling for interfaces, compact() copies them
     if obj.COLLECTION_TYPE == "system":
-        obj.interfaces = copy.deepcopy(seed_data["interfaces"])
+        obj.interfaces = compact(seed_data["interfaces"])
 
     return obj
 
@@ -1729,9 +2169,11 @@ def to_datastruct_from_fields(obj, fields):
         data = getattr(obj, k)
         ds[k] = data
     # interfaces on systems require somewhat special handling
-    # they are the only exception in Cobbler.
+    # they are the only exception in Cobbler.  System setters never
+    # change them in place (see item_system.py), so they can be shared
+    # rather than copied, but must be treated as read-only.
     if obj.COLLECTION_TYPE == "system":
-        ds["interfaces"] = copy.deepcopy(obj.interfaces)
+        ds["interfaces"] = obj.interfaces
 
     return ds
 
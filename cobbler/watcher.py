@@ -0,0 +1,208 @@
+"""
+Keeps the collections of a long running process, such as cobblerd,
+in step with changes other processes (the CLI, another API user) make
+to /var/lib/cobbler/config, reloading only the objects that changed.
+
+Uses inotify (through pyinotify) when available and otherwise falls
+back to watching /var/lib/cobbler/.mtime and rescanning the catalog
+when it moves.  Only the catalog serializer is supported.
+
+cobblerd is the only process that needs one: the mod_wsgi services
+and the web app get their objects from cobblerd over XMLRPC, and
+refresh() runs before each of those calls is answered.
+
+Copyright 2009, Red Hat, Inc
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301  USA
+"""
+
+import os
+import threading
+
+try:
+    import pyinotify
+    HAS_INOTIFY = True
+except ImportError:
+    HAS_INOTIFY = False
+
+import serializer
+from utils import _
+from cexceptions import *
+
+# in the order they must be loaded, parents before children
+TYPES = [ "distro", "repo", "profile", "image", "system" ]
+
+class Watcher:
+
+    def __init__(self, api, logger=None):
+        """
+        Constructor.  Requires a Cobbler API handle.
+        """
+        self.api      = api
+        self.config   = api._config
+        self.logger   = logger
+        if self.logger is None:
+            self.logger = api.logger
+        self.lock     = threading.Lock()
+        self.pending  = {}
+        self.notifier = None
+        self.snapshot = None
+        self.mtime    = api.last_modified_time()
+        self.storage  = api.get_module_by_name("serializer_catalog")
+
+        if api.use_couch:
+            self.logger.warning("config change watching is not supported with couchdb")
+            self.storage = None
+        elif HAS_INOTIFY:
+            self.__watch()
+        else:
+            self.__scan()
+            serializer.MTIME_LISTENERS.append(self.own_change)
+
+    def __watch(self):
+        """
+        Set up inotify watches on each of the catalog directories,
+        including any shard subdirectories created later.
+        """
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE
+        wm = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(wm, self.__on_event)
+        for ctype in TYPES:
+            path = "/var/lib/cobbler/config/%ss.d" % ctype
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            wm.add_watch(path, mask | pyinotify.IN_CREATE, rec=True, auto_add=True)
+        self.logger.debug("watching for config changes with inotify")
+
+    def own_change(self, previous, mtime):
+        """
+        Called when this process has saved a change.  If nothing else
+        had changed since the last scan there is nothing new on disk to
+        look for, so the next refresh need not rescan.
+        """
+        if previous == self.mtime:
+            self.mtime = mtime
+
+    def __on_event(self, event):
+        if not event.dir:
+            self.__queue(event.pathname)
+
+    def __scan(self):
+        """
+        Compare modification times of all stored objects with the last
+        scan and queue up any that were added, changed or removed.
+        """
+        snapshot = {}
+        for ctype in TYPES:
+            for path in self.storage.catalog_files(ctype):
+                try:
+                    snapshot[path] = os.stat(path).st_mtime
+                except OSError:
+                    # removed underneath us, the next scan will notice
+                    pass
+        if self.snapshot is not None:
+            for (path, mtime) in snapshot.iteritems():
+                if self.snapshot.get(path, None) != mtime:
+                    self.__queue(path)
+            for path in self.snapshot.keys():
+                if not snapshot.has_key(path):
+                    self.__queue(path)
+        self.snapshot = snapshot
+
+    def __queue(self, path):
+        """
+        Note that the object stored at path needs reloading.
+        """
+        name = os.path.basename(path)
+        if name.startswith("."):
+            # serializer temp files, the rename into place is what counts
+            return
+        if name.endswith(".json"):
+            name = name[:-5]
+        for part in path.split(os.sep):
+            if part.endswith("s.d") and part[:-3] in TYPES:
+                self.pending[(part[:-3], name)] = 1
+                return
+
+    def refresh(self):
+        """
+        Pick up any changes made since the last call and apply them to
+        the live collections.  Returns the number of objects reloaded or
+        removed.  Safe to call from multiple threads.
+        """
+        if self.storage is None:
+            return 0
+        self.lock.acquire()
+        try:
+            if self.notifier is not None:
+                while self.notifier.check_events(timeout=0):
+                    self.notifier.read_events()
+                    self.notifier.process_events()
+            else:
+                mtime = self.api.last_modified_time()
+                if mtime == self.mtime:
+                    return 0
+                self.mtime = mtime
+                self.__scan()
+
+            pending = self.pending.keys()
+            self.pending = {}
+            pending.sort(lambda a, b: cmp(TYPES.index(a[0]), TYPES.index(b[0])))
+            changed = 0
+            for (ctype, name) in pending:
+                if self.__reload(ctype, name):
+                    changed = changed + 1
+            if changed > 0:
+                self.logger.debug("reloaded %s changed objects" % changed)
+                # the cached /etc/ethers and hosts lines and PXE menu
+                # entries may describe the objects as they were
+                self.api.dnsmasq_tables = None
+                self.api.pxe_menu_fragments = {}
+            return changed
+        finally:
+            self.lock.release()
+
+    def __reload(self, ctype, name):
+        """
+        Bring one object in line with what is on disk.
+        """
+        collection = self.config.get_items(ctype)
+        old = collection.get(name)
+        datastruct = self.api.deserialize_item_raw(ctype, name)
+
+        if datastruct is None:
+            if old is None:
+                return False
+            collection.forget(name)
+            self.logger.debug("removed %s %s" % (ctype, name))
+            return True
+
+        if old is not None and old.mtime == datastruct.get("mtime", None):
+            # our own write, or one we have already seen
+            return False
+
+        item = collection.factory_produce(self.config, datastruct)
+        try:
+            item.check_if_valid()
+        except CX:
+            self.logger.warning(_("invalid %s %s on disk, not reloaded") % (ctype, name))
+            return False
+        if old is not None:
+            collection.forget(name)
+            item.children = old.children
+        collection.add(item)
+        self.logger.debug("reloaded %s %s" % (ctype, name))
+        return True
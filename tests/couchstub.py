@@ -0,0 +1,148 @@
+# test script for the couchdb serializer, run against a minimal in-memory
+# stand-in for the couchdb HTTP API so no couchdb install is needed.
+# reports how many requests each serializer operation makes.
+
+import BaseHTTPServer
+import threading
+import simplejson
+import urlparse
+
+import cobbler.api as capi
+import cobbler.modules.serializer_couch as serializer_couch
+
+DBS = {}
+REQUESTS = []
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, code, data):
+        body = simplejson.dumps(data)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def parse(self):
+        REQUESTS.append((self.command, self.path))
+        url = urlparse.urlparse(self.path)
+        parts = url[2].strip("/").split("/", 1)
+        if len(parts) == 1:
+            parts.append("")
+        query = dict(urlparse.parse_qsl(url[4]))
+        body = None
+        length = int(self.headers.get("Content-Length", 0))
+        if length > 0:
+            body = simplejson.loads(self.rfile.read(length))
+        return (parts[0], parts[1], query, body)
+
+    def save(self, db, doc):
+        old = DBS[db].get(doc["_id"], None)
+        if old is not None and old["_rev"] != doc.get("_rev", None):
+            return { "id" : doc["_id"], "error" : "conflict", "reason" : "Document update conflict." }
+        if old is None:
+            rev = 1
+        else:
+            rev = int(old["_rev"].split("-")[0]) + 1
+        doc["_rev"] = "%d-stub" % rev
+        DBS[db][doc["_id"]] = doc
+        return { "ok" : True, "id" : doc["_id"], "rev" : doc["_rev"] }
+
+    def do_GET(self):
+        (db, doc, query, body) = self.parse()
+        if not DBS.has_key(db):
+            return self.reply(404, { "error" : "not_found", "reason" : "Missing" })
+        if doc == "_all_docs":
+            rows = []
+            for (key, value) in DBS[db].items():
+                row = { "id" : key, "key" : key, "value" : { "rev" : value["_rev"] } }
+                if query.get("include_docs", "") == "true":
+                    row["doc"] = value
+                rows.append(row)
+            return self.reply(200, { "total_rows" : len(rows), "rows" : rows })
+        if not DBS[db].has_key(doc):
+            return self.reply(404, { "error" : "not_found", "reason" : "missing" })
+        self.reply(200, DBS[db][doc])
+
+    def do_PUT(self):
+        (db, doc, query, body) = self.parse()
+        if doc == "":
+            if DBS.has_key(db):
+                return self.reply(412, { "error" : "file_exists" })
+            DBS[db] = {}
+            return self.reply(201, { "ok" : True })
+        body["_id"] = doc
+        result = self.save(db, body)
+        if result.has_key("error"):
+            return self.reply(409, result)
+        self.reply(201, result)
+
+    def do_POST(self):
+        (db, doc, query, body) = self.parse()
+        results = []
+        for x in body["docs"]:
+            results.append(self.save(db, x))
+        self.reply(201, results)
+
+    def do_DELETE(self):
+        (db, doc, query, body) = self.parse()
+        old = DBS[db].get(doc, None)
+        if old is None:
+            return self.reply(404, { "error" : "not_found", "reason" : "missing" })
+        if old["_rev"] != query.get("rev", None):
+            return self.reply(409, { "error" : "conflict", "reason" : "Document update conflict." })
+        del DBS[db][doc]
+        self.reply(200, { "ok" : True, "id" : doc })
+
+server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), StubHandler)
+thread = threading.Thread(target=server.serve_forever)
+thread.setDaemon(True)
+thread.start()
+
+serializer_couch.couchdb.port = server.server_address[1]
+
+api = capi.BootAPI()
+systems = api.systems()
+print "sample size is %s systems" % len(systems)
+
+def phase(name, fn):
+    del REQUESTS[:]
+    fn()
+    print "%s: %s requests" % (name, len(REQUESTS))
+
+phase("bulk save", lambda: serializer_couch.serialize(systems))
+assert len(DBS["system"]) == len(systems)
+
+phase("bulk save again", lambda: serializer_couch.serialize(systems))
+
+serializer_couch.REVS.clear()
+results = []
+phase("load all", lambda: results.extend(serializer_couch.deserialize_raw("system")))
+assert len(results) == len(systems)
+assert len(serializer_couch.REVS) == len(systems)
+assert len(REQUESTS) == 1
+
+for x in systems:
+    phase("save one", lambda: serializer_couch.serialize_item(systems, x))
+    assert len(REQUESTS) == 1
+
+    # simulate another server updating the document behind our back
+    DBS["system"][x.name]["_rev"] = "99-stub"
+    phase("save one after conflict", lambda: serializer_couch.serialize_item(systems, x))
+    assert DBS["system"][x.name]["_rev"] == "100-stub"
+
+    phase("delete one", lambda: serializer_couch.serialize_delete(systems, x))
+    assert not DBS["system"].has_key(x.name)
+    assert len(REQUESTS) == 1
+    break
+
+print "connections reused: %s" % (serializer_couch.couchdb.conn is not None)
+
+# the stub serves one connection at a time, hang up before stopping it
+serializer_couch.couchdb.close()
+server.shutdown()
@@ -7,6 +7,7 @@ import cobbler.api as capi
 import time
 import sys
 import random
+from sys import getsizeof
 
 N = 500
 print "sample size is %s" % N
@@ -68,3 +69,72 @@ for mode in [ "on", "off" ]:
 
 
 
+for mode in [ "none", "item", "batch" ]:
+
+   api.settings().serializer_fsync = mode
+
+   print "Running serializer benchmarks (serializer_fsync=%s)" % (mode)
+   time1 = time.time()
+   for x in xrange(0,N):
+       sys = api.systems().find("autotest-%s" % x)
+       api.systems().add(sys,save=True,with_sync=False,with_triggers=False)
+   time2 = time.time()
+   print "ELAPSED (per item saves): %s seconds" % (time2 - time1)
+
+   time1 = time.time()
+   api.serialize()
+   time2 = time.time()
+   print "ELAPSED (full save): %s seconds" % (time2 - time1)
+
+
+print "Running search benchmarks"
+for criteria in [ { "name" : "autotest-*" }, { "mac_address" : "00:16:3e:*" }, { "name" : "autotest-1*", "netboot_enabled" : "true" } ]:
+   time1 = time.time()
+   for x in xrange(0,10):
+       found = api.find_items("system", criteria)
+   time2 = time.time()
+   print "ELAPSED (%s, %s matches): %s seconds" % (criteria, len(found), (time2 - time1) / 10)
+
+
+def object_size(data, seen):
+   """
+   Bytes used by a loaded value, counting each distinct object once
+   when seen is a dict, or every reference separately when it is None.
+   """
+   if seen is not None:
+       if seen.has_key(id(data)):
+           return 0
+       seen[id(data)] = 1
+   size = getsizeof(data)
+   if type(data) == type([]):
+       for x in data:
+           size = size + object_size(x, seen)
+   elif type(data) == type({}):
+       for (k, v) in data.iteritems():
+           size = size + object_size(k, seen) + object_size(v, seen)
+   return size
+
+print "Measuring memory used by loaded systems"
+api.deserialize()
+systems = api.systems()
+shared = {}
+used = 0
+unshared = 0
+for obj in systems:
+   # fields left at a shared default live on the class, not in here
+   used = used + getsizeof(obj.__dict__)
+   unshared = unshared + getsizeof(obj.__dict__)
+   values = [ obj.interfaces ]
+   for x in obj.get_fields():
+       if not x[0].startswith("*") and x[0].find("widget") == -1:
+           values.append(getattr(obj, x[0]))
+   for v in values:
+       used = used + object_size(v, shared)
+       unshared = unshared + object_size(v, None)
+count = max(len(systems), 1)
+print "MEMORY: %s bytes per system (%s bytes if nothing were shared)" % (used / count, unshared / count)
+
+
+import cobbler.serializer as serializer
+stats = serializer.lock_stats()
+print "LOCKS: %s shared, %s exclusive, %s seconds waiting (max %s)" % (stats["shared"], stats["exclusive"], stats["wait_time"], stats["max_wait_time"])